@@ -0,0 +1,95 @@
+import mmap
+from bisect import bisect_left
+
+import numpy as np
+
+from compact_catalog import column_texts
+from fuzzy_index import FUZZY_FIELDS, WORD_RE
+
+# Ключи автодополнения — срезы одного utf-8 буфера (bytes или mmap); bisect сравнивает их как bytes,
+# порядок байт utf-8 совпадает с порядком строк
+class _Keys:
+    def __init__(self, data, offsets: np.ndarray):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return self._data[int(self._offsets[i]):int(self._offsets[i + 1])]
+
+
+# Автодополнение названий для inline-режима бота.
+# Ключи — нормализованное полное название и каждый его "хвост" с очередного слова
+# ("dior homme intense", "homme intense", "intense"), отсортированные для bisect.
+# Префикс запроса даёт непрерывный диапазон ключей, в нём берём топ по числу отзывов.
+# Все ключи лежат одним буфером байт, а не строками Python — индекс можно сохранить в файлы
+# (to_arrays) и открыть через mmap сразу в нескольких процессах бота (bot_workers.py).
+class Autocomplete:
+    def __init__(self, texts: list, ratings=None, arrays: dict = None):
+        if arrays is None:
+            arrays = self._build(texts, ratings)
+        data = arrays["key_data"]
+        self._data = data if isinstance(data, (bytes, mmap.mmap)) else data.tobytes()
+        self._key_offsets = arrays["key_offsets"]
+        self._keys = _Keys(self._data, self._key_offsets)
+        self._rows = arrays["rows"]
+        self._key_ratings = arrays["key_ratings"]
+
+    @staticmethod
+    def _build(texts: list, ratings) -> dict:
+        pairs = []
+        for row, text in enumerate(texts):
+            words = WORD_RE.findall(text.lower())
+            for i in range(len(words)):
+                pairs.append((" ".join(words[i:]), row))
+        pairs.sort()
+        encoded = [key.encode("utf-8") for key, _ in pairs]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(key) for key in encoded], out=offsets[1:])
+        rows = np.fromiter((row for _, row in pairs), dtype=np.int64, count=len(pairs))
+        ratings = np.zeros(len(texts)) if ratings is None else np.nan_to_num(np.asarray(ratings, dtype=np.float64))
+        return {
+            "key_data": b"".join(encoded),
+            "key_offsets": offsets,
+            "rows": rows,
+            "key_ratings": ratings[rows] if len(pairs) else np.zeros(0),
+        }
+
+    @classmethod
+    def from_frame(cls, df, fields=FUZZY_FIELDS, arrays: dict = None):
+        if arrays is not None:
+            return cls(None, arrays=arrays)
+        cols = [column_texts(df, f) for f in fields if f in df.columns and f != "Perfumers"]
+        texts = [" ".join(parts) for parts in zip(*cols)] if cols else [""] * len(df)
+        ratings = np.asarray(df["Rating Count"]) if "Rating Count" in df.columns else None
+        return cls(texts, ratings)
+
+    # Массивы индекса для сохранения на диск
+    def to_arrays(self) -> dict:
+        return {
+            "key_data": np.frombuffer(self._data, dtype=np.uint8),
+            "key_offsets": self._key_offsets,
+            "rows": self._rows,
+            "key_ratings": self._key_ratings,
+        }
+
+    # Позиции строк, чьё название (или его хвост) начинается с prefix, по убыванию числа отзывов
+    def complete(self, prefix: str, limit: int = 10) -> np.ndarray:
+        prefix = " ".join(WORD_RE.findall(prefix.lower())).encode("utf-8")
+        if not prefix:
+            return np.empty(0, dtype=np.int64)
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix + "\U0010ffff".encode("utf-8"), lo)
+        if lo == hi:
+            return np.empty(0, dtype=np.int64)
+
+        # Одна строка может попасть в диапазон несколькими хвостами — берём с запасом и убираем повторы
+        ratings = self._key_ratings[lo:hi]
+        take = min(hi - lo, limit * 4)
+        top = np.argpartition(-ratings, take - 1)[:take] if take < hi - lo else np.arange(hi - lo)
+        top = top[np.argsort(-ratings[top], kind="stable")]
+        rows = self._rows[lo:hi][top]
+        _, first = np.unique(rows, return_index=True)
+        return rows[np.sort(first)][:limit]
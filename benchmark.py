@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+# Нагрузочный замер на синтетических базах: python benchmark.py --sizes 70000 500000 2000000
+# Для каждого размера генерируются две базы — в формате fra_perfumes.csv и маленькой
+# perfume_base(2).csv, и каждая замеряется в отдельном процессе (чтобы пиковый RSS был честным).
+# Результат — JSON с p50/p99, пропускной способностью и пиковым RSS; сравнивать между коммитами.
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SIZES = (70_000, 500_000, 2_000_000)
+SCHEMAS = ("fragrantica", "small")
+CHUNK_ROWS = 100_000
+
+BRANDS = ["Dior", "Chanel", "Versace", "Mancera", "Givenchy", "Lattafa", "Armani", "Guerlain", "Tom Ford",
+          "Creed", "Amouage", "Montale", "Kilian", "Byredo", "Le Labo", "Xerjoff", "Zara", "Hermes",
+          "Prada", "Gucci", "Paco Rabanne", "Jo Malone", "Maison Margiela", "Nishane", "Kayali"]
+WORDS = ["homme", "intense", "blue", "noir", "rose", "oud", "vanilla", "night", "sport", "eau", "royal",
+         "velvet", "amber", "musk", "black", "gold", "wood", "absolu", "elixir", "garden", "leather",
+         "riviera", "stronger", "reserve", "pure", "aqua", "santal", "tabac", "cherry", "imperial"]
+ACCORDS = ["woody", "amber", "vanilla", "citrus", "floral", "powdery", "musky", "fresh spicy", "warm spicy",
+           "aromatic", "sweet", "fruity", "leather", "oud", "aquatic", "marine", "green", "gourmand",
+           "tobacco", "earthy", "smoky", "rose", "patchouli", "lavender", "coconut", "salty", "iris"]
+NOTES = ["bergamot", "lemon", "pepper", "jasmine", "rose", "iris", "cedar", "sandalwood", "musk", "tonka",
+         "caramel", "saffron", "ginger", "tuberose", "honey", "vetiver", "fig", "basil", "coumarin",
+         "coffee", "cacao", "cardamom", "blackcurrant", "pine", "smoke", "cinnamon", "clove", "neroli",
+         "labdanum", "myrrh", "apple", "apricot", "salt", "violet", "magnolia", "orange blossom"]
+PERFUMERS = ["Francis Kurkdjian", "Alberto Morillas", "Dominique Ropion", "Olivier Cresp", "Quentin Bisch",
+             "Sophie Labbe", "Jacques Cavallier", "Christine Nagel", "Olivier Polge", "Thierry Wasser"]
+GENDERS = ["for men", "for women", "for women and men"]
+SMALL_NOTES = ["Апельсин", "Тиаре", "Морская соль", "Ваниль", "Бобы тонка", "Ирис", "Груша", "Кедр",
+               "Розовый перец", "Тоффи", "Яблоко", "Лаванда", "Бергамот", "Виски", "Ликер", "сахар", "пачули"]
+SMALL_GENDERS = ["men", "women", "unisex"]
+SEASONS = ["summer", "winter, autumn", "spring, summer", "all-purpose", "winter"]
+
+
+def _pick(rng, values, size):
+    return np.asarray(values, dtype=object)[rng.integers(0, len(values), size)]
+
+
+def _join(rng, values, rows, low, high):
+    counts = rng.integers(low, high + 1, rows)
+    return [", ".join(_pick(rng, values, n)) for n in counts]
+
+
+def _fragrantica_chunk(rng, start, rows) -> pd.DataFrame:
+    brands = _pick(rng, BRANDS, rows)
+    genders = _pick(rng, GENDERS, rows)
+    titles = [f"{a.title()} {b.title()} {start + i}" for i, (a, b) in
+              enumerate(zip(_pick(rng, WORDS, rows), _pick(rng, WORDS, rows)))]
+    accords = _join(rng, ACCORDS, rows, 3, 6)
+    top, base = _join(rng, NOTES, rows, 2, 3), _join(rng, NOTES, rows, 2, 4)
+    return pd.DataFrame({
+        "Name": [f"{t} {b} {g}" for t, b, g in zip(titles, brands, genders)],
+        "Main Accords": accords,
+        "Description": [f"{t} by {b} is a {a.split(',')[0]} fragrance {g}. Top notes are {n1}; base notes are {n2}."
+                        for t, b, a, g, n1, n2 in zip(titles, brands, accords, genders, top, base)],
+        "Perfumers": _join(rng, PERFUMERS, rows, 1, 2),
+        "Rating Value": np.round(rng.uniform(2.5, 4.8, rows), 2),
+        "Rating Count": rng.integers(1, 30_000, rows),
+        "Gender": genders,
+    })
+
+
+def _small_chunk(rng, start, rows) -> pd.DataFrame:
+    return pd.DataFrame({
+        "name": [f"{a.title()} {start + i}" for i, a in enumerate(_pick(rng, WORDS, rows))],
+        "brand": _pick(rng, BRANDS, rows),
+        "notes": _join(rng, SMALL_NOTES, rows, 3, 5),
+        "gender": _pick(rng, SMALL_GENDERS, rows),
+        "season": _pick(rng, SEASONS, rows),
+    })
+
+
+# Синтетическая база нужного размера (пишется по частям, чтобы не держать её целиком в памяти)
+def generate_catalog(path: str, rows: int, schema: str = "fragrantica", seed: int = 0) -> str:
+    make_chunk = _fragrantica_chunk if schema == "fragrantica" else _small_chunk
+    rng = np.random.default_rng(seed)
+    tmp_path = path + ".tmp"
+    for start in range(0, rows, CHUNK_ROWS):
+        chunk = make_chunk(rng, start, min(CHUNK_ROWS, rows - start))
+        chunk.to_csv(tmp_path, mode="w" if start == 0 else "a", header=start == 0, index=False, encoding="utf-8")
+    os.replace(tmp_path, path)
+    return path
+
+
+# Время каждого вызова -> p50/p99 в мс и вызовов в секунду
+def measure(func, calls: list) -> dict:
+    times = []
+    for args in calls:
+        started = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - started)
+    times = np.asarray(times)
+    return {
+        "calls": len(times),
+        "p50_ms": round(float(np.percentile(times, 50)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(times, 99)) * 1000, 3),
+        "throughput_per_s": round(len(times) / times.sum(), 1) if times.sum() else None,
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 if sys.platform != "darwin" else peak / 2 ** 20, 1)
+
+
+def _bench_fragrantica(queries: int, rng) -> dict:
+    import layering_app
+    from catalog_cache import build_snapshot
+    from compact_catalog import build_store
+
+    layering_app.console.quiet = True
+    results = {}
+    with mock.patch.object(layering_app.Prompt, "ask", return_value="2"):
+        results["load_base (csv)"] = measure(layering_app.load_base, [()])
+        build_snapshot("fra_perfumes.csv")
+        results["load_base (snapshot)"] = measure(layering_app.load_base, [()])
+        build_store("fra_perfumes.csv")
+        results["load_base (compact)"] = measure(layering_app.load_base, [()])
+        catalog, index = layering_app.load_base()
+
+    words = [w.lower() for w in BRANDS + WORDS + ACCORDS + PERFUMERS] + ["missing perfume"]
+    results["search_perfumes"] = measure(layering_app.search_perfumes,
+                                         [(catalog, q, index) for q in _pick(rng, words, queries)])
+
+    rows = rng.integers(0, len(catalog), (queries, 2))
+    pairs = [([catalog.row(a), catalog.row(b)],) for a, b in rows]
+    layering_app.analyze_layering(pairs[0][0])  # первая загрузка правил — не в замере
+    results["analyze_layering"] = measure(layering_app.analyze_layering, pairs)
+
+    # пакетный режим (--batch): тот же анализ по маскам ароматов
+    from layering_analysis import BatchAnalyzer
+    batch = BatchAnalyzer(catalog, index, layering_app.rules_file.get() or layering_app.get_fallback_rules())
+    results["analyze_batch"] = measure(batch.analyze, [([int(a), int(b)],) for a, b in rows])
+    return results
+
+
+def _bench_small(queries: int, rng) -> dict:
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location("perfume_finder", os.path.join(REPO_DIR, "perfume_finder (reworked).py"))
+    finder = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(finder)
+
+    results = {"base_load": measure(finder.base_load, [("perfume_base(2).csv",)])}
+    df = finder.base_load("perfume_base(2).csv")
+    finder.get_aspect_index(df)  # индекс строится при первом поиске — замеряем отдельно
+    results["aspect_index_build"] = measure(finder.AspectIndex, [(df,)])
+
+    values = {
+        "notes": [n.lower() for n in SMALL_NOTES],
+        "brand": [b.lower() for b in BRANDS],
+        "gender": SMALL_GENDERS,
+        "season": ["summer", "winter", "autumn", "spring", "all-purpose"],
+    }
+    for aspect, func in (("notes", finder.search_via_notes), ("brand", finder.search_via_brand),
+                         ("gender", finder.search_via_gender), ("season", finder.search_via_season)):
+        results[func.__name__] = measure(func, [(df, q) for q in _pick(rng, values[aspect], queries)])
+    combined = [f"notes={a},{b} & season={s} & gender={g}" for a, b, s, g in
+                zip(*(_pick(rng, values[k], queries) for k in ("notes", "notes", "season", "gender")))]
+    results["search_combined"] = measure(finder.search_combined, [(df, q) for q in combined])
+    return results
+
+
+# Замер одной базы (запускается в отдельном процессе из run_all)
+def run_child(data_dir: str, schema: str, queries: int, seed: int, result_path: str):
+    os.chdir(data_dir)  # load_base ищет базу и правила в текущей папке, лог тоже пишется сюда
+    sys.path.insert(0, REPO_DIR)
+    rng = np.random.default_rng(seed)
+    bench = _bench_fragrantica if schema == "fragrantica" else _bench_small
+    operations = bench(queries, rng)
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump({"operations": operations, "peak_rss_mb": peak_rss_mb()}, f)
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(sizes, schemas, data_root: str, queries: int, seed: int, out: str) -> dict:
+    report = {"commit": _commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "queries": queries, "results": []}
+    for rows in sizes:
+        for schema in schemas:
+            data_dir = os.path.join(data_root, f"{schema}_{rows}")
+            os.makedirs(data_dir, exist_ok=True)
+            csv_path = os.path.join(data_dir, "fra_perfumes.csv" if schema == "fragrantica" else "perfume_base(2).csv")
+            if not os.path.exists(csv_path):
+                started = time.perf_counter()
+                generate_catalog(csv_path, rows, schema, seed)
+                print(f"Сгенерирована база {schema} на {rows:,} строк ({time.perf_counter() - started:.1f} с)")
+            shutil.copy(os.path.join(REPO_DIR, "layering_rules.json"), data_dir)
+
+            result_path = os.path.join(data_dir, "result.json")
+            started = time.perf_counter()
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--child", data_dir, "--schema", schema,
+                            "--queries", str(queries), "--seed", str(seed), "--result", result_path], check=True)
+            with open(result_path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+            report["results"].append({"schema": schema, "rows": rows, **result})
+            print(f"{schema} {rows:,}: {time.perf_counter() - started:.1f} с, пиковый RSS {result['peak_rss_mb']} МБ")
+            for name, stats in result["operations"].items():
+                print(f"  {name:<22} p50 {stats['p50_ms']:>10} мс  p99 {stats['p99_ms']:>10} мс  "
+                      f"{stats['throughput_per_s']} в с")
+
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {out}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замер скорости на синтетических базах")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--schemas", nargs="+", choices=SCHEMAS, default=list(SCHEMAS))
+    parser.add_argument("--data-dir", default="benchmark_data")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--schema", choices=SCHEMAS, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.schema, args.queries, args.seed, args.result)
+    else:
+        run_all(args.sizes, args.schemas, os.path.abspath(args.data_dir), args.queries, args.seed, args.out)
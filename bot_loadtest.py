@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+from aiohttp import ClientSession, web
+
+from benchmark import BRANDS, WORDS, generate_catalog
+
+# Сквозной замер бота: настоящий telegram_bot.py в отдельном процессе против локального фейкового
+# Telegram Bot API (TELEGRAM_API_URL). Виртуальные пользователи по очереди нажимают «Поиск аромата»
+# и отправляют запрос, дожидаясь ответа бота на каждое обновление. Обновления доставляются
+# через getUpdates (polling) или POST на webhook бота — так сравниваются два режима:
+# python bot_loadtest.py --mode polling webhook --users 50 --rounds 20 --rows 70000
+# --workers 1 2 4 — то же для bot_workers.py с разным числом воркеров (0 — обычный telegram_bot.py);
+# в результатах и память всех процессов бота (сумма PSS).
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Perfume Layering Bot", "username": "perfume_layering_bot"}
+# Методы, ответ на которые считается ответом бота на обновление пользователя
+REPLY_METHODS = {"sendMessage", "editMessageText"}
+
+
+# Фейковый Bot API: отдаёт обновления через getUpdates, на sendMessage/editMessageText отвечает
+# сообщением и будит пользователя, который ждёт ответа в этом чате; остальные методы — True
+class FakeTelegramAPI:
+    def __init__(self):
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._waiters = {}  # chat_id -> Future ответа бота
+        self._message_id = 0
+        self.calls = {}
+        self.polling_started = asyncio.Event()
+
+    def push_update(self, update: dict):
+        self._updates.append(update)
+        self._new_updates.set()
+
+    def expect_reply(self, chat_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id] = future
+        return future
+
+    async def _handle(self, request: web.Request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post())
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(int(params.get("offset", 0)), float(params.get("timeout", 0))))
+        if method in REPLY_METHODS:
+            chat_id = int(params["chat_id"])
+            future = self._waiters.pop(chat_id, None)
+            if future is not None and not future.done():
+                future.set_result(time.perf_counter())
+            self._message_id += 1
+            return self._ok({"message_id": self._message_id, "date": int(time.time()), "from": BOT_USER,
+                             "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")})
+        return self._ok(True)
+
+    async def _get_updates(self, offset: int, timeout: float) -> list:
+        self.polling_started.set()
+        # подтверждённые (update_id < offset) выбрасываем
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:100]
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port: int):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+
+def _callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": _user(user_id), "chat_instance": str(user_id), "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "from": BOT_USER,
+                    "chat": {"id": user_id, "type": "private"}, "text": "🌸 Главное меню"},
+    }}
+
+
+def _message_update(update_id: int, user_id: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "from": _user(user_id),
+        "chat": {"id": user_id, "type": "private"}, "text": text,
+    }}
+
+
+# Память бота вместе с воркерами: сумма PSS (общие страницы делятся между процессами, поэтому
+# не считаются дважды), МБ. Только Linux, иначе None
+def _pss_mb(pid: int):
+    pids = [pid]
+    for parent in pids:
+        try:
+            with open(f"/proc/{parent}/task/{parent}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    total = 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/smaps_rollup") as f:
+                total += sum(int(line.split()[1]) for line in f if line.startswith("Pss:"))
+        except OSError:
+            return None
+    return round(total / 1024, 1)
+
+
+async def _wait_healthy(url: str, process, timeout: float = 300):
+    deadline = time.monotonic() + timeout
+    async with ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Бот завершился с кодом {process.returncode}")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} не ответил за {timeout} с")
+
+
+# Один режим: запуск бота, прогрев, замер. Возвращает сводку
+async def run_mode(mode: str, data_dir: str, users: int, rounds: int, api_port: int, webhook_port: int,
+                   seed: int, workers: int = 0) -> dict:
+    api = FakeTelegramAPI()
+    await api.start(api_port)
+    env = dict(os.environ, BOT_TOKEN=TOKEN, TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}",
+               RATE_LIMIT_PER_SEC="0", PYTHONPATH=REPO_DIR)
+    env.pop("WEBHOOK_URL", None)
+    if mode == "webhook":
+        env.update(WEBHOOK_URL="local", WEBHOOK_HOST="127.0.0.1", WEBHOOK_PORT=str(webhook_port),
+                   WEBHOOK_PATH="/webhook", WEBHOOK_SECRET="loadtest")
+    script = "telegram_bot.py"
+    if workers:
+        env["BOT_WORKERS"] = str(workers)
+        script = "bot_workers.py"
+    log_path = os.path.join(data_dir, f"bot_{mode}_{workers}.log" if workers else f"bot_{mode}.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, script)], cwd=data_dir,
+                                   env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if mode == "webhook":
+            await _wait_healthy(f"http://127.0.0.1:{webhook_port}/healthz", process)
+        else:
+            await asyncio.wait_for(api.polling_started.wait(), 300)
+        session = ClientSession()
+        update_ids = iter(range(1, 10**9))
+
+        async def deliver(update: dict, chat_id: int) -> float:
+            reply = api.expect_reply(chat_id)
+            sent = time.perf_counter()
+            if mode == "webhook":
+                async with session.post(f"http://127.0.0.1:{webhook_port}/webhook", json=update,
+                                        headers={"X-Telegram-Bot-Api-Secret-Token": "loadtest"}) as response:
+                    response.raise_for_status()
+            else:
+                api.push_update(update)
+            return await asyncio.wait_for(reply, 30) - sent
+
+        async def user(user_id: int, rng: random.Random, count: int, latencies: list):
+            for _ in range(count):
+                latencies.append(await deliver(_callback_update(next(update_ids), user_id, "search"), user_id))
+                query = rng.choice(BRANDS + WORDS)
+                latencies.append(await deliver(_message_update(next(update_ids), user_id, query), user_id))
+
+        # Прогрев: индексы и кэши, чтобы замер не включал построение
+        await asyncio.gather(*(user(10_000 + i, random.Random(seed + i), 1, []) for i in range(min(users, 5))))
+
+        latencies = []
+        started = time.perf_counter()
+        await asyncio.gather(*(user(1 + i, random.Random(seed * 1000 + i), rounds, latencies) for i in range(users)))
+        elapsed = time.perf_counter() - started
+        pss_mb = _pss_mb(process.pid)
+        await session.close()
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        await api.stop()
+
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "mode": mode,
+        "workers": workers,
+        "users": users,
+        "updates": len(latencies),
+        "seconds": round(elapsed, 2),
+        "updates_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "pss_mb": pss_mb,
+        "bot_exit_code": process.returncode,
+        "api_calls": api.calls,
+    }
+
+
+async def run_all(modes: list, data_dir: str, rows: int, users: int, rounds: int, api_port: int,
+                  webhook_port: int, seed: int, out: str, workers: list = (0,)):
+    os.makedirs(data_dir, exist_ok=True)
+    csv_path = os.path.join(data_dir, "fra_perfumes.csv")
+    if not os.path.exists(csv_path):
+        generate_catalog(csv_path, rows, "fragrantica", seed)
+    shutil.copy(os.path.join(REPO_DIR, "layering_rules.json"), data_dir)
+
+    report = {"rows": rows, "results": []}
+    for mode in modes:
+        for count in workers:
+            result = await run_mode(mode, data_dir, users, rounds, api_port, webhook_port, seed, count)
+            report["results"].append(result)
+            label = f"{mode} x{count}" if count else mode
+            print(f"{label:<12} {result['updates']} обновлений за {result['seconds']} с: "
+                  f"{result['updates_per_s']} в с, p50 {result['p50_ms']} мс, p99 {result['p99_ms']} мс, "
+                  f"память {result['pss_mb']} МБ")
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты: {out}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замер бота против фейкового Telegram API: polling и webhook")
+    parser.add_argument("--mode", nargs="+", choices=("polling", "webhook"), default=["polling", "webhook"])
+    parser.add_argument("--data-dir", default=os.path.join("benchmark_data", "bot"))
+    parser.add_argument("--rows", type=int, default=70_000)
+    parser.add_argument("--users", type=int, default=50, help="одновременных пользователей")
+    parser.add_argument("--rounds", type=int, default=20, help="поисков на пользователя (по 2 обновления)")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-port", type=int, default=8082)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0],
+                        help="воркеров bot_workers.py (0 — один процесс telegram_bot.py)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bot_loadtest_results.json")
+    args = parser.parse_args()
+
+    asyncio.run(run_all(args.mode, os.path.abspath(args.data_dir), args.rows, args.users, args.rounds,
+                        args.api_port, args.webhook_port, args.seed, args.out, args.workers))
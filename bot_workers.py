@@ -0,0 +1,436 @@
+import argparse
+import asyncio
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+
+import telegram_bot
+from catalog_reload import CatalogHolder
+from telegram_bot import Catalog, bot, build_warm_catalog, catalog_executor, dp, metrics
+from webhook import WebhookServer
+
+# Сколько секунд getUpdates ждёт новых обновлений (long polling)
+POLL_TIMEOUT = 30
+# Через сколько секунд родитель перезапускает упавший воркер
+RESTART_DELAY = 1.0
+
+# Несколько процессов бота на одной базе. Родитель один раз собирает базу со всеми индексами,
+# сохраняет её в <база>.shared/ (Catalog.publish) и открывает через mmap, потом, ещё до event loop,
+# форкает процесс-заготовку, из которого форкаются воркеры (и перезапущенные тоже).
+# Массивы базы и индексов — общие страницы файлов для всех процессов, остальное (импорты, мелкие
+# объекты) делится copy-on-write после fork (gc.freeze, чтобы сборщик мусора их не трогал), поэтому
+# каждый следующий воркер добавляет к памяти лишь свои сессии и буферы.
+# Обновления от Telegram (polling или webhook) принимает родитель и раздаёт воркерам по id
+# пользователя — все обновления пользователя попадают в один процесс (его FSM и лимит запросов там).
+# Перезагрузка базы (SIGHUP родителю, CATALOG_WATCH_INTERVAL, /reload в любом воркере) — в родителе:
+# новая версия публикуется в ту же папку, воркеры открывают её заново.
+#   python bot_workers.py --workers 4
+
+
+def shared_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ".shared"
+
+
+# Опубликовать версию базы и открыть её из папки (в памяти процесса остаются только mmap)
+def publish_catalog(catalog: Catalog) -> Catalog:
+    return Catalog.attach(catalog.publish(shared_path(catalog.source[0])))
+
+
+def build_shared_catalog(source_path=None) -> Catalog:
+    return publish_catalog(build_warm_catalog(source_path))
+
+
+# Версия базы в воркере: перезагрузку выполняет родитель, воркер только просит о ней и
+# подменяет current, когда родитель пришлёт новую версию
+class WorkerCatalogs(CatalogHolder):
+    def __init__(self, current, conn):
+        super().__init__(None, current)
+        self._conn = conn
+        self._waiting = []  # futures команд /reload, ждущих ответа родителя
+
+    async def reload(self, reason: str = "") -> bool:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append(future)
+        self._conn.send(("reload", reason))
+        return await future
+
+    def reloaded(self, ok: bool, catalog=None):
+        if catalog is not None:
+            old, self.current = self.current, catalog
+            logging.info(f"База перезагружена: версия {old.version} -> {catalog.version}")
+        for future in self._waiting:
+            if not future.done():
+                future.set_result(ok)
+        self._waiting.clear()
+
+    # Сигналы и слежение за файлом — у родителя
+    def start(self, watch_interval: float = 0):
+        pass
+
+    def stop(self):
+        pass
+
+
+# Процесс-воркер: обновления приходят из канала от родителя, обрабатываются тем же dp, что и в
+# telegram_bot.py, не больше max_concurrency одновременно
+class Worker:
+    def __init__(self, conn, max_concurrency: int = 64, shutdown_timeout: float = 10.0):
+        self.conn = conn
+        self.shutdown_timeout = shutdown_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+        self._stop = asyncio.Event()
+        self.handled = 0
+        self.failed = 0
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _on_message(self):
+        try:
+            kind, payload = self.conn.recv()
+        except (EOFError, OSError):  # родитель завершился
+            asyncio.get_running_loop().remove_reader(self.conn.fileno())
+            self._stop.set()
+            return
+        if kind == "update":
+            self._spawn(self._process(payload))
+        elif kind == "attach":
+            self._spawn(self._attach(payload))
+        elif kind == "reloaded":
+            telegram_bot.catalogs.reloaded(payload)
+        elif kind == "stop":
+            self._stop.set()
+
+    async def _process(self, data: str):
+        async with self._slots:
+            try:
+                update = Update.model_validate_json(data, context={"bot": bot})
+                await dp.feed_update(bot, update)
+                self.handled += 1
+            except Exception:
+                self.failed += 1
+                logging.exception("Воркер: ошибка обработки обновления")
+
+    async def _attach(self, path: str):
+        try:
+            catalog = await asyncio.get_running_loop().run_in_executor(None, Catalog.attach, path)
+        except Exception as e:
+            logging.error(f"Воркер: не удалось открыть новую версию базы {path}: {e}", exc_info=True)
+            telegram_bot.catalogs.reloaded(False)
+            return
+        telegram_bot.catalogs.reloaded(True, catalog)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.conn.fileno(), self._on_message)
+        metrics.port = None  # /metrics отдаёт родитель; сводка в лог (METRICS_LOG_INTERVAL) — у каждого воркера
+        await metrics.start()
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+        try:
+            await self._stop.wait()
+        finally:
+            if self._tasks:
+                _, unfinished = await asyncio.wait(set(self._tasks), timeout=self.shutdown_timeout)
+                for task in unfinished:
+                    task.cancel()
+                await asyncio.gather(*unfinished, return_exceptions=True)
+            await dp.emit_shutdown(bot=bot, dispatcher=dp)
+            await bot.session.close()
+            await metrics.stop()
+            catalog_executor.shutdown()
+            logging.info(f"Воркер остановлен: обработано {self.handled}, ошибок {self.failed}")
+
+
+# Процесс-заготовка: форкается из родителя до запуска event loop и потоков, держит открытую базу
+# и по запросу родителя форкает из себя воркеры — и при старте, и при перезапуске упавших.
+# Родителю возвращает pid воркера и его конец канала (через Unix-сокет).
+def _fork_server(control, parent_end, max_concurrency: int, shutdown_timeout: float):
+    parent_end.close()  # иначе заготовка не заметит завершения родителя
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C получает вся группа — остановкой управляет родитель
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # завершившиеся воркеры не остаются зомби
+    gc.collect()
+    gc.freeze()  # всё, что уже есть в процессе, сборщик мусора больше не обходит — страницы остаются общими
+    while True:
+        try:
+            number, path = control.recv()
+        except EOFError:  # родитель завершился
+            return
+        parent_conn, conn = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            parent_conn.close()
+            code = 0
+            try:
+                _worker_main(number, conn, path, max_concurrency, shutdown_timeout)
+            except BaseException:
+                logging.exception("Воркер завершился с ошибкой")
+                code = 1
+            finally:
+                os._exit(code)
+        conn.close()
+        control.send(pid)
+        reduction.send_handle(control, parent_conn.fileno(), os.getppid())
+        parent_conn.close()  # иначе его унаследуют следующие воркеры и не будет EOF при падении
+
+
+# path — версия базы, опубликованная после старта заготовки (None — у заготовки актуальная)
+def _worker_main(number: int, conn, path, max_concurrency: int, shutdown_timeout: float):
+    multiprocessing.current_process().name = f"worker-{number}"
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    catalog = telegram_bot.catalogs.current if path is None else Catalog.attach(path)
+    telegram_bot.catalogs = WorkerCatalogs(catalog, conn)
+    asyncio.run(Worker(conn, max_concurrency, shutdown_timeout).run())
+
+
+# Воркеры и раздача им обновлений (в родителе)
+class WorkerPool:
+    def __init__(self, count: int, max_concurrency: int = 64, shutdown_timeout: float = 10.0):
+        self.count = count
+        self.max_concurrency = max_concurrency
+        self.shutdown_timeout = shutdown_timeout
+        self._context = multiprocessing.get_context("fork")
+        self._server = None
+        self._control = None
+        self._shared = None  # версия базы, опубликованная после старта заготовки
+        self._pids = [None] * count
+        self._conns = [None] * count
+        self._exited = {}  # номер воркера -> future, который завершится с его каналом (ждёт stop)
+        self._stopping = False
+        self._tasks = set()
+        self.routed = [0] * count
+        self.restarts = 0
+        self.dropped = 0
+
+    # Настройки из .env: BOT_WORKERS (по умолчанию — число ядер), WEBHOOK_MAX_CONCURRENCY
+    # (обновлений в работе на воркер), WEBHOOK_SHUTDOWN_TIMEOUT
+    @classmethod
+    def from_env(cls, count: int = None):
+        return cls(
+            count=count or int(os.getenv("BOT_WORKERS", "0")) or os.cpu_count() or 1,
+            max_concurrency=int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "64")),
+            shutdown_timeout=float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "10")),
+        )
+
+    # Вызывать до asyncio.run: заготовка форкается из родителя без event loop и потоков
+    def start(self):
+        self._control, control = self._context.Pipe()
+        self._server = self._context.Process(target=_fork_server, name="fork-server", daemon=True,
+                                             args=(control, self._control, self.max_concurrency, self.shutdown_timeout))
+        self._server.start()
+        control.close()
+        for number in range(self.count):
+            self.start_worker(number)
+
+    def start_worker(self, number: int):
+        self._control.send((number, self._shared))
+        pid = self._control.recv()
+        self._conns[number] = Connection(reduction.recv_handle(self._control))
+        self._pids[number] = pid
+        logging.info(f"Запущен воркер {number} (pid {pid})")
+
+    def _listen(self, number: int):
+        asyncio.get_running_loop().add_reader(self._conns[number].fileno(), self._on_message, number)
+
+    # Сообщение от воркера: пока это только просьба перезагрузить базу (/reload)
+    def _on_message(self, number: int):
+        conn = self._conns[number]
+        try:
+            kind, payload = conn.recv()
+        except (EOFError, OSError):  # воркер завершился
+            self._exit(number)
+            return
+        if kind == "reload":
+            task = asyncio.create_task(self._reload(number, payload))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _exit(self, number: int):
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self._conns[number].fileno())
+        self._conns[number].close()
+        self._conns[number] = None
+        exited = self._exited.pop(number, None)
+        if exited is not None:
+            exited.set_result(None)
+        if not self._stopping:
+            logging.warning(f"Воркер {number} (pid {self._pids[number]}) завершился — перезапускаю")
+            loop.call_later(RESTART_DELAY, self._restart, number)
+
+    def _restart(self, number: int):
+        if self._stopping:
+            return
+        if not self._server.is_alive():
+            logging.error(f"Процесс-заготовка завершился с кодом {self._server.exitcode} — воркер {number} "
+                          f"не перезапустить")
+            return
+        self.restarts += 1
+        self.start_worker(number)
+        self._listen(number)
+
+    async def _reload(self, number: int, reason: str):
+        if not await telegram_bot.catalogs.reload(f"{reason} (воркер {number})"):
+            self.send(number, ("reloaded", False))
+
+    # Новая версия уже опубликована и открыта родителем (CatalogHolder.on_reload)
+    def broadcast_catalog(self, catalog: Catalog):
+        self._shared = shared_path(catalog.source[0])
+        for number in range(self.count):
+            self.send(number, ("attach", self._shared))
+
+    def send(self, number: int, message) -> bool:
+        try:
+            self._conns[number].send(message)
+            return True
+        except (AttributeError, OSError, ValueError):  # канал закрыт — воркер упал и ещё не перезапущен
+            return False
+
+    # Воркер по пользователю: обновления одного пользователя всегда идут в один процесс
+    def route(self, update: Update) -> int:
+        try:
+            user = getattr(update.event, "from_user", None)
+        except UpdateTypeLookupError:
+            user = None
+        return (user.id if user is not None else update.update_id) % self.count
+
+    async def feed(self, update: Update):
+        data = update.model_dump_json(exclude_unset=True, by_alias=True)
+        number = self.route(update)
+        # если воркер лежит, обновление берёт следующий — лучше потерять FSM, чем само обновление
+        for i in range(self.count):
+            if self.send((number + i) % self.count, ("update", data)):
+                self.routed[(number + i) % self.count] += 1
+                return
+        self.dropped += 1
+        logging.warning(f"Нет живых воркеров — обновление {update.update_id} потеряно")
+
+    def alive(self) -> int:
+        return sum(conn is not None for conn in self._conns)
+
+    def stats(self) -> dict:
+        return {"alive": self.alive(), "restarts": self.restarts, "dropped": self.dropped,
+                **{f"routed_{number}": routed for number, routed in enumerate(self.routed)}}
+
+    def listen(self):
+        for number in range(self.count):
+            self._listen(number)
+
+    # Воркеры дорабатывают начатое (не дольше shutdown_timeout) и завершаются
+    async def stop(self):
+        self._stopping = True
+        for task in list(self._tasks):
+            task.cancel()
+        loop = asyncio.get_running_loop()
+        for number, conn in enumerate(self._conns):
+            if conn is not None:
+                self._exited[number] = loop.create_future()
+                self.send(number, ("stop", None))
+        started = time.monotonic()
+        if self._exited:
+            await asyncio.wait(list(self._exited.values()), timeout=self.shutdown_timeout + 5)
+        for number in list(self._exited):
+            logging.warning(f"Воркер {number} не завершился за {time.monotonic() - started:.1f} с — останавливаю")
+            try:
+                os.kill(self._pids[number], signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            loop.remove_reader(self._conns[number].fileno())
+            self._conns[number].close()
+            self._conns[number] = None
+        self._exited.clear()
+        self._control.close()  # заготовка получит EOF и завершится
+        await loop.run_in_executor(None, self._server.join)
+        logging.info(f"Воркеры остановлены, обновлений: {sum(self.routed)}, потеряно: {self.dropped}")
+
+
+# Long polling в родителе: обновления забирает один процесс и раздаёт воркерам
+async def poll(pool: WorkerPool, parent_bot: Bot):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    signals = [s for s in (getattr(signal, "SIGTERM", None), signal.SIGINT) if s is not None]
+    for sig in signals:
+        loop.add_signal_handler(sig, stop.set)
+
+    async def receive():
+        offset = None
+        allowed_updates = dp.resolve_used_update_types()
+        while True:
+            try:
+                updates = await parent_bot.get_updates(offset=offset, timeout=POLL_TIMEOUT,
+                                                       allowed_updates=allowed_updates)
+            except Exception as e:
+                logging.warning(f"getUpdates: {e} — повтор через секунду")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await pool.feed(update)
+                offset = update.update_id + 1
+
+    task = asyncio.create_task(receive())
+    logging.info(f"Polling: обновления раздаются {pool.count} воркерам")
+    try:
+        await stop.wait()
+    finally:
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await parent_bot.session.close()
+
+
+async def serve(pool: WorkerPool):
+    # свой Bot у родителя: сессия aiohttp общего bot не должна открыться до fork
+    parent_bot = Bot(token=telegram_bot.TOKEN, session=AiohttpSession(api=bot.session.api))
+    pool.listen()
+    telegram_bot.catalogs.start(watch_interval=float(os.getenv("CATALOG_WATCH_INTERVAL", "0")))
+    webhook = WebhookServer.from_env(dp, parent_bot, feed=pool.feed, health=lambda: {
+        "catalog_size": len(telegram_bot.catalogs.current.store),
+        "workers_alive": pool.alive(),
+    })
+    metrics.collect("workers", pool.stats)
+    if webhook is not None:
+        metrics.collect("webhook", webhook.stats)
+    await metrics.start()
+    try:
+        if webhook is not None:
+            await webhook.serve()
+        else:
+            await poll(pool, parent_bot)
+    finally:
+        telegram_bot.catalogs.stop()
+        await pool.stop()
+        await metrics.stop()
+
+
+def main(workers: int = None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+    started = time.perf_counter()
+    pool = WorkerPool.from_env(workers)
+    catalog = publish_catalog(telegram_bot.catalogs.current)
+    telegram_bot.catalogs = CatalogHolder(build_shared_catalog, catalog, on_reload=pool.broadcast_catalog)
+    logging.info(f"База готова за {time.perf_counter() - started:.1f} с: {len(catalog.store)} ароматов, "
+                 f"воркеров {pool.count}")
+    pool.start()
+    asyncio.run(serve(pool))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telegram-бот в несколько процессов на общей базе")
+    parser.add_argument("--workers", type=int, default=None, help="число воркеров (по умолчанию BOT_WORKERS или число ядер)")
+    args = parser.parse_args()
+    main(args.workers)
@@ -0,0 +1,190 @@
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from search_index import SEARCH_FIELDS, SearchIndex
+from startup import LazyModule
+
+# pandas нужен только для чтения CSV и сборки DataFrame — compact_catalog открывает базу без него
+pd = LazyModule("pandas")
+
+# Бинарный снапшот базы: колонки в виде numpy-массивов в одном .npz рядом с CSV
+# (числа — как есть, строки — общий utf-8 буфер + смещения + маска пропусков),
+# плюс готовый поисковый индекс и sha256 исходного CSV.
+# Сборка: python catalog_cache.py fra_perfumes.csv
+SNAPSHOT_VERSION = 1
+
+
+def snapshot_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ".snapshot.npz"
+
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Размер, mtime и sha256 файла — чтобы потом проверить, что он не менялся
+def file_info(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_checksum(path)}
+
+
+def file_matches(path: str, info: dict) -> bool:
+    stat = os.stat(path)
+    if (stat.st_size, stat.st_mtime_ns) == (info["size"], info["mtime_ns"]):
+        return True
+    # mtime мог смениться без изменения содержимого — сверяем контрольную сумму
+    return stat.st_size == info["size"] and file_checksum(path) == info["sha256"]
+
+
+# info с текущими размером и mtime файла (содержимое уже сверено file_matches). Если они сменились,
+# новую версию стоит сохранить — иначе file_matches будет считать sha256 при каждом запуске
+def restamp(path: str, info: dict) -> dict:
+    stat = os.stat(path)
+    return dict(info, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+# Строки -> общий utf-8 буфер + смещения + маска пропусков (и обратно); используется и в compact_catalog
+def pack_strings(values) -> dict:
+    null = np.fromiter(
+        (not isinstance(v, str) and (v is None or v != v) for v in values), dtype=bool, count=len(values)
+    )
+    encoded = [b"" if missing else str(v).encode("utf-8") for v, missing in zip(values, null)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return {"data": np.frombuffer(b"".join(encoded), dtype=np.uint8), "offsets": offsets, "null": null}
+
+
+def unpack_strings(data: np.ndarray, offsets: np.ndarray, null: np.ndarray) -> list:
+    raw = data.tobytes()
+    bounds = offsets.tolist()
+    values = [raw[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(len(bounds) - 1)]
+    for i in np.flatnonzero(null).tolist():
+        values[i] = np.nan
+    return values
+
+
+# Собрать снапшот для CSV, возвращает путь к .npz
+def build_snapshot(csv_path: str) -> str:
+    source = file_info(csv_path)
+    df = pd.read_csv(csv_path, encoding='utf-8')
+
+    arrays = {}
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        if series.dtype.kind in "iufb":
+            arrays[f"col{i}"] = series.to_numpy()
+            columns.append({"name": col, "kind": "num"})
+        else:
+            for key, arr in pack_strings(series.tolist()).items():
+                arrays[f"col{i}_{key}"] = arr
+            columns.append({"name": col, "kind": "str"})
+
+    index = SearchIndex.from_frame(df)
+    for key, arr in index.to_arrays().items():
+        arrays[f"index_{key}"] = arr
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "rows": len(df),
+        "columns": columns,
+        "index_fields": list(index.fields),
+        "source": source,
+    }
+    path = snapshot_path(csv_path)
+    _save(path, arrays, meta)
+    return path
+
+
+def _save(path: str, arrays: dict, meta: dict):
+    arrays["meta"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+# Открыть снапшот, если он соответствует текущему CSV; иначе None
+def _open_fresh(csv_path: str):
+    os.stat(csv_path)  # нет CSV — FileNotFoundError, как у pd.read_csv
+    path = snapshot_path(csv_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        snap = np.load(path)
+        meta = json.loads(snap["meta"].tobytes().decode("utf-8"))
+    except Exception as e:
+        logging.warning(f"Снапшот {path} повреждён: {e}")
+        return None
+    if meta.get("version") != SNAPSHOT_VERSION:
+        snap.close()
+        return None
+
+    if not file_matches(csv_path, meta["source"]):
+        snap.close()
+        return None
+    source = restamp(csv_path, meta["source"])
+    if source != meta["source"]:  # содержимое то же, сменился только mtime
+        meta["source"] = source
+        arrays = {key: snap[key] for key in snap.files if key != "meta"}
+        snap.close()
+        try:
+            _save(path, arrays, meta)
+        except OSError as e:
+            logging.warning(f"Не удалось обновить mtime в снапшоте {path}: {e}")
+        snap = np.load(path)
+    return snap, meta
+
+
+def _frame(snap, meta) -> pd.DataFrame:
+    data = {}
+    for i, col in enumerate(meta["columns"]):
+        if col["kind"] == "num":
+            data[col["name"]] = snap[f"col{i}"]
+        else:
+            data[col["name"]] = unpack_strings(snap[f"col{i}_data"], snap[f"col{i}_offsets"], snap[f"col{i}_null"])
+    return pd.DataFrame(data)
+
+
+# База из свежего снапшота, а если его нет или он устарел — из CSV
+def read_catalog(csv_path: str) -> pd.DataFrame:
+    opened = _open_fresh(csv_path)
+    if opened is None:
+        return pd.read_csv(csv_path, encoding='utf-8')
+    snap, meta = opened
+    with snap:
+        return _frame(snap, meta)
+
+
+# База + поисковый индекс (из снапшота, если он свежий)
+def load_catalog(csv_path: str, fields=SEARCH_FIELDS):
+    opened = _open_fresh(csv_path)
+    if opened is None:
+        df = pd.read_csv(csv_path, encoding='utf-8')
+        return df, SearchIndex.from_frame(df, fields)
+
+    snap, meta = opened
+    with snap:
+        df = _frame(snap, meta)
+        arrays = None
+        if meta["index_fields"] == [f for f in fields if f in df.columns]:
+            arrays = {key[len("index_"):]: snap[key] for key in snap.files if key.startswith("index_")}
+    return df, SearchIndex.from_frame(df, fields, arrays)
+
+
+if __name__ == "__main__":
+    for csv_path in sys.argv[1:] or ["fra_perfumes.csv"]:
+        started = time.perf_counter()
+        path = build_snapshot(csv_path)
+        print(f"{csv_path} -> {path} ({time.perf_counter() - started:.1f} с)")
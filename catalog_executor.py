@@ -0,0 +1,58 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Все места в пуле и очереди заняты — запрос отклоняется сразу, а не копится
+class ExecutorBusy(Exception):
+    pass
+
+
+# Пул потоков для тяжёлой работы с базой (поиск, анализ), чтобы не блокировать event loop aiogram.
+# Потоки, а не процессы: база и индексы общие, копировать их в каждый процесс не нужно.
+# Очередь ограничена: одновременно не больше workers + queue_size задач, остальным — ExecutorBusy.
+class CatalogExecutor:
+    def __init__(self, workers: int = 2, queue_size: int = 32, timeout: float = 10.0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="catalog")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    # Настройки из переменных окружения (.env): CATALOG_WORKERS, CATALOG_QUEUE_SIZE, CATALOG_TIMEOUT
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.getenv("CATALOG_WORKERS", "2")),
+            queue_size=int(os.getenv("CATALOG_QUEUE_SIZE", "32")),
+            timeout=float(os.getenv("CATALOG_TIMEOUT", "10")),
+        )
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    # Выполнить func(*args) в пуле. ExecutorBusy — очередь полна, asyncio.TimeoutError — не уложились в таймаут
+    async def run(self, func, *args, timeout: float = None, **kwargs):
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                raise ExecutorBusy()
+            self._pending += 1
+        # место освобождается, когда задача реально закончилась (даже после таймаута)
+        future = self._pool.submit(functools.partial(func, *args, **kwargs))
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()  # если задача ещё в очереди — не запустится
+            raise
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,371 @@
+import argparse
+import hashlib
+import logging
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+
+from catalog_cache import file_info, pack_strings
+from compact_catalog import (CATEGORY_FIELDS, LIST_FIELDS, LIST_SEPARATOR, NUMERIC_FIELDS, CategoryColumn,
+                             ListColumn, parse_numbers, replace_dir, store_path, write_meta)
+from search_index import SEARCH_FIELDS, TOKEN_RE, lower_text, vocab_arrays
+from startup import LazyModule
+
+pd = LazyModule("pandas")
+
+# Потоковая сборка базы из нескольких выгрузок, которые не помещаются в память целиком:
+#   python catalog_ingest.py dump1.csv dump2.csv -o fra_perfumes.csv
+# CSV читаются кусками по --chunk-size строк, колонки приводятся к одной схеме, дубли (по ID аромата)
+# отбрасываются. Каждый кусок сразу дописывается в итоговый CSV, в колонки компактной базы
+# (compact_catalog) и в поисковый индекс, поэтому в памяти — один кусок и словари, а не вся база.
+# Рядом с CSV получается свежая папка .compact — layering_app и бот открывают её через mmap.
+
+# Единая схема: колонки всех выгрузок называются как в fra_perfumes.csv
+CANONICAL_COLUMNS = ("Name", "Brand", "Main Accords", "Description", "Perfumers", "Gender", "Season",
+                     "Rating Value", "Rating Count")
+
+# Названия колонок в разных выгрузках (в нижнем регистре, "_" как пробел) -> колонка схемы.
+# notes маленькой базы — такой же список через ", ", как Main Accords
+COLUMN_ALIASES = {
+    "name": "Name",
+    "perfume": "Name",
+    "brand": "Brand",
+    "main accords": "Main Accords",
+    "accords": "Main Accords",
+    "notes": "Main Accords",
+    "description": "Description",
+    "perfumers": "Perfumers",
+    "perfumer": "Perfumers",
+    "gender": "Gender",
+    "season": "Season",
+    "rating value": "Rating Value",
+    "rating count": "Rating Count",
+}
+# mainaccord1..mainaccord5, perfumer1, perfumer2 — значения склеиваются в один список через ", "
+NUMBERED_COLUMNS = {"mainaccord": "Main Accords", "main accord": "Main Accords", "perfumer": "Perfumers"}
+NUMBERED_RE = re.compile(r"^(.+?) ?\d+$")
+
+CHUNK_SIZE = 50_000
+# Сколько пар (слово, строка) индекса раскладывается за раз при сборке postings
+POSTINGS_BLOCK = 1 << 20
+
+
+# Колонка выгрузки -> колонка схемы (неизвестные колонки — url, Year, Top и т.п. — не попадают в базу)
+def canonical_columns(columns) -> dict:
+    mapping = {}
+    for column in columns:
+        key = " ".join(str(column).replace("_", " ").split()).lower()
+        numbered = NUMBERED_RE.match(key)
+        if key in COLUMN_ALIASES:
+            mapping[column] = COLUMN_ALIASES[key]
+        elif numbered and numbered.group(1) in NUMBERED_COLUMNS:
+            mapping[column] = NUMBERED_COLUMNS[numbered.group(1)]
+    return mapping
+
+
+# Разделитель по заголовку: выгрузки Fragrantica бывают и через ";"
+def _sniff(path: str):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        header = f.readline()
+    sep = ";" if header.count(";") > header.count(",") else ","
+    return sep, list(pd.read_csv(path, sep=sep, nrows=0, encoding="utf-8-sig").columns)
+
+
+def _strings(chunk, sources: list) -> list:
+    if not sources:
+        return [np.nan] * len(chunk)
+    parts = [["" if v is None or v != v else str(v).strip() for v in chunk[raw].tolist()] for raw in sources]
+    return [LIST_SEPARATOR.join(p for p in row if p) or np.nan for row in zip(*parts)]
+
+
+# Кусок выгрузки (все колонки строками) -> DataFrame с колонками columns в порядке схемы
+def normalize_chunk(chunk, mapping: dict, columns: list):
+    data = {}
+    for column in columns:
+        sources = [raw for raw, canonical in mapping.items() if canonical == column]
+        if column in NUMERIC_FIELDS:
+            data[column] = parse_numbers(chunk[sources[0]], column) if sources else np.full(len(chunk), np.nan)
+        else:
+            data[column] = _strings(chunk, sources)
+    return pd.DataFrame(data, columns=columns)
+
+
+# ID аромата для дедупликации: "бренд - название" без регистра и лишних пробелов. Строки без Brand
+# получают пустой бренд (в таких выгрузках бренд — часть Name, её и достаточно для сравнения), поэтому
+# это не get_perfume_id из telegram_bot: там бренд без колонки угадывается brand_from_name
+def perfume_id(name: str, brand) -> str:
+    brand = brand if isinstance(brand, str) else ""
+    return " ".join(f"{brand} - {name}".lower().split())
+
+
+def _id_hash(perfume: str) -> int:
+    return int.from_bytes(hashlib.blake2b(perfume.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# Уже записанные ID — отсортированный массив 64-битных хешей (8 байт на аромат вместо строки в set)
+class SeenIds:
+    def __init__(self):
+        self.hashes = np.empty(0, dtype=np.uint64)
+
+    # Маска новых ID: первое вхождение в куске, которого не было в прошлых кусках
+    def add(self, ids: list) -> np.ndarray:
+        hashes = np.fromiter(map(_id_hash, ids), dtype=np.uint64, count=len(ids))
+        unique, first = np.unique(hashes, return_index=True)
+        pos = np.searchsorted(self.hashes, unique)
+        known = pos < len(self.hashes)
+        known[known] = self.hashes[pos[known]] == unique[known]
+        keep = np.zeros(len(ids), dtype=bool)
+        keep[first[~known]] = True
+        self.hashes = np.insert(self.hashes, pos[~known], unique[~known])
+        return keep
+
+
+# Массив, который дописывается частями в сырой файл path.part, а в конце становится .npy
+class ArrayFile:
+    def __init__(self, path: str, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.size = 0
+        self._file = open(path + ".part", "wb")
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        self._file.write(values.tobytes())
+        self.size += len(values)
+
+    # Записанное — блоками по size элементов (в памяти только текущий блок)
+    def blocks(self, size: int):
+        self._file.flush()
+        with open(self.path + ".part", "rb") as part:
+            for _ in range(0, self.size, size):
+                yield np.fromfile(part, dtype=self.dtype, count=size)
+
+    # Дописать записанные байты в открытый файл out как есть (без заголовка .npy)
+    def copy_to(self, out):
+        self._file.flush()
+        with open(self.path + ".part", "rb") as part:
+            shutil.copyfileobj(part, out, 1 << 20)
+
+    def finish(self):
+        self._file.close()
+        with open(self.path, "wb") as out:
+            np.lib.format.write_array_header_1_0(out, {
+                "descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False, "shape": (self.size,)
+            })
+            with open(self.path + ".part", "rb") as part:
+                shutil.copyfileobj(part, out, 1 << 20)
+        os.remove(self.path + ".part")
+
+    def discard(self):
+        self._file.close()
+        os.remove(self.path + ".part")
+
+
+# Колонка компактной базы, которая собирается по кускам в те же файлы, что пишет CompactCatalog.save
+class ColumnWriter:
+    def __init__(self, directory: str, i: int, name: str):
+        self.name = name
+        if name in NUMERIC_FIELDS:
+            self.kind = "num"
+        elif name in CATEGORY_FIELDS:
+            self.kind = "category"
+        elif name in LIST_FIELDS:
+            self.kind = "list"
+        else:
+            self.kind = "str"
+        self._prefix = os.path.join(directory, f"col{i}_")
+        self.vocab = {}  # категории / значения списков — общие для всех кусков
+        parts = {
+            "num": {"values": np.float64},
+            "str": {"data": np.uint8, "offsets": np.int64, "null": bool},
+            "category": {"codes": np.int32},
+            "list": {"ids": np.int32, "offsets": np.int64, "null": bool},
+        }[self.kind]
+        self._files = {key: ArrayFile(f"{self._prefix}{key}.npy", dtype) for key, dtype in parts.items()}
+        if "offsets" in self._files:
+            self._files["offsets"].append([0])
+
+    def append(self, values: list):
+        if self.kind == "num":
+            self._files["values"].append(values)
+        elif self.kind == "category":
+            self._files["codes"].append(CategoryColumn.from_values(values, self.vocab).codes)
+        elif self.kind == "str":
+            packed = pack_strings(values)
+            self._append_items("data", packed["data"], packed["offsets"], packed["null"])
+        else:
+            column = ListColumn.from_values(values, self.vocab)
+            self._append_items("ids", column.ids, column.offsets, column.null)
+
+    # Элементы + смещения (сдвинутые на уже записанные элементы) + маска пропусков
+    def _append_items(self, key: str, items, offsets, null):
+        shift = self._files[key].size
+        self._files[key].append(items)
+        self._files["offsets"].append(offsets[1:] + shift)
+        self._files["null"].append(null)
+
+    def finish(self) -> dict:
+        for file in self._files.values():
+            file.finish()
+        if self.kind in ("category", "list"):
+            packed = pack_strings(list(self.vocab))
+            prefix = "" if self.kind == "category" else "vocab_"
+            np.save(f"{self._prefix}{prefix}data.npy", packed["data"])
+            np.save(f"{self._prefix}{prefix}offsets.npy", packed["offsets"])
+        return {"name": self.name, "kind": self.kind}
+
+
+# Поисковый индекс (SearchIndex.to_arrays), который строится по кускам: пары (слово, строка) и тексты
+# колонок копятся во временных файлах, а в конце пары раскладываются по словам блоками
+class IndexWriter:
+    def __init__(self, directory: str, fields: list):
+        self.fields = fields
+        self.size = 0
+        self.vocab = {}
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._dir = directory
+        self._tokens = ArrayFile(os.path.join(directory, "_pairs_tokens"), np.int32)
+        self._rows = ArrayFile(os.path.join(directory, "_pairs_rows"), np.int32)
+        self._texts = [ArrayFile(os.path.join(directory, f"_text{f}"), np.uint8) for f in range(len(fields))]
+        self._text_offsets = [ArrayFile(os.path.join(directory, f"_text{f}_offsets"), np.int64)
+                              for f in range(len(fields))]
+
+    # columns — значения колонок fields для очередных строк
+    def append(self, columns: list):
+        texts = [[lower_text(v) for v in values] for values in columns]
+        rows = len(texts[0]) if texts else 0
+        vocab = self.vocab
+        token_ids = []
+        row_ids = []
+        for row in range(rows):
+            tokens = set()
+            for field_texts in texts:
+                tokens.update(TOKEN_RE.findall(field_texts[row]))
+            token_ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+            row_ids.extend([self.size + row] * len(tokens))
+        self._tokens.append(token_ids)
+        self._rows.append(row_ids)
+        counts = np.bincount(np.asarray(token_ids, dtype=np.int64), minlength=len(vocab))
+        counts[:len(self._counts)] += self._counts
+        self._counts = counts
+
+        for f, field_texts in enumerate(texts):
+            packed = pack_strings(field_texts)
+            shift = self._texts[f].size
+            self._texts[f].append(packed["data"])
+            self._text_offsets[f].append(packed["offsets"][1:] + shift)
+        self.size += rows
+
+    def finish(self):
+        words = vocab_arrays(list(self.vocab))
+        np.save(os.path.join(self._dir, "index_blob.npy"), np.frombuffer(words["blob"].encode("utf-8"), dtype=np.uint8))
+        np.save(os.path.join(self._dir, "index_starts.npy"), words["starts"])
+        offsets = np.zeros(len(self._counts) + 1, dtype=np.int64)
+        np.cumsum(self._counts, out=offsets[1:])
+        np.save(os.path.join(self._dir, "index_offsets.npy"), offsets)
+
+        # Строки каждого слова — подряд и по возрастанию (куски шли по порядку, сортировка устойчивая)
+        postings = np.lib.format.open_memmap(os.path.join(self._dir, "index_postings.npy"), mode="w+",
+                                             dtype=np.int32, shape=(int(offsets[-1]),))
+        cursor = offsets[:-1].copy()
+        for block, rows in zip(self._tokens.blocks(POSTINGS_BLOCK), self._rows.blocks(POSTINGS_BLOCK)):
+            order = np.argsort(block, kind="stable")
+            block = block[order]
+            group_starts = np.flatnonzero(np.r_[True, block[1:] != block[:-1]])
+            rank = np.arange(len(block)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(block)]))
+            postings[cursor[block] + rank] = rows[order]
+            cursor += np.bincount(block, minlength=len(cursor))
+        postings.flush()
+        del postings
+        self._tokens.discard()
+        self._rows.discard()
+
+        # Тексты колонок подряд (колонка за колонкой), смещения — сквозные, как в SearchIndex
+        text_offsets = ArrayFile(os.path.join(self._dir, "index_text_offsets.npy"), np.int64)
+        text_offsets.append([0])
+        shift = 0
+        with open(os.path.join(self._dir, "index_text_data.bin"), "wb") as out:
+            for texts, field_offsets in zip(self._texts, self._text_offsets):
+                for block in field_offsets.blocks(POSTINGS_BLOCK):
+                    text_offsets.append(block + shift)
+                shift += texts.size
+                texts.copy_to(out)
+                texts.discard()
+                field_offsets.discard()
+        text_offsets.finish()
+
+
+# Собрать из выгрузок csv_paths одну базу out_path (+ компактную базу и индекс рядом).
+# Из дублей остаётся первый встреченный (порядок файлов важен). Возвращает счётчики
+def ingest(csv_paths: list, out_path: str, chunk_size: int = CHUNK_SIZE, fields=SEARCH_FIELDS) -> dict:
+    sources = []
+    for path in csv_paths:
+        sep, names = _sniff(path)
+        mapping = canonical_columns(names)
+        if "Name" not in mapping.values():
+            raise ValueError(f"В {path} нет колонки с названием аромата: {names}")
+        sources.append((path, sep, mapping))
+    columns = [c for c in CANONICAL_COLUMNS if any(c in mapping.values() for _, _, mapping in sources)]
+    fields = [f for f in fields if f in columns]
+
+    tmp_csv = out_path + ".tmp"
+    tmp_store = store_path(out_path) + ".tmp"
+    shutil.rmtree(tmp_store, ignore_errors=True)
+    os.makedirs(tmp_store)
+    writers = [ColumnWriter(tmp_store, i, name) for i, name in enumerate(columns)]
+    index = IndexWriter(tmp_store, fields)
+    seen = SeenIds()
+    stats = {"read": 0, "written": 0, "duplicates": 0, "skipped": 0}
+
+    started = time.perf_counter()
+    with open(tmp_csv, "w", encoding="utf-8", newline="") as out:
+        out.write(pd.DataFrame(columns=columns).to_csv(index=False))
+        for path, sep, mapping in sources:
+            total = os.path.getsize(path) or 1
+            with open(path, "rb") as f:
+                for chunk in pd.read_csv(f, sep=sep, dtype=str, chunksize=chunk_size, encoding="utf-8-sig",
+                                         usecols=list(mapping)):
+                    frame = normalize_chunk(chunk, mapping, columns)
+                    named = frame["Name"].notna().to_numpy()
+                    frame = frame[named]
+                    brands = frame["Brand"].tolist() if "Brand" in columns else [None] * len(frame)
+                    new = seen.add([perfume_id(n, b) for n, b in zip(frame["Name"].tolist(), brands)])
+                    frame = frame[new]
+
+                    frame.to_csv(out, header=False, index=False)
+                    for writer in writers:
+                        writer.append(frame[writer.name].tolist())
+                    index.append([frame[field].tolist() for field in fields])
+
+                    stats["read"] += len(chunk)
+                    stats["skipped"] += int((~named).sum())
+                    stats["duplicates"] += int((~new).sum())
+                    stats["written"] += len(frame)
+                    elapsed = time.perf_counter() - started
+                    logging.info(f"{path}: {min(f.tell() / total, 1):.0%}, прочитано {stats['read']:,}, "
+                                 f"записано {stats['written']:,}, дублей {stats['duplicates']:,} "
+                                 f"({stats['read'] / elapsed:,.0f} строк/с)")
+
+    logging.info(f"Сборка индекса: {len(index.vocab):,} слов")
+    column_meta = [writer.finish() for writer in writers]
+    index.finish()
+    os.replace(tmp_csv, out_path)
+    write_meta(tmp_store, stats["written"], column_meta, fields, file_info(out_path))
+    replace_dir(tmp_store, store_path(out_path))
+    logging.info(f"Готово: {out_path} и {store_path(out_path)} за {time.perf_counter() - started:.1f} с "
+                 f"({stats['written']:,} ароматов, дублей {stats['duplicates']:,}, без названия {stats['skipped']:,})")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Потоковая сборка одной базы из нескольких выгрузок CSV")
+    parser.add_argument("csv_paths", nargs="+")
+    parser.add_argument("-o", "--out", default="fra_perfumes.csv")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    ingest(args.csv_paths, args.out, args.chunk_size)
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+import signal
+
+
+# Размер и mtime файла — по ним видно, что файл базы изменился
+def file_stamp(path: str) -> tuple:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Текущая версия базы бота (база + все индексы по ней) с перезагрузкой без остановки.
+# Новая версия собирается build(путь к файлу текущей версии) в отдельном потоке и подменяется одним присваиванием current:
+# запросы, которые уже взяли старую версию, дорабатывают на ней, новые получают новую.
+# У версии должны быть .version и .source — (путь к файлу базы, file_stamp на момент загрузки).
+# on_reload(catalog) вызывается после каждой подмены (bot_workers.py так оповещает воркеры).
+class CatalogHolder:
+    def __init__(self, build, current=None, on_reload=None):
+        self._build = build
+        self._on_reload = on_reload
+        self.current = current if current is not None else build()
+        self._lock = None  # asyncio.Lock — создаётся уже в event loop
+        self._tasks = set()
+        self._seen_stamp = None
+        self._failed_stamp = None  # версия файла, которую не удалось загрузить: не повторять, пока файл не изменится
+
+    # Перезагрузка; False — если перезагрузка уже идёт или не удалась (тогда остаётся старая версия)
+    async def reload(self, reason: str = "") -> bool:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._lock.locked():
+            return False
+        async with self._lock:
+            logging.info(f"Перезагрузка базы: {reason}")
+            loop = asyncio.get_running_loop()
+            try:
+                # тот же файл, что у текущей версии: запасная база при перезагрузке не подставляется
+                catalog = await loop.run_in_executor(None, self._build, self.current.source[0])
+            except Exception as e:
+                logging.error(f"Не удалось перезагрузить базу, остаётся старая версия: {e}", exc_info=True)
+                return False
+            old, self.current = self.current, catalog
+            logging.info(f"База перезагружена: версия {old.version} -> {catalog.version}")
+            if self._on_reload is not None:
+                self._on_reload(catalog)
+            return True
+
+    def _reload_soon(self, reason: str):
+        task = asyncio.ensure_future(self.reload(reason))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # Файл базы изменился и не меняется уже один интервал (чтобы не читать недописанный файл)
+    def _source_changed(self) -> bool:
+        path, loaded_stamp = self.current.source
+        try:
+            stamp = file_stamp(path)
+        except FileNotFoundError:
+            return False
+        if stamp == loaded_stamp or stamp == self._failed_stamp:
+            self._seen_stamp = None
+            return False
+        settled = stamp == self._seen_stamp
+        self._seen_stamp = stamp
+        return settled
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if self._source_changed():
+                if self._lock is not None and self._lock.locked():
+                    continue  # перезагрузка уже идёт (SIGHUP, /reload)
+                stamp = self._seen_stamp
+                if not await self.reload("файл базы изменился"):
+                    self._failed_stamp = stamp
+                    logging.warning("Файл базы не загрузился — следующая попытка, когда он снова изменится")
+
+    # SIGHUP (kill -HUP) перезагружает базу; watch_interval > 0 — ещё и проверка файла раз в столько секунд
+    def start(self, watch_interval: float = 0):
+        loop = asyncio.get_running_loop()
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, self._reload_soon, "SIGHUP")
+        if watch_interval > 0:
+            task = asyncio.create_task(self._watch(watch_interval))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def stop(self):
+        if hasattr(signal, "SIGHUP"):
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+        for task in list(self._tasks):
+            task.cancel()
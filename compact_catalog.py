@@ -0,0 +1,459 @@
+import json
+import logging
+import mmap
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from catalog_cache import file_info, file_matches, load_catalog, pack_strings, restamp, unpack_strings
+from search_index import SEARCH_FIELDS, SearchIndex
+from startup import LazyModule
+
+pd = LazyModule("pandas")
+
+# Компактная база в памяти вместо DataFrame со строками Python:
+#  * категории (бренд, пол, сезон, парфюмеры) — коды int32 + список уникальных значений;
+#  * аккорды — номера аккордов int32 подряд + смещения строк, словарь аккордов один на базу;
+#  * остальные строки (Name, Description) — один utf-8 буфер + смещения, строка декодируется при обращении;
+#  * числа — массивы numpy как есть.
+# Сохранённая база (python compact_catalog.py fra_perfumes.csv) — папка .npy рядом с CSV, открывается
+# через mmap: буферы не копируются в память процесса, а страницы общие для всех процессов с этой базой.
+STORE_VERSION = 2
+CATEGORY_FIELDS = ("Brand", "Gender", "Perfumers", "Season", "brand", "gender", "season")
+LIST_FIELDS = ("Main Accords", "notes")
+LIST_SEPARATOR = ", "
+# Числовые колонки: в выгрузках бывают строками ("1,234" отзывов, "3,74" — рейтинг)
+NUMERIC_FIELDS = ("Rating Value", "Rating Count")
+
+
+def _is_missing(value) -> bool:
+    return not isinstance(value, str) and (value is None or value != value)
+
+
+class StringColumn:
+    kind = "str"
+    parts = ("data", "offsets", "null")
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, null: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+        self.null = null
+        self._buffer = memoryview(data)
+
+    @classmethod
+    def from_values(cls, values):
+        return cls(**pack_strings(values))
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        return cls(arrays["data"], arrays["offsets"], arrays["null"])
+
+    def arrays(self) -> dict:
+        return {"data": self.data, "offsets": self.offsets, "null": self.null}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, pos):
+        if self.null[pos]:
+            return np.nan
+        return str(self._buffer[self.offsets[pos]:self.offsets[pos + 1]], "utf-8")
+
+    def tolist(self) -> list:
+        return unpack_strings(self.data, self.offsets, self.null)
+
+
+class CategoryColumn:
+    kind = "category"
+    parts = ("codes", "data", "offsets")
+
+    def __init__(self, codes: np.ndarray, categories: list):
+        self.codes = codes  # -1 — пропуск
+        self.categories = categories
+
+    # ids — словарь категорий, общий для нескольких вызовов (catalog_ingest кодирует базу по частям)
+    @classmethod
+    def from_values(cls, values, ids: dict = None):
+        ids = {} if ids is None else ids
+        codes = np.fromiter(
+            (-1 if _is_missing(v) else ids.setdefault(str(v), len(ids)) for v in values), dtype=np.int32, count=len(values)
+        )
+        return cls(codes, list(ids))
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        null = np.zeros(len(arrays["offsets"]) - 1, dtype=bool)
+        return cls(arrays["codes"], unpack_strings(arrays["data"], arrays["offsets"], null))
+
+    def arrays(self) -> dict:
+        packed = pack_strings(self.categories)
+        return {"codes": self.codes, "data": packed["data"], "offsets": packed["offsets"]}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, pos):
+        code = self.codes[pos]
+        return np.nan if code < 0 else self.categories[code]
+
+    def tolist(self) -> list:
+        categories = self.categories + [np.nan]  # код -1 -> последний элемент
+        return [categories[code] for code in self.codes.tolist()]
+
+
+# Список через ", " (аккорды): номера значений из общего словаря, по строке — срез ids[offsets[i]:offsets[i + 1]]
+class ListColumn:
+    kind = "list"
+    parts = ("ids", "offsets", "null", "vocab_data", "vocab_offsets")
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, null: np.ndarray, vocab: list):
+        self.ids = ids
+        self.offsets = offsets
+        self.null = null
+        self.vocab = vocab
+
+    @classmethod
+    def from_values(cls, values, vocab: dict = None):
+        vocab = {} if vocab is None else vocab
+        ids = []
+        lengths = np.zeros(len(values), dtype=np.int64)
+        null = np.zeros(len(values), dtype=bool)
+        for pos, value in enumerate(values):
+            if _is_missing(value):
+                null[pos] = True
+                continue
+            items = str(value).split(LIST_SEPARATOR)
+            ids.extend(vocab.setdefault(item, len(vocab)) for item in items)
+            lengths[pos] = len(items)
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(np.asarray(ids, dtype=np.int32), offsets, null, list(vocab))
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        vocab_null = np.zeros(len(arrays["vocab_offsets"]) - 1, dtype=bool)
+        vocab = unpack_strings(arrays["vocab_data"], arrays["vocab_offsets"], vocab_null)
+        return cls(arrays["ids"], arrays["offsets"], arrays["null"], vocab)
+
+    def arrays(self) -> dict:
+        packed = pack_strings(self.vocab)
+        return {"ids": self.ids, "offsets": self.offsets, "null": self.null,
+                "vocab_data": packed["data"], "vocab_offsets": packed["offsets"]}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # Номера значений строки pos в словаре vocab
+    def item_ids(self, pos) -> np.ndarray:
+        return self.ids[self.offsets[pos]:self.offsets[pos + 1]]
+
+    def __getitem__(self, pos):
+        if self.null[pos]:
+            return np.nan
+        return LIST_SEPARATOR.join([self.vocab[i] for i in self.item_ids(pos).tolist()])
+
+    def tolist(self) -> list:
+        return [self[pos] for pos in range(len(self))]
+
+
+COLUMN_TYPES = {cls.kind: cls for cls in (StringColumn, CategoryColumn, ListColumn)}
+
+
+# Строка базы: row.get("Name"), row["Gender"], row.name — позиция (как у строки df.iloc[pos])
+class CatalogRow:
+    __slots__ = ("_store", "name")
+
+    def __init__(self, store, pos: int):
+        self._store = store
+        self.name = pos
+
+    def __getitem__(self, column):
+        return self._store[column][self.name]
+
+    def get(self, column, default=None):
+        if column not in self._store.column_types:
+            return default
+        return self._store[column][self.name]
+
+    def keys(self) -> list:
+        return self._store.columns
+
+    def __repr__(self):
+        return f"<CatalogRow {self.name}: {self.get('Name', self.get('name'))!r}>"
+
+
+# Результат поиска: строки базы по позициям (по порядку), без копирования данных
+class CatalogRows:
+    def __init__(self, store, positions):
+        self.store = store
+        self.positions = np.asarray(positions, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.positions) == 0
+
+    def __getitem__(self, i):
+        return self.store.row(self.positions[i])
+
+    def __iter__(self):
+        return (self.store.row(pos) for pos in self.positions.tolist())
+
+
+# Строки чисел -> float64 (NaN, если не число)
+def parse_numbers(values, column: str) -> np.ndarray:
+    text = values.str.replace(" ", "", regex=False)
+    # "3,74" — десятичная запятая; в числе отзывов запятая разделяет тысячи
+    text = text.str.replace(",", "" if column == "Rating Count" else ".", regex=False)
+    return pd.to_numeric(text, errors="coerce").to_numpy(dtype=np.float64)
+
+
+class CompactCatalog:
+    def __init__(self, columns: dict):
+        self._columns = columns
+        self.columns = list(columns)
+        self.column_types = {name: getattr(col, "kind", "num") for name, col in columns.items()}
+        self.size = len(next(iter(columns.values()))) if columns else 0
+
+    # Колонки DataFrame по типам: числа, категории (CATEGORY_FIELDS), списки (LIST_FIELDS), строки
+    @classmethod
+    def from_frame(cls, df):
+        columns = {}
+        for name in df.columns:
+            series = df[name]
+            if series.dtype.kind in "iufb":
+                columns[name] = series.to_numpy()
+            elif name in NUMERIC_FIELDS:
+                # приводим один раз здесь, чтобы индексы и подбор пар получали числа
+                columns[name] = parse_numbers(series.astype(str), name)
+            elif name in CATEGORY_FIELDS:
+                columns[name] = CategoryColumn.from_values(series.tolist())
+            elif name in LIST_FIELDS:
+                columns[name] = ListColumn.from_values(series.tolist())
+            else:
+                columns[name] = StringColumn.from_values(series.tolist())
+        return cls(columns)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def empty(self) -> bool:
+        return self.size == 0
+
+    def __getitem__(self, column):
+        return self._columns[column]
+
+    def row(self, pos) -> CatalogRow:
+        return CatalogRow(self, int(pos))
+
+    def rows(self, positions) -> CatalogRows:
+        return CatalogRows(self, positions)
+
+    # Размер всех массивов (у открытой через mmap базы — размер отображённых файлов)
+    @property
+    def nbytes(self) -> int:
+        total = 0
+        for column in self._columns.values():
+            arrays = column.arrays().values() if hasattr(column, "arrays") else [column]
+            total += sum(arr.nbytes for arr in arrays)
+        return total
+
+    # Сохранить в папку path (атомарно: старая папка подменяется целиком; открытые через mmap
+    # файлы старой версии остаются доступны тем, кто их уже открыл)
+    def save(self, path: str, index: SearchIndex = None, source: dict = None):
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        columns = []
+        for i, name in enumerate(self.columns):
+            column = self._columns[name]
+            arrays = column.arrays() if hasattr(column, "arrays") else {"values": column}
+            for key, arr in arrays.items():
+                np.save(os.path.join(tmp_path, f"col{i}_{key}.npy"), arr)
+            columns.append({"name": name, "kind": self.column_types[name]})
+        if index is not None:
+            # тексты для поиска — сырым файлом: SearchIndex ищет в них через mmap.find
+            save_arrays(tmp_path, "index", index.to_arrays(), raw=("text_data",))
+        write_meta(tmp_path, self.size, columns, list(index.fields) if index is not None else None, source)
+        replace_dir(tmp_path, path)
+
+    @classmethod
+    def open(cls, path: str, meta: dict = None):
+        if meta is None:
+            meta = read_meta(path)
+        columns = {}
+        for i, col in enumerate(meta["columns"]):
+            if col["kind"] == "num":
+                columns[col["name"]] = _load(path, f"col{i}_values")
+            else:
+                column_type = COLUMN_TYPES[col["kind"]]
+                columns[col["name"]] = column_type.from_arrays(
+                    {key: _load(path, f"col{i}_{key}") for key in column_type.parts}
+                )
+        return cls(columns)
+
+
+# Массив из папки базы через mmap (пустые массивы mmap не умеет — они читаются как есть)
+def _load(path: str, name: str) -> np.ndarray:
+    file_path = os.path.join(path, name + ".npy")
+    try:
+        return np.load(file_path, mmap_mode="r")
+    except ValueError:
+        return np.load(file_path)
+
+
+def _map_bytes(file_path: str):
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def write_meta(path: str, rows: int, columns: list, index_fields, source: dict):
+    meta = {
+        "version": STORE_VERSION,
+        "rows": rows,
+        "columns": columns,
+        "index_fields": index_fields,
+        "source": source,
+    }
+    tmp_path = os.path.join(path, "meta.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(path, "meta.json"))  # базу могут читать другие процессы
+
+
+# Подменить папку path собранной tmp_path целиком (используется и в catalog_ingest)
+def replace_dir(tmp_path: str, path: str):
+    old_path = path + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def store_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ".compact"
+
+
+def read_meta(path: str) -> dict:
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Сохранённая база, если она соответствует текущему CSV: (папка, meta), иначе None
+def _open_fresh(csv_path: str):
+    os.stat(csv_path)  # нет CSV — FileNotFoundError, как у pd.read_csv
+    path = store_path(csv_path)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    try:
+        meta = read_meta(path)
+    except Exception as e:
+        logging.warning(f"Компактная база {path} повреждена: {e}")
+        return None
+    if meta.get("version") != STORE_VERSION or not file_matches(csv_path, meta["source"]):
+        return None
+    source = restamp(csv_path, meta["source"])
+    if source != meta["source"]:  # содержимое то же, сменился только mtime
+        meta["source"] = source
+        try:
+            write_meta(path, meta["rows"], meta["columns"], meta["index_fields"], source)
+        except OSError as e:
+            logging.warning(f"Не удалось обновить mtime в {path}: {e}")
+    return path, meta
+
+
+# Компактная база + поисковый индекс: из сохранённой папки (mmap), если она свежая,
+# иначе из снапшота или CSV (catalog_cache.load_catalog) с переводом в компактный вид
+def load_compact(csv_path: str, fields=SEARCH_FIELDS):
+    opened = _open_fresh(csv_path)
+    if opened is None:
+        df, index = load_catalog(csv_path, fields)
+        store = CompactCatalog.from_frame(df)
+        return store, SearchIndex.from_frame(store, fields, index.to_arrays())
+
+    return open_store(*opened, fields=fields)
+
+
+# База и поисковый индекс из сохранённой папки (mmap) без сверки с CSV
+def open_store(path: str, meta: dict = None, fields=SEARCH_FIELDS):
+    if meta is None:
+        meta = read_meta(path)
+    store = CompactCatalog.open(path, meta)
+    arrays = None
+    if meta["index_fields"] == [f for f in fields if f in store.columns]:
+        arrays = load_arrays(path, "index")  # index_text_data.bin — буфер mmap
+    return store, SearchIndex.from_frame(store, fields, arrays)
+
+
+# Массивы в папку как prefix_ключ.npy; ключи из raw пишутся сырыми байтами (prefix_ключ.bin) —
+# load_arrays отдаёт их буфером mmap, а не массивом
+def save_arrays(path: str, prefix: str, arrays: dict, raw=()):
+    for key, arr in arrays.items():
+        if key in raw:
+            with open(os.path.join(path, f"{prefix}_{key}.bin"), "wb") as f:
+                f.write(arr.tobytes())
+        else:
+            np.save(os.path.join(path, f"{prefix}_{key}.npy"), arr)
+
+
+# Массивы, сохранённые save_arrays, через mmap
+def load_arrays(path: str, prefix: str) -> dict:
+    arrays = {}
+    for name in os.listdir(path):
+        base, ext = os.path.splitext(name)
+        if not base.startswith(prefix + "_"):
+            continue
+        if ext == ".npy":
+            arrays[base[len(prefix) + 1:]] = _load(path, base)
+        elif ext == ".bin":
+            arrays[base[len(prefix) + 1:]] = _map_bytes(os.path.join(path, name))
+    return arrays
+
+
+# Собрать компактную базу для CSV, возвращает путь к папке
+def build_store(csv_path: str) -> str:
+    source = file_info(csv_path)
+    df, index = load_catalog(csv_path)
+    store = CompactCatalog.from_frame(df)
+    path = store_path(csv_path)
+    store.save(path, index, source)
+    return path
+
+
+# Сохранённая база для CSV: собирается, если её нет или она устарела. Вызывается перед пулом процессов,
+# чтобы воркеры открыли одну папку через mmap, а не разбирали CSV каждый сам
+def ensure_store(csv_path: str) -> str:
+    opened = _open_fresh(csv_path)
+    if opened is not None:
+        return opened[0]
+    logging.info(f"Собираю компактную базу для {csv_path}")
+    return build_store(csv_path)
+
+
+# Значения колонки строками ("" вместо пропусков) — для DataFrame и CompactCatalog
+def column_texts(frame, column) -> list:
+    values = frame[column]
+    if isinstance(values, np.ndarray):
+        return [str(v) for v in values.tolist()]
+    if hasattr(values, "fillna"):
+        return values.fillna("").astype(str).tolist()
+    return ["" if _is_missing(v) else v for v in values.tolist()]
+
+
+if __name__ == "__main__":
+    for csv_path in sys.argv[1:] or ["fra_perfumes.csv"]:
+        started = time.perf_counter()
+        path = build_store(csv_path)
+        store = CompactCatalog.open(path)
+        frame_mb = load_catalog(csv_path)[0].memory_usage(deep=True).sum() / 2 ** 20
+        print(f"{csv_path} -> {path} ({time.perf_counter() - started:.1f} с): "
+              f"{store.nbytes / 2 ** 20:.1f} МБ вместо {frame_mb:.1f} МБ в DataFrame")
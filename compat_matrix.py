@@ -0,0 +1,180 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from catalog_cache import file_info, file_matches
+from compact_catalog import ensure_store, load_compact
+from partners import RULE_FIELDS, PartnerRecommender
+from rules_engine import RulesFile
+
+# Офлайн-расчёт совместимости всех пар базы: для каждого аромата хранится только топ-N партнёров.
+# Результат — два .npy (позиции int32 и совместимость uint8, форма N x top), которые бот и
+# layering_app открывают через mmap, не загружая в память.
+# Запуск: python compat_matrix.py fra_perfumes.csv --top 20 --workers 4
+# Прерванный расчёт продолжается с недостающих чанков.
+TOP_PARTNERS_DIR = "top_partners"
+
+
+# Отпечаток базы: от имён, аккордов и описаний зависят и позиции, и совместимость
+def catalog_fingerprint(df) -> str:
+    digest = hashlib.sha256(str(len(df)).encode())
+    for col in ("Name",) + RULE_FIELDS:
+        if col in df.columns:
+            digest.update(col.encode("utf-8"))
+            digest.update("\x00".join(map(str, df[col].tolist())).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Готовая таблица топ-N партнёров (mmap, только чтение)
+class TopPartnersTable:
+    def __init__(self, path: str = TOP_PARTNERS_DIR):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.top = self.meta["top"]
+        self.ids = np.load(os.path.join(path, "topn_ids.npy"), mmap_mode="r")
+        self.scores = np.load(os.path.join(path, "topn_scores.npy"), mmap_mode="r")
+
+    # Таблица для этой базы и текущего файла правил или None, если её нет или она устарела.
+    # fingerprint — уже посчитанный catalog_fingerprint(df)
+    @classmethod
+    def open(cls, df, rules_path: str = "layering_rules.json", path: str = TOP_PARTNERS_DIR, fingerprint: str = None):
+        try:
+            table = cls(path)
+        except FileNotFoundError:
+            return None
+        if fingerprint is None:
+            fingerprint = catalog_fingerprint(df)
+        if table.meta["fingerprint"] != fingerprint or not table.rules_fresh(rules_path):
+            logging.info(f"Таблица {path} устарела — подбор пар будет считаться на лету")
+            return None
+        return table
+
+    def rules_fresh(self, rules_path: str = "layering_rules.json") -> bool:
+        try:
+            return file_matches(rules_path, self.meta["rules"])
+        except FileNotFoundError:
+            return False
+
+    # То же, что PartnerRecommender.top_partners, но из готовой таблицы
+    def top_partners(self, pos: int, k: int = 10) -> list:
+        k = min(k, self.top)
+        return [(int(p), int(s)) for p, s in zip(self.ids[pos, :k], self.scores[pos, :k]) if p >= 0]
+
+
+# Состояние процесса-воркера: база и битсеты строятся один раз на процесс
+_worker = None
+
+
+def _init_worker(csv_path: str, rules_path: str):
+    global _worker
+    store, index = load_compact(csv_path)  # сохранённая компактная база — общая для всех воркеров через mmap
+    _worker = PartnerRecommender.from_frame(store, index, RulesFile(rules_path).get())
+
+
+def _chunk_path(work_dir: str, chunk: int) -> str:
+    return os.path.join(work_dir, f"chunk_{chunk:05d}.npz")
+
+
+def _compute_chunk(work_dir: str, chunk: int, start: int, end: int, top: int):
+    started = time.perf_counter()
+    ids = np.full((end - start, top), -1, dtype=np.int32)
+    scores = np.zeros((end - start, top), dtype=np.uint8)
+    for row, pos in enumerate(range(start, end)):
+        partners = _worker.top_partners(pos, top)
+        ids[row, :len(partners)] = [p for p, _ in partners]
+        scores[row, :len(partners)] = [s for _, s in partners]
+
+    tmp_path = _chunk_path(work_dir, chunk) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, ids=ids, scores=scores)
+    os.replace(tmp_path, _chunk_path(work_dir, chunk))
+    return chunk, (end - start) * (_worker.size - 1), time.perf_counter() - started
+
+
+def build_table(csv_path: str, rules_path: str = "layering_rules.json", out: str = TOP_PARTNERS_DIR,
+                top: int = 20, chunk_size: int = 1000, workers: int = None):
+    ensure_store(csv_path)  # воркеры откроют сохранённую базу через mmap, а не будут разбирать CSV
+    store, _ = load_compact(csv_path)
+    size = len(store)
+    job = {"fingerprint": catalog_fingerprint(store), "rules": file_info(rules_path), "top": top,
+           "chunk_size": chunk_size, "rows": size}
+    del store
+
+    # Чанки от другой базы/правил/параметров не переиспользуем
+    work_dir = os.path.join(out, "chunks")
+    os.makedirs(work_dir, exist_ok=True)
+    job_path = os.path.join(work_dir, "job.json")
+    if os.path.exists(job_path):
+        with open(job_path, "r", encoding="utf-8") as f:
+            if json.load(f) != job:
+                for path in glob.glob(os.path.join(work_dir, "chunk_*.npz")):
+                    os.remove(path)
+    with open(job_path, "w", encoding="utf-8") as f:
+        json.dump(job, f)
+
+    chunks = [(c, start, min(start + chunk_size, size)) for c, start in enumerate(range(0, size, chunk_size))]
+    todo = [c for c in chunks if not os.path.exists(_chunk_path(work_dir, c[0]))]
+    logging.info(f"Чанков: {len(chunks)}, осталось посчитать: {len(todo)}")
+
+    started = time.perf_counter()
+    total_pairs = 0
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(csv_path, rules_path)) as pool:
+            futures = [pool.submit(_compute_chunk, work_dir, c, s, e, top) for c, s, e in todo]
+            for done, future in enumerate(as_completed(futures), 1):
+                chunk, pairs, seconds = future.result()
+                total_pairs += pairs
+                elapsed = time.perf_counter() - started
+                logging.info(f"Чанк {chunk} готов ({done}/{len(todo)}): {pairs / seconds:,.0f} пар/с, "
+                             f"всего {total_pairs / elapsed:,.0f} пар/с")
+
+    # Сборка чанков в итоговые mmap-файлы; старые файлы подменяются атомарно,
+    # чтобы уже открытые читателями mmap не оборвались
+    meta_path = os.path.join(out, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    ids_path, scores_path = os.path.join(out, "topn_ids.npy"), os.path.join(out, "topn_scores.npy")
+    ids = np.lib.format.open_memmap(ids_path + ".tmp", mode="w+", dtype=np.int32, shape=(size, top))
+    scores = np.lib.format.open_memmap(scores_path + ".tmp", mode="w+", dtype=np.uint8, shape=(size, top))
+    for c, start, end in chunks:
+        with np.load(_chunk_path(work_dir, c)) as part:
+            ids[start:end] = part["ids"]
+            scores[start:end] = part["scores"]
+    ids.flush()
+    scores.flush()
+    del ids, scores
+    os.replace(ids_path + ".tmp", ids_path)
+    os.replace(scores_path + ".tmp", scores_path)
+
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({k: job[k] for k in ("fingerprint", "rules", "top", "rows")}, f)
+    for path in glob.glob(os.path.join(work_dir, "chunk_*.npz")) + [job_path]:
+        os.remove(path)
+    os.rmdir(work_dir)
+
+    elapsed = time.perf_counter() - started
+    if total_pairs:
+        logging.info(f"Готово: {total_pairs:,} пар за {elapsed:.1f} с ({total_pairs / elapsed:,.0f} пар/с)")
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Топ-N совместимых пар для всей базы")
+    parser.add_argument("csv_path", nargs="?", default="fra_perfumes.csv")
+    parser.add_argument("--rules", default="layering_rules.json")
+    parser.add_argument("--out", default=TOP_PARTNERS_DIR)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    build_table(args.csv_path, args.rules, args.out, args.top, args.chunk_size, args.workers)
@@ -0,0 +1,146 @@
+import re
+
+import numpy as np
+
+from compact_catalog import column_texts
+
+# Колонки с названием, брендом и парфюмерами (в большой базе бренд внутри Name)
+FUZZY_FIELDS = ("Name", "Brand", "brand", "name", "Perfumers")
+
+# Слова с похожестью ниже порога не считаются совпадением
+MIN_SIMILARITY = 0.3
+# Сколько похожих слов словаря берём на одно слово запроса
+MAX_WORDS = 50
+# Триграммы, которые встречаются в слишком многих словах, не помогают отбирать кандидатов
+MAX_TRIGRAM_WORDS = 5000
+
+WORD_RE = re.compile(r"\w+")
+
+
+# Списки чисел -> плоский массив и смещения: список i — flat[offsets[i]:offsets[i + 1]]
+def _flatten(lists: list):
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(items) for items in lists], out=offsets[1:])
+    flat = np.fromiter((item for items in lists for item in items), dtype=np.int32, count=int(offsets[-1]))
+    return flat, offsets
+
+
+def _trigrams(word: str) -> set:
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Нечёткий поиск с опечатками ("dilan blu" -> Dylan Blue).
+# Триграммный индекс по словарю слов из названий/брендов/парфюмеров: для слова запроса
+# находим похожие слова (коэффициент Дайса по триграммам), а строки ранжируем по сумме
+# лучших похожестей каждого слова запроса, при равенстве — по числу отзывов.
+# Списки строк слов и слов триграмм хранятся плоскими массивами со смещениями — их можно
+# сохранить (to_arrays) и открыть через mmap в нескольких процессах бота.
+class FuzzyIndex:
+    def __init__(self, texts: list, ratings=None, arrays: dict = None):
+        if arrays is None:
+            arrays = self._build(texts, ratings)
+        self._word_rows = arrays["word_rows"]
+        self._word_offsets = arrays["word_offsets"]
+        self._word_trigrams = arrays["word_trigrams"]
+        self._trigram_words = arrays["trigram_words"]
+        self._trigram_offsets = arrays["trigram_offsets"]
+        blob = arrays["trigrams"]
+        self._trigrams_blob = blob if isinstance(blob, str) else blob.tobytes().decode("utf-8")
+        self._trigram_ids = {t: i for i, t in enumerate(self._trigrams_blob.split("\n"))} if self._trigrams_blob else {}
+        self._tiebreak = arrays["tiebreak"]
+        self.size = len(self._tiebreak)
+
+    @staticmethod
+    def _build(texts: list, ratings) -> dict:
+        size = len(texts)
+        word_ids = {}
+        word_rows = []
+        for row, text in enumerate(texts):
+            for word in set(WORD_RE.findall(text.lower())):
+                word_id = word_ids.setdefault(word, len(word_ids))
+                if word_id == len(word_rows):
+                    word_rows.append([])
+                word_rows[word_id].append(row)
+
+        word_trigrams = np.zeros(len(word_ids), dtype=np.int32)
+        trigram_words = {}
+        for word_id, word in enumerate(word_ids):
+            trigrams = _trigrams(word)
+            word_trigrams[word_id] = len(trigrams)
+            for trigram in trigrams:
+                trigram_words.setdefault(trigram, []).append(word_id)
+
+        ratings = np.zeros(size) if ratings is None else np.nan_to_num(np.asarray(ratings, dtype=np.float64))
+        rows, row_offsets = _flatten(word_rows)
+        words, word_offsets = _flatten(list(trigram_words.values()))
+        return {
+            "word_rows": rows,
+            "word_offsets": row_offsets,
+            "word_trigrams": word_trigrams,
+            "trigram_words": words,
+            "trigram_offsets": word_offsets,
+            "trigrams": "\n".join(trigram_words),
+            "tiebreak": ratings / (ratings.max() + 1) * 1e-3 if size else ratings,
+        }
+
+    @classmethod
+    def from_frame(cls, df, fields=FUZZY_FIELDS, arrays: dict = None):
+        if arrays is not None:
+            return cls(None, arrays=arrays)
+        cols = [column_texts(df, f) for f in fields if f in df.columns]
+        texts = [" ".join(parts) for parts in zip(*cols)] if cols else [""] * len(df)
+        ratings = np.asarray(df["Rating Count"]) if "Rating Count" in df.columns else None
+        return cls(texts, ratings)
+
+    # Массивы индекса для сохранения на диск
+    def to_arrays(self) -> dict:
+        return {
+            "word_rows": self._word_rows,
+            "word_offsets": self._word_offsets,
+            "word_trigrams": self._word_trigrams,
+            "trigram_words": self._trigram_words,
+            "trigram_offsets": self._trigram_offsets,
+            "trigrams": np.frombuffer(self._trigrams_blob.encode("utf-8"), dtype=np.uint8),
+            "tiebreak": self._tiebreak,
+        }
+
+    # Похожие слова словаря: (номера слов, похожесть)
+    def _similar_words(self, word: str):
+        trigrams = _trigrams(word)
+        ids = [self._trigram_ids[t] for t in trigrams if t in self._trigram_ids]
+        offsets = self._trigram_offsets
+        lists = [self._trigram_words[offsets[i]:offsets[i + 1]] for i in ids]
+        if not lists:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        lists.sort(key=len)
+        selective = [ids for ids in lists if len(ids) <= MAX_TRIGRAM_WORDS] or lists[:2]
+        candidates, shared = np.unique(np.concatenate(selective), return_counts=True)
+        similarity = 2 * shared / (len(trigrams) + self._word_trigrams[candidates])
+        keep = similarity >= MIN_SIMILARITY
+        candidates, similarity = candidates[keep], similarity[keep]
+        if len(candidates) > MAX_WORDS:
+            top = np.argpartition(-similarity, MAX_WORDS - 1)[:MAX_WORDS]
+            candidates, similarity = candidates[top], similarity[top]
+        return candidates, similarity
+
+    # Позиции строк, отсортированные по похожести на запрос
+    def search(self, query: str, limit: int = 10) -> np.ndarray:
+        words = WORD_RE.findall(query.lower())
+        if not words or not self.size:
+            return np.empty(0, dtype=np.int64)
+        total = np.zeros(self.size)
+        for word in words:
+            best = np.zeros(self.size)
+            for word_id, similarity in zip(*self._similar_words(word)):
+                rows = self._word_rows[self._word_offsets[word_id]:self._word_offsets[word_id + 1]]  # без повторов
+                best[rows] = np.maximum(best[rows], similarity)
+            total += best
+        found = np.flatnonzero(total)
+        if not len(found):
+            return np.empty(0, dtype=np.int64)
+        score = total[found] + self._tiebreak[found]
+        if len(found) > limit:
+            top = np.argpartition(-score, limit - 1)[:limit]
+            found, score = found[top], score[top]
+        return found[np.argsort(-score, kind="stable")].astype(np.int64)
@@ -0,0 +1,264 @@
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from compact_catalog import column_texts, ensure_store, load_compact
+from preset_registry import PresetRegistry
+from rules_engine import CompiledRules
+from search_index import SearchIndex
+from startup import LazyModule
+
+# partners сам берёт константы совместимости отсюда
+partners = LazyModule("partners")
+
+# Анализ лееринга по правилам layering_rules.json: общий для диалога (layering_app.analyze_layering)
+# и пакетного режима — python layering_app.py --batch combos.jsonl --out results.jsonl
+BASE_COMPATIBILITY = 70
+PERFUME_BONUS = 5  # за каждый аромат в миксе
+MIN_COMPATIBILITY = 50  # минимум, чтобы не было 0
+TIPS = ["Apply lighter/fresh scent first, heavy on top", "2–3 sprays total to avoid overload"]
+
+# Строк входа в одном куске для воркера и сколько кусков на воркер держим в работе
+CHUNK_SIZE = 2000
+IN_FLIGHT = 4
+# Кэш названий -> позиций очищается, когда разрастается
+CACHE_SIZE = 100_000
+
+
+# Текст аромата для правил (ноты без 'notes'): notes_all микса — склейка таких текстов
+def rule_text(perfume) -> str:
+    return " " + str(perfume.get("Main Accords", "")).lower() + " " + str(perfume.get("Description", "")).lower()
+
+
+def layering_text(perfumes) -> str:
+    return (" " + "".join(rule_text(p) for p in perfumes)).strip()
+
+
+# Итог по сработавшим правилам (rules.match) для микса из count ароматов
+def layering_result(matched: dict, count: int) -> dict:
+    compatibility = BASE_COMPATIBILITY
+    vibe = "Unique mix — experimental and interesting 🧪"
+    risks = []
+
+    # Positive правила
+    for rule in matched["positive"]:
+        compatibility += rule["bonus"]
+        vibe = rule["vibe"]
+        if "risk" in rule and rule["risk"]:
+            risks.append(rule["risk"])
+
+    # Negative правила (уменьшают совместимость)
+    for rule in matched["negative"]:
+        compatibility += rule["penalty"]  # penalty отрицательное
+        vibe = rule["vibe"]
+        if "risk" in rule and rule["risk"]:
+            risks.append(rule["risk"])
+
+    compatibility = max(MIN_COMPATIBILITY, min(100, compatibility + count * PERFUME_BONUS))
+
+    # Risks
+    for rule in matched["risks"]:
+        risks.append(rule["description"])
+
+    if not risks:
+        risks = ["Minimal — should work smoothly!"]
+
+    return {
+        "compatibility": compatibility,
+        "vibe": vibe,
+        "risks": risks,
+        "tips": list(TIPS)
+    }
+
+
+# Анализ миксов по позициям строк базы без склейки текстов: маска слов правил у аромата —
+# из битсетов PartnerRecommender (поиск слова сразу по всей базе), маска микса — OR масок его
+# ароматов. Слово с пробелом ("orange blossom") может найтись и на стыке аккордов и описания
+# или текстов двух ароматов, а слово внутри "nan" — в пустой колонке; такие слова ищутся
+# в самих текстах, поэтому результат совпадает с rules.match(layering_text(...)).
+class BatchAnalyzer:
+    def __init__(self, store, index, rules: CompiledRules):
+        self.store = store
+        self.rules = rules
+        self._recommender = partners.PartnerRecommender(index, rules)
+        if "Name" in store.columns:
+            # Отдельный индекс по одному Name: слово ищется по словарю без проверки текстов строк
+            ratings = store["Rating Count"] if "Rating Count" in store.columns else None
+            self._registry = PresetRegistry({}, SearchIndex({"Name": column_texts(store, "Name")}), None, ratings)
+        else:
+            self._registry = PresetRegistry.from_frame({}, store, index)
+        self._positions = {}  # название -> позиция (None — не найдено)
+        self._exact = {}  # название в нижнем регистре -> позиция (при повторах — с наибольшим числом отзывов)
+        if "Name" in store.columns:
+            ratings = store["Rating Count"].tolist() if "Rating Count" in store.columns else [0] * len(store)
+            best = {}
+            for pos, (name, rating) in enumerate(zip(store["Name"].tolist(), ratings)):
+                if isinstance(name, str):
+                    key = name.lower()
+                    rating = rating if rating == rating else -1  # NaN
+                    if key not in best or rating > best[key]:
+                        best[key] = rating
+                        self._exact[key] = pos
+        self._rows = {}  # позиция -> (маска слов, начало текста, конец текста, название)
+        # (бит в маске, слово) для слов, которые ищутся в текстах
+        self._spaced = [(1 << i, k) for i, k in enumerate(rules.keywords) if " " in k]
+        self._text_keywords = [(1 << i, k) for i, k in enumerate(rules.keywords) if " " in k or k in "nan"]
+        self._joint = max((len(k) - 1 for _, k in self._spaced), default=0)
+
+    def _row(self, pos: int):
+        row = self._rows.get(pos)
+        if row is None:
+            perfume = self.store.row(pos)
+            text = rule_text(perfume)
+            mask = self._recommender.keyword_mask(pos)
+            for bit, keyword in self._text_keywords:
+                if keyword in text:
+                    mask |= bit
+            joint = self._joint
+            row = (mask, text[:joint], text[-joint:] if joint else "", perfume.get("Name"))
+            self._rows[pos] = row
+        return row
+
+    def analyze(self, positions: list) -> dict:
+        rows = [self._row(pos) for pos in positions]
+        mask = 0
+        for row_mask, _, _, _ in rows:
+            mask |= row_mask
+        if self._joint:
+            for (_, _, tail, _), (_, head, _, _) in zip(rows, rows[1:]):
+                joint = tail + head
+                for bit, keyword in self._spaced:
+                    if keyword in joint:
+                        mask |= bit
+        return layering_result(self.rules.match_mask(mask), len(positions))
+
+    # Аромат из строки входа: число — позиция в базе, строка — название: точное совпадение с Name,
+    # иначе все слова есть в Name (из нескольких — с наибольшим числом отзывов, как у пресетов)
+    def resolve(self, item):
+        if isinstance(item, int) and not isinstance(item, bool):
+            return item if 0 <= item < len(self.store) else None
+        if not isinstance(item, str):
+            return None
+        pos = self._exact.get(item.lower())
+        if pos is not None:
+            return pos
+        if item not in self._positions:
+            if len(self._positions) >= CACHE_SIZE:
+                self._positions.clear()
+            self._positions[item] = self._registry.resolve(item)
+        return self._positions[item]
+
+    # Строка JSONL входа -> запись результата (с "error", если микс не разобрать)
+    def process(self, number: int, line: str) -> dict:
+        record = {"line": number}
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            record["error"] = f"не JSON: {e}"
+            return record
+        if isinstance(data, dict):
+            if "id" in data:
+                record["id"] = data["id"]
+            data = data.get("perfumes")
+        if not isinstance(data, list) or not 2 <= len(data) <= 3:
+            record["error"] = "нужно 2–3 аромата: список или {\"perfumes\": [...]}"
+            return record
+
+        positions = [self.resolve(item) for item in data]
+        missing = [item for item, pos in zip(data, positions) if pos is None]
+        if missing:
+            record["error"] = "аромат не найден"
+            record["not_found"] = missing
+            return record
+        record["perfumes"] = [{"pos": pos, "name": self._row(pos)[3]} for pos in positions]
+        record.update(self.analyze(positions))
+        return record
+
+
+# Состояние процесса-воркера: база (mmap) и маски ароматов — одни на процесс
+_worker = None
+
+
+def _init_worker(csv_path: str, rules: CompiledRules):
+    global _worker
+    store, index = load_compact(csv_path)
+    _worker = BatchAnalyzer(store, index, rules)
+
+
+# Кусок строк входа (start — номер первой) -> результаты одной строкой и число ошибок
+def _process_chunk(start: int, lines: list):
+    out = []
+    errors = 0
+    for number, line in enumerate(lines, start):
+        if not line.strip():
+            continue
+        record = _worker.process(number, line)
+        errors += "error" in record
+        out.append(json.dumps(record, ensure_ascii=False))
+    return "\n".join(out) + "\n" if out else "", errors
+
+
+def _chunks(lines, size: int):
+    chunk = []
+    start = 1
+    for number, line in enumerate(lines, 1):
+        chunk.append(line)
+        if len(chunk) == size:
+            yield start, chunk
+            chunk = []
+            start = number + 1
+    if chunk:
+        yield start, chunk
+
+
+# Пакетный анализ: in_path/out_path — файлы JSONL ("-" — stdin/stdout). Вход читается потоково,
+# куски считаются в пуле процессов (workers=1 — в этом процессе), результаты пишутся по мере
+# готовности в порядке входа. Возвращает счётчики
+def run_batch(csv_path: str, rules: CompiledRules, in_path: str, out_path: str,
+              workers: int = None, chunk_size: int = CHUNK_SIZE) -> dict:
+    source = sys.stdin if in_path == "-" else open(in_path, "r", encoding="utf-8")
+    out = sys.stdout if out_path == "-" else open(out_path, "w", encoding="utf-8")
+    stats = {"lines": 0, "errors": 0}
+    started = time.perf_counter()
+
+    def write(start, lines, result):
+        text, errors = result
+        out.write(text)
+        stats["lines"] = start + len(lines) - 1
+        stats["errors"] += errors
+        elapsed = time.perf_counter() - started
+        logging.info(f"Пакетный анализ: {stats['lines']:,} строк, ошибок {stats['errors']:,} "
+                     f"({stats['lines'] / elapsed:,.0f} строк/с)")
+
+    try:
+        if workers == 1:
+            _init_worker(csv_path, rules)
+            for start, lines in _chunks(source, chunk_size):
+                write(start, lines, _process_chunk(start, lines))
+        else:
+            workers = workers or os.cpu_count() or 1
+            ensure_store(csv_path)  # иначе каждый воркер разберёт CSV и будет держать свою копию
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(csv_path, rules)) as pool:
+                pending = deque()
+                for start, lines in _chunks(source, chunk_size):
+                    pending.append((start, lines, pool.submit(_process_chunk, start, lines)))
+                    if len(pending) >= workers * IN_FLIGHT:
+                        start, lines, future = pending.popleft()
+                        write(start, lines, future.result())
+                while pending:
+                    start, lines, future = pending.popleft()
+                    write(start, lines, future.result())
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+        else:
+            out.flush()
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    return stats
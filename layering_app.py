@@ -1,11 +1,32 @@
-import pandas as pd
+from __future__ import annotations
+import time
+STARTED = time.perf_counter()
+
+import threading
 from rich.console import Console
-from rich.table import Table
 from rich.panel import Panel
 from rich.prompt import Prompt, IntPrompt
 from rich import box
 import logging
-import json
+from query_cache import normalize_query, search_cache
+from rules_engine import CompiledRules, RulesFile
+from startup import LazyModule, StartupProfiler
+
+# numpy, таблицы rich и всё, что строится по базе, импортируются при первом использовании,
+# чтобы меню появлялось сразу (python layering_app.py --profile-startup)
+rich_table = LazyModule("rich.table")
+compact_catalog = LazyModule("compact_catalog")
+search_index = LazyModule("search_index")
+partners = LazyModule("partners")
+compat_matrix = LazyModule("compat_matrix")
+preset_registry = LazyModule("preset_registry")
+fuzzy_index = LazyModule("fuzzy_index")
+layering_analysis = LazyModule("layering_analysis")
+profiler = StartupProfiler(STARTED)
+
+# Пока пользователь читает первый вопрос, модули для загрузки базы импортируются в фоне
+def prefetch_modules():
+    import compact_catalog  # noqa: F401
 
 # Настройка логирования и rich-консоли
 console = Console()
@@ -98,9 +119,16 @@ PRESETS = {
     }
 }
 
+# В базе из нескольких выгрузок у части ароматов колонки пустые (NaN)
+def text_or(value, default: str) -> str:
+    return value if isinstance(value, str) else default
+
 def get_brand(row):
-    if "brand" in row.index.str.lower():
-        return row.get("brand", "Неизвестный бренд")
+    # Бренд отдельной колонкой: brand в маленькой базе, Brand в базе из catalog_ingest.py
+    for column in ("Brand", "brand"):
+        brand = row.get(column)
+        if isinstance(brand, str):
+            return brand
     # Если бренда нет — пытаемся извлечь из Name (первые слова до "-" или тире)
     name = row.get("Name", "")
     if "-" in name:
@@ -114,11 +142,16 @@ def get_brand(row):
     return "Неизвестный бренд"
 
 def get_name(row):
-    return row.get("Name", "Без названия")
+    return row.get("Name", row.get("name", "Без названия"))
+
+def get_season(row):
+    return text_or(row.get("Season", row.get("season")), "N/A")
 
-# Загрузка базы
+# Загрузка базы в компактном виде (из сохранённой compact_catalog.py или снапшота catalog_cache.py, если собраны)
 def load_base():
     console.print("\n[bold]Выбери базу парфюмов:[/bold]")
+    profiler.first_prompt()
+    threading.Thread(target=prefetch_modules, daemon=True).start()
     base_choice = Prompt.ask("1 — Моя маленькая база (для теста)\n2 — Большая база Fragrantica (тысячи ароматов)", choices=["1", "2"], default="1")
 
     if base_choice == "2":
@@ -127,70 +160,67 @@ def load_base():
         filepath = "perfume_base(2).csv"
 
     try:
-        df = pd.read_csv(filepath, encoding='utf-8')
+        catalog, index = compact_catalog.load_compact(filepath)
         required = {"Name"}  # минимальные колонки, в большом датасете могут быть другие названия
-        actual_columns = set(df.columns.str.lower())
+        actual_columns = {column.lower() for column in catalog.columns}
         missing = required - actual_columns
         if missing:
             console.print(f"[yellow]Предупреждение: в большой базе могут быть другие названия колонок. Использую доступные.[/yellow]")
         
-        console.print(f"[green]База загружена: {len(df)} ароматов из {'большой' if base_choice == '2' else 'маленькой'} базы![/green]")
-        logging.info(f"Загружена база: {len(df)} записей из {filepath}")
-        return df
+        console.print(f"[green]База загружена: {len(catalog)} ароматов из {'большой' if base_choice == '2' else 'маленькой'} базы![/green]")
+        logging.info(f"Загружена база: {len(catalog)} записей из {filepath}")
+        return catalog, index
     except FileNotFoundError:
         console.print(f"[red]Файл {filepath} не найден — используй маленькую базу или скачай большую[/red]")
         return load_base_fallback()  # fallback на маленькую
     except Exception as e:
         console.print(f"[red]Ошибка: {e}[/red]")
-        return None
+        return None, None
 
 def load_base_fallback():
     try:
-        return pd.read_csv("perfume_base(2).csv", encoding='utf-8')
+        return compact_catalog.load_compact("perfume_base(2).csv")
     except:
-        return None
-
-# Поиск ароматов по подстроке (имя или бренд)
-def search_perfumes(df: pd.DataFrame, query: str) -> pd.DataFrame:
-    query = query.lower()
-    mask = pd.Series([False] * len(df))  # пустая маска
-
-    # Поиск по колонке Name (название аромата)
-    if "Name" in df.columns:
-        mask = mask | df["Name"].str.lower().str.contains(query, na=False)
-
-    # Поиск по Main Accords (аккорды/ноты)
-    if "Main Accords" in df.columns:
-        mask = mask | df["Main Accords"].str.lower().str.contains(query, na=False)
-
-    # Поиск по Description (если там упоминаются ноты или бренд)
-    if "Description" in df.columns:
-        mask = mask | df["Description"].str.lower().str.contains(query, na=False)
-
-    # Поиск по Perfumers (если там бренд или парфюмер)
-    if "Perfumers" in df.columns:
-        mask = mask | df["Perfumers"].str.lower().str.contains(query, na=False)
-
-    return df[mask].reset_index(drop=True)
+        return None, None
+
+# Поиск ароматов по подстроке (название, аккорды, описание, парфюмеры)
+# Индекс строится один раз при загрузке базы — см. load_base(), повторные запросы берутся из кэша
+def search_perfumes(catalog: compact_catalog.CompactCatalog, query: str,
+                    index: search_index.SearchIndex = None) -> compact_catalog.CatalogRows:
+    if index is None:
+        index = search_index.SearchIndex.from_frame(catalog)
+    query = normalize_query(query)
+    # в кэше — только позиции строк, сами строки берутся из базы
+    return catalog.rows(search_cache.get_or_compute(index.version, ("exact", query, None), lambda: index.search(query)))
+
+# Нечёткий поиск с опечатками ("dilan blu") — индекс строится при первом использовании
+_fuzzy_index = None
+
+def fuzzy_search_perfumes(catalog: compact_catalog.CompactCatalog, query: str, limit: int = 10) -> compact_catalog.CatalogRows:
+    global _fuzzy_index
+    if _fuzzy_index is None or _fuzzy_index[0] is not catalog:
+        _fuzzy_index = (catalog, fuzzy_index.FuzzyIndex.from_frame(catalog))
+    return catalog.rows(_fuzzy_index[1].search(query, limit))
 
 # Показ результатов поиска в красивой таблице
-def display_search_results(results: pd.DataFrame):
+def display_search_results(results: compact_catalog.CatalogRows):
     if results.empty:
         console.print("[yellow]Ничего не найдено 😔[/yellow]")
         return None
 
-    table = Table(title="Найденные парфюмы", box=box.ROUNDED, show_header=True, header_style="bold magenta")
+    table = rich_table.Table(title="Найденные парфюмы", box=box.ROUNDED, show_header=True, header_style="bold magenta")
     table.add_column("№", style="dim", width=4)
     table.add_column("Название", style="cyan", width=30)
     table.add_column("Аккорды", style="white", width=40)
     table.add_column("Рейтинг", style="green")
     table.add_column("Гендер", style="pink1")
 
-    for i, row in results.iterrows():
-        name = row.get("Name", "Без названия")
-        accords = row.get("Main Accords", "Нет аккордов")[:60] + "..." if len(str(row.get("Main Accords", ""))) > 60 else row.get("Main Accords", "")
+    for i, row in enumerate(results):
+        name = get_name(row)
+        accords = text_or(row.get("Main Accords"), "")
+        accords = accords[:60] + "..." if len(accords) > 60 else accords
         rating = f"{row.get('Rating Value', 'N/A')}/5 ({row.get('Rating Count', 0)} отзывов)"
-        gender = row.get("Gender", "Унисекс")
+        gender = text_or(row.get("Gender"), "Унисекс")
 
         table.add_row(
             str(i + 1),
@@ -203,77 +233,141 @@ def display_search_results(results: pd.DataFrame):
     console.print(table)
     return results
 
+# Правила из layering_rules.json компилируются один раз и перечитываются только при изменении файла
+rules_file = RulesFile("layering_rules.json")
+_fallback_rules = None
+
+# Базовые правила LAYERING_RULES в формате layering_rules.json ("любой" — без второго слова)
+def get_fallback_rules():
+    global _fallback_rules
+    if _fallback_rules is None:
+        _fallback_rules = CompiledRules({
+            "positive": [
+                {"keywords": [w for w in (a, b) if w != "любой"], "bonus": score - 70, "vibe": vibe, "risk": risk}
+                for a, b, score, vibe, risk in LAYERING_RULES["positive"]
+            ],
+            "risks": [
+                {"keywords": [a, b], "description": description}
+                for a, b, description in LAYERING_RULES["risks"]
+            ],
+        })
+    return _fallback_rules
+
+# Подбор пар по тем же правилам; пересобирается, если правила в файле изменились
+_recommender = None
+
+def get_recommender(catalog, index):
+    global _recommender
+    rules = rules_file.get() or get_fallback_rules()
+    if _recommender is None or _recommender.rules is not rules or _recommender.size != len(catalog):
+        _recommender = partners.PartnerRecommender.from_frame(catalog, index, rules)
+    return _recommender
+
+# Готовая таблица из compat_matrix.py (если посчитана для этой базы и правил), иначе расчёт на лету
+_top_table = None
+
+def get_top_partners(catalog, index, pos, k=10):
+    global _top_table
+    if _top_table is None or _top_table[0] is not catalog:
+        _top_table = (catalog, compat_matrix.TopPartnersTable.open(catalog))
+    table = _top_table[1]
+    if table is not None and k <= table.top and table.rules_fresh():
+        return table.top_partners(pos, k)
+    return get_recommender(catalog, index).top_partners(pos, k)
+
 # Анализ лееринга с поддержкой пресетов
 def analyze_layering(perfumes):
     # Загружаем правила
-    try:
-        with open("layering_rules.json", "r", encoding="utf-8") as f:
-            rules = json.load(f)
-        positive_rules = rules["positive"]
-        risk_rules = rules["risks"]
-        negative_rules = rules.get("negative", [])  # Новый раздел
-    except FileNotFoundError:
+    rules = rules_file.get()
+    if rules is None:
         console.print("[yellow]Файл layering_rules.json не найден — использую базовые правила[/yellow]")
-        positive_rules = LAYERING_RULES["positive"]
-        risk_rules = LAYERING_RULES["risks"]
-        negative_rules = []
-
-    # Собираем ноты (без 'notes')
-    notes_all = " "
-    for p in perfumes:
-        notes_all += " " + str(p.get("Main Accords", "")).lower()
-        notes_all += " " + str(p.get("Description", "")).lower()
-
-    notes_all = notes_all.strip()
-
-    compatibility = 70
-    vibe = "Unique mix — experimental and interesting 🧪"
-    risks = []
-
-    tips = ["Apply lighter/fresh scent first, heavy on top", "2–3 sprays total to avoid overload"]
-
-    # Positive правила
-    for rule in positive_rules:
-        keywords = [k.lower() for k in rule["keywords"]]
-        if all(word in notes_all for word in keywords):
-            compatibility += rule["bonus"]
-            vibe = rule["vibe"]
-            if "risk" in rule and rule["risk"]:
-                risks.append(rule["risk"])
-
-    # Negative правила (уменьшают совместимость)
-    for rule in negative_rules:
-        keywords = [k.lower() for k in rule["keywords"]]
-        if all(word in notes_all for word in keywords):
-            compatibility += rule["penalty"]  # penalty отрицательное
-            vibe = rule["vibe"]
-            if "risk" in rule and rule["risk"]:
-                risks.append(rule["risk"])
-
-    compatibility = max(50, min(100, compatibility + len(perfumes) * 5))  # Минимум 50%, чтобы не было 0
-
-    # Risks
-    for rule in risk_rules:
-        keywords = [k.lower() for k in rule["keywords"]]
-        if all(word in notes_all for word in keywords):
-            risks.append(rule["description"])
-
-    if not risks:
-        risks = ["Minimal — should work smoothly!"]
-
-    return {
-        "compatibility": compatibility,
-        "vibe": vibe,
-        "risks": risks,
-        "tips": tips
-    }
+        rules = get_fallback_rules()
+
+    # Собираем ноты (без 'notes') и применяем правила
+    notes_all = layering_analysis.layering_text(perfumes)
+    return layering_analysis.layering_result(rules.match(notes_all), len(perfumes))
+
+# Пакетный режим: миксы из JSONL-файла -> результаты в JSONL (в том же порядке)
+def run_batch(args):
+    logging.getLogger().addHandler(logging.StreamHandler())
+    rules = rules_file.get() or get_fallback_rules()
+    stats = layering_analysis.run_batch(args.base, rules, args.batch, args.out, args.workers, args.chunk_size)
+    logging.info(f"Готово: {stats['lines']:,} строк за {stats['seconds']} с, ошибок {stats['errors']:,}")
+
+# Поиск и выбор одного аромата; None — если пользователь ввёл 'стоп'
+def pick_perfume(catalog, index, number):
+    while True:
+        query = Prompt.ask(f"\n[bold]Введите название или бренд для поиска аромата №{number}[/bold] (или 'стоп' для завершения)")
+        if query.lower() in ["стоп", "stop", "exit"]:
+            return None
+
+        results = search_perfumes(catalog, query, index)
+        if results.empty:
+            results = fuzzy_search_perfumes(catalog, query)
+            if results.empty:
+                console.print("[yellow]Ничего не найдено 😔[/yellow]")
+                continue
+            console.print("[yellow]Точных совпадений нет — возможно, ты имел в виду:[/yellow]")
+
+        displayed = display_search_results(results)
+        if displayed is None:
+            continue
+
+        choice = IntPrompt.ask("Выберите номер парфюма", choices=[str(i+1) for i in range(len(results))], default=1)
+        return results[choice - 1]
+
+# Лучшие пары к выбранному аромату по правилам лееринга; возвращает выбранного партнёра или None
+def pick_partner(catalog, index, chosen, k=10):
+    with console.status("Подбираю пары..."):
+        top = get_top_partners(catalog, index, chosen.name, k)
+    if not top:
+        console.print("[yellow]В базе не с чем сочетать 😔[/yellow]")
+        return None
+
+    table = rich_table.Table(title=f"Лучшие пары для {get_brand(chosen)} - {get_name(chosen)}", box=box.ROUNDED, header_style="bold magenta")
+    table.add_column("№", style="dim", width=4)
+    table.add_column("Аромат", style="cyan", width=40)
+    table.add_column("Совместимость", style="green")
+    for i, (pos, compatibility) in enumerate(top, 1):
+        partner = catalog.row(pos)
+        table.add_row(str(i), f"{get_brand(partner)} - {get_name(partner)}", f"{compatibility}%")
+    console.print(table)
+
+    choice = IntPrompt.ask("Выбери пару для анализа (0 — выход)", choices=[str(i) for i in range(len(top) + 1)], default=1)
+    if choice == 0:
+        return None
+    return catalog.row(top[choice - 1][0])
+
+# Дополнение микса из 1–2 ароматов до тройки с наибольшей совместимостью;
+# возвращает выбранные добавленные ароматы или None
+def pick_completion(catalog, index, chosen, k=10):
+    with console.status("Подбираю ароматы к миксу..."):
+        options = get_recommender(catalog, index).complete([p.name for p in chosen], k)
+    if not options:
+        console.print("[yellow]В базе не с чем сочетать 😔[/yellow]")
+        return None
+
+    names = " + ".join(f"{get_brand(p)} - {get_name(p)}" for p in chosen)
+    table = rich_table.Table(title=f"Лучшие дополнения к {names}", box=box.ROUNDED, header_style="bold magenta", show_lines=True)
+    table.add_column("№", style="dim", width=4)
+    table.add_column("Добавить", style="cyan", width=60)
+    table.add_column("Совместимость", style="green")
+    for i, (positions, compatibility) in enumerate(options, 1):
+        added = catalog.rows(positions)
+        table.add_row(str(i), "\n".join(f"{get_brand(p)} - {get_name(p)}" for p in added), f"{compatibility}%")
+    console.print(table)
+
+    choice = IntPrompt.ask("Выбери вариант для анализа (0 — выход)", choices=[str(i) for i in range(len(options) + 1)], default=1)
+    if choice == 0:
+        return None
+    return list(catalog.rows(options[choice - 1][0]))
 
 # Основное меню
 def main():
     console.print(Panel("[bold magenta]🌸 Perfume Layering Assistant 🌸[/bold magenta]\nГенератор леерингов от [cyan]Saint[/cyan]", box=box.DOUBLE))
     
-    df = load_base()
-    if df is None:
+    catalog, index = load_base()
+    if catalog is None:
         return
 
     selected_perfumes = []
@@ -283,12 +377,13 @@ def main():
     use_preset = Prompt.ask("Хочешь сразу выбрать один из моих экспериментов?", choices=["y", "n"], default="n")
 
     if use_preset == "y":
-        preset_table = Table(title="Мои готовые лееринги", box=box.ROUNDED, header_style="bold magenta")
+        preset_table = rich_table.Table(title="Мои готовые лееринги", box=box.ROUNDED, header_style="bold magenta")
         preset_table.add_column("№", style="dim")
         preset_table.add_column("Микс", style="cyan")
         preset_table.add_column("Краткое описание", style="white")
 
-        preset_list = list(PRESETS.keys())
+        registry = preset_registry.PresetRegistry.from_frame(PRESETS, catalog, index)
+        preset_list = registry.keys
         for i, key in enumerate(preset_list, 1):
             names = " + ".join(key)
             short_vibe = PRESETS[key]["vibe"][:60] + "..." if len(PRESETS[key]["vibe"]) > 60 else PRESETS[key]["vibe"]
@@ -300,13 +395,9 @@ def main():
         selected_key = preset_list[choice - 1]
 
         selected_perfumes = []
-        for perfume_name in selected_key:
-            match = df[
-                df["name"].str.contains(perfume_name.split()[-1], case=False, na=False) |
-                (df["brand"] + " " + df["name"]).str.contains(perfume_name, case=False, na=False)
-            ]
-            if not match.empty:
-                selected_perfumes.append(match.iloc[0])
+        for perfume_name, pos in zip(selected_key, registry.rows[choice - 1]):
+            if pos is not None:
+                selected_perfumes.append(catalog.row(pos))
             else:
                 console.print(f"[red]Аромат {perfume_name} не найден в базе[/red]")
 
@@ -315,25 +406,32 @@ def main():
         else:
             console.print("\n[bold green]Загружен пресет:[/bold green]")
             for p in selected_perfumes:
-                console.print(f"• {p['brand']} - {p['name']}")
+                console.print(f"• {get_brand(p)} - {get_name(p)}")
+
+    elif Prompt.ask("Подобрать лучшую пару к одному аромату?", choices=["y", "n"], default="n") == "y":
+        chosen = pick_perfume(catalog, index, 1)
+        partner = pick_partner(catalog, index, chosen) if chosen is not None else None
+        if partner is not None:
+            selected_perfumes = [chosen, partner]
+
+    elif Prompt.ask("Дополнить микс до тройки (к 1–2 ароматам)?", choices=["y", "n"], default="n") == "y":
+        chosen = []
+        while len(chosen) < 2:
+            perfume = pick_perfume(catalog, index, len(chosen) + 1)
+            if perfume is None:
+                break
+            chosen.append(perfume)
+            console.print(f"[green]Добавлено:[/green] {get_brand(perfume)} - {get_name(perfume)}")
+        added = pick_completion(catalog, index, chosen) if chosen else None
+        if added is not None:
+            selected_perfumes = chosen + added
 
     else:
         # Ручной выбор ароматов
         while len(selected_perfumes) < 3:
-            query = Prompt.ask(f"\n[bold]Введите название или бренд для поиска аромата №{len(selected_perfumes)+1}[/bold] (или 'стоп' для завершения)")
-            if query.lower() in ["стоп", "stop", "exit"]:
+            chosen = pick_perfume(catalog, index, len(selected_perfumes) + 1)
+            if chosen is None:
                 break
-
-            results = search_perfumes(df, query)
-            if results.empty:
-                continue
-
-            displayed = display_search_results(results)
-            if displayed is None:
-                continue
-
-            choice = IntPrompt.ask("Выберите номер парфюма", choices=[str(i+1) for i in range(len(results))], default=1)
-            chosen = results.iloc[choice - 1]
             selected_perfumes.append(chosen)
 
             console.print(f"[green]Добавлено:[/green] {get_brand(chosen)} - {get_name(chosen)}")
@@ -344,13 +442,13 @@ def main():
 
     console.print("\n[bold green]Выбранные ароматы:[/bold green]")
     for p in selected_perfumes:
-        console.print(f"• {get_brand(p)} - {get_name(p)} ({p.get('season', 'N/A')}, {p.get('Gender', 'Унисекс')})")
+        console.print(f"• {get_brand(p)} - {get_name(p)} ({get_season(p)}, {text_or(p.get('Gender'), 'Унисекс')})")
 
     # Генерация и вывод лееринга
     console.print("\n[bold magenta]🎭 Анализ лееринга...[/bold magenta]")
     analysis = analyze_layering(selected_perfumes)
 
-    result_table = Table(box=box.ROUNDED, title="Результат лееринга", title_style="bold gold")
+    result_table = rich_table.Table(box=box.ROUNDED, title="Результат лееринга", title_style="bold gold")
     result_table.add_column("Параметр", style="cyan")
     result_table.add_column("Описание", style="white")
 
@@ -364,9 +462,9 @@ def main():
     # Сохранение результата
     if Prompt.ask("\nСохранить результат в файл?", choices=["y", "n"], default="y") == "y":
         with open("last_layering.txt", "w", encoding="utf-8") as f:
-            f.write(f"Лееринг от {pd.Timestamp('now').strftime('%d.%m.%Y %H:%M')}\n\n")
+            f.write(f"Лееринг от {time.strftime('%d.%m.%Y %H:%M')}\n\n")
             for p in selected_perfumes:
-                f.write(f"{get_brand(p)} - {get_name(p)} ({p.get('season', 'N/A')}, {p.get('Gender', 'Унисекс')})\n")
+                f.write(f"{get_brand(p)} - {get_name(p)} ({get_season(p)}, {text_or(p.get('Gender'), 'Унисекс')})\n")
             f.write(f"\nСовместимость: {analysis['compatibility']}%\n")
             f.write(f"Вайб: {analysis['vibe']}\n")
             f.write("Риски:\n" + "\n".join(f"- {r}" for r in analysis["risks"]) + "\n")
@@ -374,4 +472,17 @@ def main():
         console.print("[green]Результат сохранён в last_layering.txt[/green]")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Perfume Layering Assistant")
+    parser.add_argument("--profile-startup", action="store_true", help="показать время до первого вопроса и выйти")
+    parser.add_argument("--batch", metavar="JSONL", help="проанализировать миксы из файла (- — stdin) без диалога")
+    parser.add_argument("--out", default="-", help="куда писать результаты --batch (JSONL, - — stdout)")
+    parser.add_argument("--base", default="fra_perfumes.csv", help="база для --batch")
+    parser.add_argument("--workers", type=int, default=None, help="процессов для --batch (по умолчанию — все ядра)")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="строк входа на один кусок --batch")
+    args = parser.parse_args()
+    if args.batch:
+        run_batch(args)
+    else:
+        profiler.enabled = args.profile_startup
+        main()
\ No newline at end of file
@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.storage.base import BaseStorage
+
+# Границы корзин гистограмм задержки, в секундах
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — больше всех границ (+Inf)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    # Оценка квантиля по корзинам: верхняя граница корзины, в которую он попал
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# Счётчики и гистограммы задержек горячих путей бота.
+# Выключенные метрики почти ничего не стоят: timed() возвращает функцию как есть,
+# timer() — общий пустой контекст, обёртки хранилища FSM и запросов к Telegram не ставятся.
+class Metrics:
+    def __init__(self, enabled: bool = False, port: int = None, host: str = "127.0.0.1",
+                 log_interval: float = 0, prefix: str = "bot"):
+        self.enabled = enabled
+        self.port = port
+        self.host = host
+        self.log_interval = log_interval
+        self.prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []  # (префикс, функция -> {имя: значение}) — счётчики других модулей
+        self._lock = threading.Lock()  # наблюдения приходят и из пула потоков
+        self._runner = None
+        self._summary_task = None
+
+    # Настройки из .env: METRICS_PORT — HTTP-эндпоинт /metrics (формат Prometheus),
+    # METRICS_LOG_INTERVAL — сводка в лог раз в N секунд. Без них метрики выключены
+    @classmethod
+    def from_env(cls):
+        port = os.getenv("METRICS_PORT")
+        log_interval = float(os.getenv("METRICS_LOG_INTERVAL", "0"))
+        return cls(
+            enabled=bool(port) or log_interval > 0,
+            port=int(port) if port else None,
+            host=os.getenv("METRICS_HOST", "127.0.0.1"),
+            log_interval=log_interval,
+        )
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    # Счётчики, которые ведёт сам модуль (например, попадания в кэш): читаются при выводе метрик
+    def collect(self, prefix: str, func):
+        if self.enabled:
+            self._collectors.append((prefix, func))
+
+    def _all_counters(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        for prefix, func in self._collectors:
+            for name, value in func().items():
+                counters[f"{prefix}_{name}"] = value
+        return counters
+
+    @contextlib.contextmanager
+    def _timer(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def timer(self, name: str):
+        return self._timer(name) if self.enabled else contextlib.nullcontext()
+
+    # Декоратор: время каждого вызова функции (обычной или async) в гистограмму name
+    def timed(self, name: str):
+        def decorator(func):
+            if not self.enabled:
+                return func
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self._timer(name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self._timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Хранилище FSM с замером чтения/записи состояния (или то же хранилище, если метрики выключены)
+    def wrap_storage(self, storage: BaseStorage) -> BaseStorage:
+        return TimedStorage(storage, self) if self.enabled else storage
+
+    # Замер всех запросов к Telegram API этого бота
+    def instrument_bot(self, bot):
+        if self.enabled:
+            bot.session.middleware(TelegramRequestTimer(self))
+
+    # Текстовый формат Prometheus
+    def render(self) -> str:
+        with self._lock:
+            histograms = {name: (list(h.counts), h.count, h.sum) for name, h in self._histograms.items()}
+        counters = self._all_counters()
+        lines = []
+        if histograms:
+            metric = f"{self.prefix}_operation_seconds"
+            lines.append(f"# HELP {metric} Время операций бота")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, (counts, count, total) in sorted(histograms.items()):
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS + ("+Inf",), counts):
+                    cumulative += bucket
+                    lines.append(f'{metric}_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{operation="{name}"}} {total}')
+                lines.append(f'{metric}_count{{operation="{name}"}} {count}')
+        if counters:
+            metric = f"{self.prefix}_events_total"
+            lines.append(f"# HELP {metric} Счётчики событий бота")
+            lines.append(f"# TYPE {metric} counter")
+            for name, value in sorted(counters.items()):
+                lines.append(f'{metric}{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    # Одна строка для лога: число вызовов, среднее и p99 по каждой операции + счётчики
+    def summary(self) -> str:
+        with self._lock:
+            parts = [
+                f"{name}: n={h.count} avg={h.sum / h.count * 1000:.1f}ms p99<={h.quantile(0.99) * 1000:g}ms"
+                for name, h in sorted(self._histograms.items()) if h.count
+            ]
+        parts += [f"{name}={value}" for name, value in sorted(self._all_counters().items())]
+        return "; ".join(parts) or "нет данных"
+
+    async def _log_summary(self):
+        while True:
+            await asyncio.sleep(self.log_interval)
+            logging.info(f"Метрики: {self.summary()}")
+
+    # Запуск эндпоинта и периодической сводки (внутри event loop бота)
+    async def start(self):
+        if not self.enabled:
+            return
+        if self.port:
+            from aiohttp import web
+
+            async def handle(_request):
+                return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+            app = web.Application()
+            app.router.add_get("/metrics", handle)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            logging.info(f"Метрики: http://{self.host}:{self.port}/metrics")
+        if self.log_interval > 0:
+            self._summary_task = asyncio.create_task(self._log_summary())
+
+    async def stop(self):
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+            self._summary_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self.enabled:
+            logging.info(f"Метрики: {self.summary()}")
+
+
+class TimedStorage(BaseStorage):
+    def __init__(self, storage: BaseStorage, metrics: Metrics):
+        self.storage = storage
+        self.metrics = metrics
+
+    async def set_state(self, key, state=None):
+        with self.metrics.timer("fsm_set_state"):
+            return await self.storage.set_state(key, state)
+
+    async def get_state(self, key):
+        with self.metrics.timer("fsm_get_state"):
+            return await self.storage.get_state(key)
+
+    async def set_data(self, key, data):
+        with self.metrics.timer("fsm_set_data"):
+            return await self.storage.set_data(key, data)
+
+    async def get_data(self, key):
+        with self.metrics.timer("fsm_get_data"):
+            return await self.storage.get_data(key)
+
+    async def update_data(self, key, data):
+        with self.metrics.timer("fsm_update_data"):
+            return await self.storage.update_data(key, data)
+
+    async def close(self):
+        await self.storage.close()
+
+
+class TelegramRequestTimer(BaseRequestMiddleware):
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        name = f"telegram_{type(method).__name__}"
+        try:
+            with self.metrics.timer(name):
+                return await make_request(bot, method)
+        except Exception:
+            self.metrics.inc(f"{name}_error")
+            raise
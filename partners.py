@@ -0,0 +1,206 @@
+import heapq
+import logging
+import time
+
+import numpy as np
+
+from layering_analysis import BASE_COMPATIBILITY, MIN_COMPATIBILITY, PERFUME_BONUS
+from rules_engine import CompiledRules
+from search_index import SearchIndex
+
+# Колонки, из которых analyze_layering собирает notes_all
+RULE_FIELDS = ("Main Accords", "Description")
+
+# Совместимость считается как в layering_analysis.layering_result для пары ароматов
+PAIR_BONUS = 2 * PERFUME_BONUS
+TRIPLE_BONUS = 3 * PERFUME_BONUS
+# Сколько секунд искать лучшие пары к одному аромату; по истечении — лучшие из найденных
+COMPLETE_TIME_LIMIT = 0.8
+
+
+# Подбор лучших пар для одного аромата по правилам layering_rules.json.
+# У каждого аромата битсет ключевых слов правил (N x W слов uint64), найденных в его
+# аккордах/описании. Слово есть в notes_all пары, если оно есть хотя бы у одного аромата,
+# поэтому правило выполняется для всех N пар сразу — несколькими операциями numpy.
+# bits — готовые битсеты из to_arrays() для тех же правил (например, открытые через mmap в bot_workers.py)
+class PartnerRecommender:
+    def __init__(self, index: SearchIndex, rules: CompiledRules, ratings=None, bits=None):
+        self.rules = rules
+        self.size = index.size
+        if bits is not None:
+            self._bits = bits
+        else:
+            words = max(1, (len(rules.keywords) + 63) // 64)
+            self._bits = np.zeros((self.size, words), dtype=np.uint64)
+            for keyword_id, keyword in enumerate(rules.keywords):
+                rows = index.search(keyword, fields=RULE_FIELDS)
+                self._bits[rows, keyword_id // 64] |= np.uint64(1 << (keyword_id % 64))
+
+        # Только правила, влияющие на совместимость: (маска слов, бонус/штраф)
+        self._scored = [
+            (rules.rule_masks[rule_id], rule["bonus"] if section == "positive" else rule["penalty"])
+            for rule_id, (section, rule) in enumerate(rules.rules)
+            if section in ("positive", "negative")
+        ]
+
+        # При равной совместимости выше те, у кого больше отзывов
+        if ratings is None:
+            self._tiebreak = np.zeros(self.size, dtype=np.int64)
+        else:
+            ratings = np.nan_to_num(np.asarray(ratings, dtype=np.float64), nan=0.0)
+            self._tiebreak = np.empty(self.size, dtype=np.int64)
+            self._tiebreak[np.argsort(ratings, kind="stable")] = np.arange(self.size)
+
+    @classmethod
+    def from_frame(cls, df, index: SearchIndex, rules: CompiledRules, bits=None):
+        ratings = np.asarray(df["Rating Count"]) if "Rating Count" in df.columns else None
+        return cls(index, rules, ratings, bits)
+
+    # Битсеты для сохранения на диск (действительны, пока не изменились правила)
+    def to_arrays(self) -> dict:
+        return {"bits": self._bits}
+
+    def keyword_mask(self, pos: int) -> int:
+        mask = 0
+        for word, value in enumerate(self._bits[pos].tolist()):
+            mask |= value << (64 * word)
+        return mask
+
+    def _has_keyword(self, keyword_id: int, bits=None) -> np.ndarray:
+        bits = self._bits if bits is None else bits
+        return (bits[:, keyword_id // 64] & np.uint64(1 << (keyword_id % 64))) != 0
+
+    # Сумма бонусов и штрафов правил, выполненных в миксе из own (маска слов) и строки базы —
+    # для всех строк или только для rows
+    def _rule_scores(self, own: int, rows=None) -> np.ndarray:
+        bits = self._bits if rows is None else self._bits[rows]
+        score = np.zeros(len(bits), dtype=np.int64)
+        constant = 0
+        for mask, value in self._scored:
+            needed = mask & ~own
+            if not needed:
+                constant += value  # правило выполняется без строки — для всех
+                continue
+            ok = None
+            while needed:
+                low = needed & -needed
+                has = self._has_keyword(low.bit_length() - 1, bits)
+                ok = has if ok is None else ok & has
+                needed ^= low
+            score += value * ok
+        return score + constant
+
+    # Совместимость аромата pos с каждым ароматом базы (массив длины N)
+    def scores(self, pos: int) -> np.ndarray:
+        score = BASE_COMPATIBILITY + PAIR_BONUS + self._rule_scores(self.keyword_mask(pos))
+        return np.clip(score, MIN_COMPATIBILITY, 100)
+
+    # Топ-k партнёров: список (позиция, совместимость), сам аромат не учитывается
+    def top_partners(self, pos: int, k: int = 10) -> list:
+        score = self.scores(pos)
+        key = score * (self.size + 1) + self._tiebreak
+        key[pos] = -1
+        k = min(k, self.size - 1)
+        if k <= 0:
+            return []
+        top = np.argpartition(-key, k - 1)[:k]
+        top = top[np.argsort(-key[top])]
+        return [(int(p), int(score[p])) for p in top]
+
+    # Дополнение микса до тройки: к двум ароматам — лучший третий, к одному — лучшая пара.
+    # Список (позиции добавленных ароматов, совместимость тройки), лучшие первыми
+    def complete(self, positions: list, k: int = 5, time_limit: float = COMPLETE_TIME_LIMIT) -> list:
+        if len(positions) == 2:
+            return self._best_thirds(positions, k)
+        if len(positions) == 1:
+            return self._best_pairs(positions[0], k, time_limit)
+        raise ValueError("Дополнить можно микс из 1–2 ароматов")
+
+    def _best_thirds(self, positions: list, k: int) -> list:
+        own = self.keyword_mask(positions[0]) | self.keyword_mask(positions[1])
+        score = np.clip(BASE_COMPATIBILITY + TRIPLE_BONUS + self._rule_scores(own), MIN_COMPATIBILITY, 100)
+        key = score * (self.size + 1) + self._tiebreak
+        key[list(positions)] = -1
+        k = min(k, self.size - len(set(positions)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-key, k - 1)[:k]
+        top = top[np.argsort(-key[top])]
+        return [([int(p)], int(score[p])) for p in top]
+
+    # Лучшие пары к аромату pos без перебора всех N² пар — ветви и границы.
+    # Положительное правило выполнено в паре (j, x), только если j и x вместе покрывают его недостающие
+    # слова, поэтому вклад правила не больше bonus * (доля слов у j + доля слов у x). Отсюда граница
+    # сверху для пары: base + f[j] + f[x] + neg[j], где f — сумма таких долей, а neg — штрафы,
+    # которые j набирает уже сам. Ароматы j перебираются по убыванию границы (при равной — сначала
+    # популярные); перебор заканчивается, когда граница не выше k-го найденного результата, а для
+    # каждого j точно считаются только партнёры x с достаточно большим f[x]. От каждого j в топ
+    # попадает одна пара — его лучший партнёр; сильный партнёр x при этом может повторяться в
+    # нескольких вариантах (в паре с разными j).
+    # Обычно первый же j даёт совместимость 100 и перебор сразу заканчивается; если граница
+    # долго остаётся выше найденного, через time_limit секунд возвращаются лучшие из найденных.
+    def _best_pairs(self, pos: int, k: int, time_limit: float) -> list:
+        deadline = time.perf_counter() + time_limit
+        k = min(k, self.size - 2)
+        if k <= 0:
+            return []
+        own = self.keyword_mask(pos)
+        base = BASE_COMPATIBILITY + TRIPLE_BONUS
+        f = np.zeros(self.size, dtype=np.float64)
+        neg = np.zeros(self.size, dtype=np.int64)
+        for mask, value in self._scored:
+            needed = mask & ~own
+            if not needed:
+                base += value
+                continue
+            count = np.zeros(self.size, dtype=np.int64)
+            total = 0
+            while needed:
+                low = needed & -needed
+                count += self._has_keyword(low.bit_length() - 1)
+                total += 1
+                needed ^= low
+            if value > 0:
+                f += count * (value / total)
+            else:
+                neg += value * (count == total)
+        f[pos] = -np.inf
+
+        by_f = np.argsort(-f, kind="stable")
+        sorted_f = f[by_f]
+        best_other = np.full(self.size, sorted_f[0])
+        best_other[by_f[0]] = sorted_f[1]
+        bound = np.minimum(base + f + best_other + neg, 100)
+        visited = np.zeros(self.size, dtype=bool)
+        visited[pos] = True
+
+        eps = 1e-9
+        top = []  # куча (совместимость, популярность, j, x)
+        for j in np.lexsort((-self._tiebreak, -bound)).tolist():
+            if visited[j]:
+                continue
+            if len(top) == k and bound[j] <= top[0][0] + eps:
+                break
+            if top and time.perf_counter() > deadline:
+                logging.info(f"Подбор пары к {pos}: перебор остановлен через {time_limit} с, граница {bound[j]:.0f}%")
+                break
+            visited[j] = True
+            worst = top[0][0] if len(top) == k else -np.inf
+            # партнёры j, с которыми пара ещё может попасть в топ (кроме уже перебранных j)
+            count = np.searchsorted(-sorted_f, -(worst - base - f[j] - neg[j] - eps), side="left")
+            candidates = by_f[:count]
+            candidates = candidates[~visited[candidates]]
+            if not len(candidates):
+                continue
+            score = BASE_COMPATIBILITY + TRIPLE_BONUS + self._rule_scores(own | self.keyword_mask(j), candidates)
+            score = np.clip(score, MIN_COMPATIBILITY, 100)
+            popularity = self._tiebreak[j] + self._tiebreak[candidates]
+            i = np.lexsort((-popularity, -score))[0]
+            item = (int(score[i]), int(popularity[i]), j, int(candidates[i]))
+            if len(top) < k:
+                heapq.heappush(top, item)
+            elif item[:2] > top[0][:2]:
+                heapq.heapreplace(top, item)
+
+        top.sort(reverse=True)
+        return [([j, x], score) for score, _, j, x in top]
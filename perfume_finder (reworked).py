@@ -1,14 +1,30 @@
-import pandas as pd
+from __future__ import annotations
+import time
+STARTED = time.perf_counter()
+
 import logging
 from typing import Optional
+from startup import LazyModule, StartupProfiler
+
+# pandas, numpy и чтение базы загружаются при первом поиске, а не при запуске.
+# pandas, numpy and catalog reading are imported on first search, not at startup.
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+catalog_cache = LazyModule("catalog_cache")
+profiler = StartupProfiler(STARTED)
+
+
+# Колонки базы, собранной catalog_ingest.py (схема Fragrantica) -> колонки этого поиска.
+# Columns of a base built by catalog_ingest.py (Fragrantica schema) -> columns used here.
+FINDER_COLUMNS = {"Name": "name", "Brand": "brand", "Main Accords": "notes", "Gender": "gender", "Season": "season"}
 
 
-# Загрузка базы парфюмов их csv файла с проверкой на ошибку.
-# Loading perfume base from CSV, with errors checking
+# Загрузка базы парфюмов их csv файла (или его бинарного снапшота) с проверкой на ошибку.
+# Loading perfume base from CSV (or its binary snapshot), with errors checking
 def base_load(filepath: str =
               "perfume_base(2).csv") -> Optional[pd.DataFrame]:
     try:
-        df = pd.read_csv(filepath)
+        df = catalog_cache.read_catalog(filepath).rename(columns=FINDER_COLUMNS)
         required_columns = {"name", "brand", "notes", "gender", "season"}
         if not required_columns.issubset(df.columns):
             missing = required_columns - set(df.columns)
@@ -34,6 +50,58 @@ def setup_logging():
     )
 
 
+# Колонки "через запятую", по которым можно искать.
+# Columns with comma-separated values available for search.
+ASPECT_COLUMNS = ("notes", "brand", "gender", "season")
+
+
+# Индекс, разобранный один раз: колонка -> значение -> позиции строк.
+# Поиск становится пересечением массивов позиций вместо .apply по каждой строке.
+# Index parsed once: column -> value -> row positions, so searching is a vectorized intersection.
+class AspectIndex:
+    def __init__(self, df: pd.DataFrame):
+        self.size = len(df)
+        self._rows = {}
+        for column in ASPECT_COLUMNS:
+            if column not in df.columns:
+                continue
+            items = {}
+            for pos, value in enumerate(df[column].tolist()):
+                for item in {i.strip().lower() for i in str(value).split(",")}:
+                    items.setdefault(item, []).append(pos)
+            self._rows[column] = {item: np.asarray(rows, dtype=np.int64) for item, rows in items.items()}
+
+    # Маска строк, где в каждой колонке есть все нужные значения (одна общая маска на весь запрос)
+    # Mask of rows containing all requested values in every column (one fused mask)
+    def mask(self, conditions: dict) -> np.ndarray:
+        positions = None
+        for column, values in conditions.items():
+            column_rows = self._rows[column]
+            for value in values:
+                rows = column_rows.get(value)
+                if rows is None:
+                    return np.zeros(self.size, dtype=bool)
+                positions = rows if positions is None else np.intersect1d(positions, rows, assume_unique=True)
+        result = np.zeros(self.size, dtype=bool)
+        if positions is None:
+            result[:] = True
+        else:
+            result[positions] = True
+        return result
+
+
+_aspect_index = None
+
+
+# Индекс для df строится при первом поиске и переиспользуется.
+# Index for df is built on the first search and then reused.
+def get_aspect_index(df: pd.DataFrame) -> AspectIndex:
+    global _aspect_index
+    if _aspect_index is None or _aspect_index[0] is not df:
+        _aspect_index = (df, AspectIndex(df))
+    return _aspect_index[1]
+
+
 # Функция поиска по нотам с обработкой ошибок.
 # Function of searching by notes with error handling
 def search_via_notes(df: pd.DataFrame, notes: str) -> Optional[pd.DataFrame]:
@@ -45,12 +113,7 @@ def search_via_notes(df: pd.DataFrame, notes: str) -> Optional[pd.DataFrame]:
         if not notes_to_find:
             logging.warning("Получен пустой список нот для поиска")
             return pd.DataFrame()
-        return df[df["notes"].apply(
-            lambda x: all(
-                n in [item.strip().lower() for item in str(x).split(",")]
-                for n in notes_to_find
-            )
-        )]
+        return df[get_aspect_index(df).mask({"notes": notes_to_find})]
     except Exception as e:
         logging.error(f"Ошибка поиска по нотам: {str(e)}", exc_info=True)
         return None
@@ -66,12 +129,7 @@ def search_via_brand(df: pd.DataFrame, brands: str) -> Optional[pd.DataFrame]:
         if not brands_to_find:
             logging.warning("Нет бренда для поиска")
             return pd.DataFrame()
-        return df[df["brands"].apply(
-            lambda x: all(
-                b in [item.strip().lower() for item in str(x).split(",")]
-                for b in brands_to_find
-            )
-        )]
+        return df[get_aspect_index(df).mask({"brand": brands_to_find})]
     except Exception as e:
         logging.error(f"Ошибка поиска по бренду: {str(e)}", exc_info=True)
         return None
@@ -87,12 +145,7 @@ def search_via_gender(df: pd.DataFrame, gender: str) -> Optional[pd.DataFrame]:
         if not gender_to_find:
             logging.warning("Нет пола для поиска")
             return pd.DataFrame()
-        return df[df["gender"].apply(
-            lambda x: all(
-                g in [item.strip().lower() for item in str(x).split(",")]
-                for g in gender_to_find
-            )
-        )]
+        return df[get_aspect_index(df).mask({"gender": gender_to_find})]
     except Exception as e:
         logging.error(f"Ошибка поиска по полу: {str(e)}", exc_info=True)
         return None
@@ -108,12 +161,7 @@ def search_via_season(df: pd.DataFrame, season: str) -> Optional[pd.DataFrame]:
         if not season_to_find:
             logging.warning("Нет сезона для поиска")
             return pd.DataFrame()
-        return df[df["season"].apply(
-            lambda x: all(
-                s in [item.strip().lower() for item in str(x).split(",")]
-                for s in season_to_find
-            )
-        )]
+        return df[get_aspect_index(df).mask({"season": season_to_find})]
     except Exception as e:
         logging.error(f"Ошибка поиска по сезону: {str(e)}", exc_info=True)
         return None
@@ -128,29 +176,81 @@ search_dictionary = {
     "сезон": search_via_season
     }
 
+# Названия аспектов в составном запросе -> колонки базы.
+# Aspect names in a combined query -> base columns.
+aspect_columns = {
+    "ноты": "notes", "notes": "notes",
+    "бренд": "brand", "brand": "brand",
+    "гендер": "gender", "gender": "gender",
+    "сезон": "season", "season": "season"
+    }
+
+
+# Разбор составного запроса "ноты=ваниль,тонка & сезон=winter & гендер=men".
+# Parsing of a combined query "notes=vanilla,tonka & season=winter & gender=men".
+def parse_combined_query(query: str) -> dict:
+    conditions = {}
+    for part in query.split("&"):
+        if not part.strip():
+            continue
+        if "=" not in part:
+            raise ValueError(f"Условие без '=': {part.strip()}")
+        aspect, values = part.split("=", 1)
+        aspect = aspect.strip().lower()
+        if aspect not in aspect_columns:
+            raise ValueError(f"Такого аспекта нет: {aspect}")
+        values = [v.strip().lower() for v in values.split(",") if v.strip()]
+        conditions.setdefault(aspect_columns[aspect], []).extend(values)
+    return conditions
+
+
+# Поиск сразу по нескольким аспектам одной общей маской.
+# Search by several aspects at once with a single fused mask.
+def search_combined(df: pd.DataFrame, query: str) -> Optional[pd.DataFrame]:
+    try:
+        if not isinstance(query, str):
+            raise ValueError("Запрос должен быть строкой")
+        conditions = parse_combined_query(query)
+        if not any(conditions.values()):
+            logging.warning("Получен пустой составной запрос")
+            return pd.DataFrame()
+        return df[get_aspect_index(df).mask(conditions)]
+    except Exception as e:
+        logging.error(f"Ошибка составного поиска: {str(e)}", exc_info=True)
+        return None
+
 
 # Главная функция.  Main function
 def main():
     setup_logging()
     logging.info("Запуск программы")
-    df = base_load()
-    if df is None:
-        logging.critical("Не удалось загрузить данные. Программа остановлена.")
-        return
     try:
-        print("Доступен поиск по: нотам, бренду, гендеру, сезону\n")
+        # база загружается после вопросов: меню появляется сразу, без ожидания pandas
+        print("Доступен поиск по: нотам, бренду, гендеру, сезону")
+        print("или составной запрос: ноты=ваниль,тонка & сезон=winter\n")
+        profiler.first_prompt()
         aspect = input("Введите аспект поиска: ").strip().lower()
-        if aspect not in search_dictionary:
-            print("Такого аспекта нет")
-            logging.warning
-            (f"Попытка поиска по несуществующему аспекту: {aspect}")
-            return
-        search_query = input(f"Что вы ищете по {aspect}: ").strip()
-        if not search_query:
-            print("Пустой запрос")
-            logging.warning("Получен пустой поисковый запрос")
+        if "=" in aspect:
+            search_query = aspect
+        else:
+            if aspect not in search_dictionary:
+                print("Такого аспекта нет")
+                logging.warning
+                (f"Попытка поиска по несуществующему аспекту: {aspect}")
+                return
+            search_query = input(f"Что вы ищете по {aspect}: ").strip()
+            if not search_query:
+                print("Пустой запрос")
+                logging.warning("Получен пустой поисковый запрос")
+                return
+        df = base_load()
+        if df is None:
+            logging.critical("Не удалось загрузить данные. Программа остановлена.")
             return
-        result = search_dictionary[aspect](df, search_query)
+        if "=" in aspect:
+            result = search_combined(df, search_query)
+        else:
+            result = search_dictionary[aspect](df, search_query)
         if result is None:
             print("Произошла ошибка при поиске")
         elif not result.empty:
@@ -168,4 +268,10 @@ def main():
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Поиск ароматов по нотам, бренду, гендеру и сезону")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="показать время до первого вопроса и выйти")
+    profiler.enabled = parser.parse_args().profile_startup
     main()
@@ -0,0 +1,67 @@
+from itertools import combinations
+
+import numpy as np
+
+from compact_catalog import column_texts
+from search_index import SearchIndex
+
+WORD_CACHE_SIZE = 100_000
+
+
+# Пресеты, один раз сопоставленные со строками базы.
+# Каждое название из ключа пресета ("Mancera French Riviera") -> позиция строки, где в названии
+# есть все его слова (при нескольких — с наибольшим числом отзывов).
+# Выбор пользователя ищется по неупорядоченному набору позиций — O(1) на запрос.
+class PresetRegistry:
+    def __init__(self, presets: dict, index: SearchIndex, fields=None, ratings=None):
+        self.keys = list(presets)
+        self.presets = presets
+        self._index = index
+        self._fields = fields
+        self._ratings = ratings
+        self._words = {}  # слово -> позиции: слова повторяются между названиями
+        self.rows = [tuple(self.resolve(name) for name in key) for key in self.keys]
+        self._by_rows = {}
+        for key, rows in zip(self.keys, self.rows):
+            if None not in rows:
+                self._by_rows.setdefault(frozenset(rows), key)
+
+    # Реестр для базы Fragrantica (колонка Name) или маленькой базы (brand + name)
+    @classmethod
+    def from_frame(cls, presets: dict, df, index: SearchIndex):
+        ratings = np.asarray(df["Rating Count"]) if "Rating Count" in df.columns else None
+        if "Name" in index.fields:
+            return cls(presets, index, ("Name",), ratings)
+        if {"brand", "name"}.issubset(df.columns):
+            names = [f"{brand} {name}" for brand, name in zip(column_texts(df, "brand"), column_texts(df, "name"))]
+            return cls(presets, SearchIndex({"name": names}), None, ratings)
+        return cls(presets, SearchIndex({}), None, ratings)
+
+    # Позиция строки для названия (все слова есть в названии) или None; используется и в пакетном анализе
+    def resolve(self, name: str):
+        rows = None
+        for word in name.lower().split():
+            hits = self._words.get(word)
+            if hits is None:
+                if len(self._words) >= WORD_CACHE_SIZE:
+                    self._words.clear()
+                hits = self._words[word] = self._index.search(word, fields=self._fields)
+            rows = hits if rows is None else np.intersect1d(rows, hits, assume_unique=True)
+            if not len(rows):
+                return None
+        if rows is None:
+            return None
+        if self._ratings is not None:
+            return int(rows[np.argmax(np.nan_to_num(self._ratings[rows], nan=-1))])
+        return int(rows[0])
+
+    # Данные пресета по выбранным позициям (порядок не важен) или None.
+    # Как и раньше, пресет находится, если его ароматы входят в выбор из 2–3 штук
+    def match(self, positions) -> dict:
+        positions = list(positions)
+        for size in range(len(positions), 1, -1):
+            for combo in combinations(positions, size):
+                key = self._by_rows.get(frozenset(combo))
+                if key is not None:
+                    return self.presets[key]
+        return None
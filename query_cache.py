@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# Ключ кэша — запрос в том виде, в каком его видит поиск: без регистра и пробелов по краям
+def normalize_query(query: str) -> str:
+    return query.strip().lower()
+
+
+# LRU-кэш результатов поиска с временем жизни записей.
+# Результаты зависят от базы, поэтому кэш привязан к её версии (SearchIndex.version растёт с каждой
+# загрузкой): пришёл запрос с более новой версией — база перезагружена, старые записи выбрасываются целиком.
+class QueryCache:
+    def __init__(self, max_size: int = 4096, ttl: float = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # ключ -> (результат, время записи)
+        self._lock = threading.Lock()  # поиск в боте идёт из пула потоков
+
+    # Настройки из .env: SEARCH_CACHE_SIZE (0 — кэш выключен), SEARCH_CACHE_TTL
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_size=int(os.getenv("SEARCH_CACHE_SIZE", "4096")),
+            ttl=float(os.getenv("SEARCH_CACHE_TTL", "600")),
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, version, key):
+        with self._lock:
+            if self.version is not None and version < self.version:
+                self.misses += 1
+                return None  # запрос к старой версии, которая ещё дорабатывает после перезагрузки
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def _store(self, version, key, value):
+        with self._lock:
+            if version != self.version:
+                return  # база сменилась, пока считали
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    # Результат compute() для ключа из кэша или посчитанный и сохранённый.
+    # Результат отдаётся всем запросившим — менять его нельзя (массивы numpy помечаются только для чтения)
+    def get_or_compute(self, version, key, compute):
+        if self.max_size <= 0:
+            return compute()
+        value = self._lookup(version, key)
+        if value is None:
+            value = compute()
+            if hasattr(value, "setflags"):
+                value.setflags(write=False)
+            self._store(version, key, value)
+        return value
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+# Общий кэш поиска процесса (бот и консольная версия)
+search_cache = QueryCache.from_env()
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+# Сколько пользователей с отказами помнить, чтобы не предупреждать их на каждое сообщение
+WARNED_SIZE = 10_000
+
+# Склейка одинаковых запросов: пока вычисление по ключу идёт, остальные запросившие ждут его же
+# результат, а не запускают своё. После завершения ключ освобождается — повторы берутся из кэшей.
+# Работает в event loop бота (asyncio), сами вычисления — в пуле CatalogExecutor.
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}  # ключ -> asyncio.Task
+        self.leaders = 0  # запущено вычислений
+        self.shared = 0  # запросов, дождавшихся чужого результата
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # ошибку получат ждущие; если их не осталось — не шуметь в логе
+
+    # Результат await func(*args) — общий для всех одновременных вызовов с этим ключом.
+    # Ошибка вычисления достаётся всем ждущим; отмена одного ждущего не отменяет вычисление
+    async def run(self, key, func, *args):
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(func(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {"leaders": self.leaders, "shared": self.shared, "inflight": len(self._inflight)}
+
+
+# Token bucket на пользователя: в ведре до burst жетонов, каждый запрос забирает один,
+# жетоны возвращаются со скоростью rate в секунду. Короткая серия нажатий проходит целиком,
+# а частые запросы дольше burst / rate секунд режутся до rate в секунду.
+class RateLimiter:
+    def __init__(self, rate: float = 1.0, burst: int = 5):
+        self.rate = rate
+        self.burst = burst
+        self.allowed = 0
+        self.limited = 0
+        self._buckets = {}  # пользователь -> [жетоны, время последнего пополнения]
+        self._sweep_at = 1024
+
+    # Настройки из .env: RATE_LIMIT_PER_SEC (0 — без ограничения), RATE_LIMIT_BURST
+    @classmethod
+    def from_env(cls):
+        return cls(
+            rate=float(os.getenv("RATE_LIMIT_PER_SEC", "1")),
+            burst=int(os.getenv("RATE_LIMIT_BURST", "5")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    # Можно ли выполнить запрос пользователя сейчас (если да — жетон списан)
+    def allow(self, user_id, now: float = None) -> bool:
+        if not self.enabled:
+            return True
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= self._sweep_at:
+                self._sweep(now)
+            bucket = self._buckets[user_id] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.allowed += 1
+            return True
+        self.limited += 1
+        return False
+
+    # Вёдра, которые успели наполниться, ничем не отличаются от новых — удаляем
+    def _sweep(self, now: float):
+        full = self.burst / self.rate
+        self._buckets = {user: b for user, b in self._buckets.items() if now - b[1] < full}
+        self._sweep_at = max(1024, 2 * len(self._buckets))
+
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "limited": self.limited, "users": len(self._buckets)}
+
+
+# Middleware aiogram для сообщений и кнопок: запросы сверх лимита не доходят до обработчиков.
+# На кнопку отвечаем всегда (иначе у пользователя крутятся часики), на сообщения —
+# один раз за серию отказов, чтобы не умножать запросы к Telegram
+class RateLimitMiddleware(BaseMiddleware):
+    def __init__(self, limiter: RateLimiter, text: str = "⏳ Слишком много запросов — подожди пару секунд"):
+        self.limiter = limiter
+        self.text = text
+        self._warned = set()  # кому уже ответили в текущей серии отказов
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, "from_user", None)
+        if user is None or self.limiter.allow(user.id):
+            self._warned.discard(getattr(user, "id", None))
+            return await handler(event, data)
+
+        logging.debug(f"Лимит запросов: пользователь {user.id}")
+        if isinstance(event, CallbackQuery):
+            await event.answer(self.text)
+        elif isinstance(event, Message) and user.id not in self._warned:
+            if len(self._warned) >= WARNED_SIZE:
+                self._warned.clear()  # в худшем случае кто-то получит предупреждение второй раз
+            self._warned.add(user.id)
+            await event.answer(self.text)
+        return None
@@ -0,0 +1,144 @@
+import json
+import os
+
+# Разделы файла правил и в каком порядке они применяются
+SECTIONS = ("positive", "negative", "risks")
+
+# До стольких правил быстрее проверить маски всех правил подряд, чем отбирать кандидатов по словам
+LINEAR_RULES = 256
+
+
+# Автомат Ахо-Корасик: за один проход по тексту находит все ключевые слова,
+# сколько бы их ни было в правилах
+class AhoCorasick:
+    def __init__(self, words):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for word_id, word in enumerate(words):
+            state = 0
+            for ch in word:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] += (word_id,)
+
+        # Ссылки неудач — обход в ширину
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    # Множество номеров слов, встретившихся в тексте
+    def find(self, text: str) -> set:
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+# Правила, скомпилированные в автомат + битовые маски:
+# у каждого правила маска нужных слов, у каждого слова — маска правил, где оно встречается.
+# Проверяются только правила, чьи слова нашлись в тексте.
+class CompiledRules:
+    def __init__(self, rules: dict):
+        self.rules = []  # (раздел, правило) в порядке применения
+        for section in SECTIONS:
+            for rule in rules.get(section, []):
+                self.rules.append((section, rule))
+
+        keyword_ids = {}
+        self.rule_masks = []
+        self._always = 0  # правила без ключевых слов срабатывают всегда
+        for rule_id, (_, rule) in enumerate(self.rules):
+            mask = 0
+            for word in rule.get("keywords", []):
+                mask |= 1 << keyword_ids.setdefault(word.lower(), len(keyword_ids))
+            self.rule_masks.append(mask)
+            if not mask:
+                self._always |= 1 << rule_id
+
+        self._by_section = {
+            section: [(mask, rule) for mask, (s, rule) in zip(self.rule_masks, self.rules) if s == section]
+            for section in SECTIONS
+        }
+
+        self.keywords = list(keyword_ids)
+        self._keyword_rules = [0] * len(self.keywords)
+        for rule_id, mask in enumerate(self.rule_masks):
+            while mask:
+                low = mask & -mask
+                self._keyword_rules[low.bit_length() - 1] |= 1 << rule_id
+                mask ^= low
+        self._automaton = AhoCorasick(self.keywords)
+
+    # Маска слов, встретившихся в тексте (текст уже в нижнем регистре)
+    def keyword_mask(self, text: str) -> int:
+        mask = 0
+        for word_id in self._automaton.find(text):
+            mask |= 1 << word_id
+        return mask
+
+    # Сработавшие правила по разделам, в исходном порядке
+    def match(self, text: str) -> dict:
+        return self.match_mask(self.keyword_mask(text))
+
+    def match_mask(self, present: int) -> dict:
+        if len(self.rules) <= LINEAR_RULES:
+            missing = ~present
+            return {section: [rule for mask, rule in rules if not mask & missing]
+                    for section, rules in self._by_section.items()}
+
+        candidates = self._always
+        rest = present
+        while rest:
+            low = rest & -rest
+            candidates |= self._keyword_rules[low.bit_length() - 1]
+            rest ^= low
+
+        matched = {section: [] for section in SECTIONS}
+        while candidates:
+            low = candidates & -candidates
+            rule_id = low.bit_length() - 1
+            candidates ^= low
+            if not self.rule_masks[rule_id] & ~present:
+                section, rule = self.rules[rule_id]
+                matched[section].append(rule)
+        return matched
+
+
+# Файл правил с перезагрузкой: перечитывается и компилируется заново только при смене mtime
+class RulesFile:
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime = None
+        self._compiled = None
+
+    # Скомпилированные правила или None, если файла нет
+    def get(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime = self._compiled = None
+            return None
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._compiled = CompiledRules(json.load(f))
+            self._mtime = mtime
+        return self._compiled
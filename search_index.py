@@ -0,0 +1,201 @@
+import itertools
+import mmap
+import re
+
+import numpy as np
+
+# Слово — непрерывная последовательность букв/цифр (как \w в re)
+TOKEN_RE = re.compile(r"\w+")
+
+# Колонки, по которым ищет search_perfumes в большой базе Fragrantica (Brand — в базе из catalog_ingest)
+SEARCH_FIELDS = ("Name", "Brand", "Main Accords", "Description", "Perfumers")
+
+# Куски запроса короче 3 символов дают слишком много кандидатов — для них прямой перебор
+MIN_PIECE = 3
+
+# Версии индексов в процессе: каждая загрузка базы получает новый номер (по нему сбрасываются кэши)
+_versions = itertools.count(1)
+
+
+def lower_text(value) -> str:
+    if isinstance(value, str):
+        return value.lower()
+    if value is None or value != value:  # None / NaN
+        return ""
+    return str(value).lower()
+
+
+# Слово -> строки для всех слов текстов (texts — по списку строк на колонку)
+def _build(texts: list) -> dict:
+    size = len(texts[0]) if texts else 0
+    postings = {}
+    for row in range(size):
+        tokens = set()
+        for field_texts in texts:
+            tokens.update(TOKEN_RE.findall(field_texts[row]))
+        for token in tokens:
+            postings.setdefault(token, []).append(row)
+
+    vocab = list(postings)
+    lengths = np.fromiter((len(postings[t]) for t in vocab), dtype=np.int64, count=len(vocab))
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    flat = np.fromiter(
+        (row for t in vocab for row in postings[t]), dtype=np.int32, count=int(offsets[-1])
+    )
+    return {**vocab_arrays(vocab), "offsets": offsets, "postings": flat}
+
+
+# Словарь -> склейка "\nслово1\nслово2\n..." и начало каждого слова в ней (используется и в catalog_ingest)
+def vocab_arrays(vocab: list) -> dict:
+    token_lens = np.fromiter(map(len, vocab), dtype=np.int64, count=len(vocab))
+    starts = np.ones(len(vocab), dtype=np.int64)
+    starts[1:] += np.cumsum(token_lens[:-1] + 1)
+    return {"blob": "\n" + "\n".join(vocab) + "\n", "starts": starts}
+
+
+# Тексты колонок в нижнем регистре одним utf-8 буфером: колонка за колонкой, в ней — строка за строкой.
+# Текст колонки f строки row — data[offsets[f * N + row]:offsets[f * N + row + 1]]
+def _pack_texts(texts: list) -> dict:
+    encoded = [text.encode("utf-8") for field_texts in texts for text in field_texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return {"text_data": b"".join(encoded), "text_offsets": offsets}
+
+
+# Начала всех вхождений needle в data (массив uint8): байты сравниваются сразу по всему массиву.
+# Для коротких запросов, где вхождений слишком много, чтобы перебирать их по одному
+def _find_all(data: np.ndarray, needle: bytes) -> np.ndarray:
+    if len(data) < len(needle):
+        return np.empty(0, dtype=np.int64)
+    found = np.flatnonzero(data[:len(data) - len(needle) + 1] == needle[0])
+    for shift in range(1, len(needle)):
+        if not len(found):
+            break
+        found = found[data[found + shift] == needle[shift]]
+    return found
+
+
+# Инвертированный индекс для подстрочного поиска.
+# Строится один раз при загрузке базы: слово -> номера строк (позиции в df),
+# а все слова склеены в одну строку, чтобы кусок запроса находить через str.find.
+# Кандидаты проверяются по текстам колонок в нижнем регистре — они лежат одним буфером байт
+# (bytes или mmap — поиск через .find без копирования), а не строками Python.
+# Результат совпадает с df[col].str.lower().str.contains(query, regex=False) по всем колонкам.
+class SearchIndex:
+    # arrays — готовые массивы из to_arrays() (например, из снапшота базы), иначе индекс строится заново.
+    # Если в arrays есть и тексты колонок, сами колонки не читаются (значения columns не нужны)
+    def __init__(self, columns: dict, arrays: dict = None):
+        self.fields = tuple(columns)
+        self.version = next(_versions)
+        if arrays is None or "text_data" not in arrays:
+            texts = [[lower_text(v) for v in values] for values in columns.values()]
+            arrays = {**(arrays or _build(texts)), **_pack_texts(texts)}
+
+        blob = arrays["blob"]
+        self._blob = blob if isinstance(blob, str) else blob.tobytes().decode("utf-8")
+        self._starts = arrays["starts"]
+        self._offsets = arrays["offsets"]
+        self._postings = arrays["postings"]
+        text = arrays["text_data"]
+        self._text = text if isinstance(text, (bytes, mmap.mmap)) else text.tobytes()
+        self._text_offsets = arrays["text_offsets"]
+        self.size = (len(self._text_offsets) - 1) // len(self.fields) if self.fields else 0
+
+    @classmethod
+    def from_frame(cls, df, fields=SEARCH_FIELDS, arrays: dict = None):
+        fields = [f for f in fields if f in df.columns]
+        if arrays is not None and "text_data" in arrays:
+            return cls(dict.fromkeys(fields), arrays)
+        return cls({f: df[f].tolist() for f in fields}, arrays)
+
+    # Массивы индекса для сохранения на диск (numpy, без pickle)
+    def to_arrays(self) -> dict:
+        return {
+            "blob": np.frombuffer(self._blob.encode("utf-8"), dtype=np.uint8),
+            "starts": self._starts,
+            "offsets": self._offsets,
+            "postings": self._postings,
+            "text_data": np.frombuffer(self._text, dtype=np.uint8),
+            "text_offsets": self._text_offsets,
+        }
+
+    # Номера слов словаря, внутри которых встречается кусок запроса
+    def _token_ids(self, piece: str) -> np.ndarray:
+        blob = self._blob
+        hits = []
+        pos = blob.find(piece)
+        while pos != -1:
+            hits.append(pos)
+            pos = blob.find(piece, blob.find("\n", pos))
+        return np.searchsorted(self._starts, hits, side="right") - 1
+
+    def _piece_rows(self, piece: str) -> np.ndarray:
+        ids = self._token_ids(piece)
+        if len(ids) == 0:
+            return np.empty(0, dtype=np.int32)
+        lists = [self._postings[self._offsets[i]:self._offsets[i + 1]] for i in ids]
+        if len(lists) == 1:
+            return lists[0]
+        return np.unique(np.concatenate(lists))
+
+    # Строки, в текстах колонок field_ids которых есть needle: просмотр буфера целиком
+    def _scan(self, needle: bytes, field_ids: list) -> np.ndarray:
+        offsets = self._text_offsets
+        data = np.frombuffer(self._text, dtype=np.uint8)
+        found = []
+        for f in field_ids:
+            first = f * self.size
+            start, end = int(offsets[first]), int(offsets[first + self.size])
+            hits = _find_all(data[start:end], needle) + start
+            cells = np.searchsorted(offsets, hits, side="right") - 1
+            # вхождение не должно заходить в текст следующей строки
+            found.append(cells[hits + len(needle) <= offsets[cells + 1]] - first)
+        return np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+    # Проверка кандидатов из индекса: поиск только в их текстах
+    def _verify(self, needle: bytes, field_ids: list, candidates, limit=None) -> np.ndarray:
+        candidates = np.asarray(candidates, dtype=np.int64)
+        cells = [f * self.size + candidates for f in field_ids]
+        bounds = list(zip(*(self._text_offsets[c].tolist() for c in cells),
+                          *(self._text_offsets[c + 1].tolist() for c in cells)))
+        find = self._text.find
+        fields = range(len(field_ids))
+        found = []
+        for row, bound in zip(candidates.tolist(), bounds):
+            for f in fields:
+                if find(needle, bound[f], bound[len(field_ids) + f]) != -1:
+                    found.append(row)
+                    break
+            if limit is not None and len(found) >= limit:
+                break
+        return np.asarray(found, dtype=np.int64)
+
+    # Позиции строк (по возрастанию), где query — подстрока хотя бы одной из колонок
+    def search(self, query: str, limit=None, fields=None) -> np.ndarray:
+        query = query.lower()
+        if fields is None:
+            field_ids = list(range(len(self.fields)))
+        else:
+            field_ids = [self.fields.index(f) for f in fields if f in self.fields]
+        if not field_ids:
+            return np.empty(0, dtype=np.int64)
+
+        pieces = TOKEN_RE.findall(query)
+        long_pieces = sorted({p for p in pieces if len(p) >= MIN_PIECE}, key=len, reverse=True)
+        candidates = None
+        for piece in long_pieces:
+            rows = self._piece_rows(piece)
+            candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+            if len(candidates) == 0:
+                return np.empty(0, dtype=np.int64)
+        # Запрос из одного слова: слово словаря целиком лежит в одной колонке — проверка не нужна
+        if candidates is not None and pieces == [query] and len(field_ids) == len(self.fields):
+            return candidates[:limit].astype(np.int64)
+
+        needle = query.encode("utf-8")
+        if not needle:
+            return np.arange(self.size, dtype=np.int64)[:limit]
+        if candidates is not None:
+            return self._verify(needle, field_ids, candidates, limit)
+        return self._scan(needle, field_ids)[:limit]
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+
+# Хранилище FSM в памяти с ограничениями: сессии без активности дольше ttl удаляются,
+# а если все данные вместе превысили max_bytes — удаляются самые давно не использованные.
+# Данные хранятся сериализованными (pickle): это и копия, как в MemoryStorage, и точный размер сессии.
+class BoundedMemoryStorage(BaseStorage):
+    def __init__(self, ttl: float = 3600, max_bytes: int = 64 * 2 ** 20, sweep_interval: float = 60):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.evicted = 0
+        self._sessions = OrderedDict()  # ключ -> [состояние, данные (pickle), время последнего обращения]
+        self._bytes = 0
+        self._last_sweep = time.monotonic()
+
+    # Настройки из .env: SESSION_TTL (секунды), SESSION_MAX_MB
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.getenv("SESSION_TTL", "3600")),
+            max_bytes=int(float(os.getenv("SESSION_MAX_MB", "64")) * 2 ** 20),
+        )
+
+    @property
+    def size(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def _drop(self, key):
+        _, data, _ = self._sessions.pop(key)
+        self._bytes -= len(data)
+        self.evicted += 1
+
+    # Удаление простаивающих сессий (в порядке последнего обращения — самые старые в начале)
+    def _sweep(self, now: float):
+        self._last_sweep = now
+        while self._sessions:
+            key, (_, _, touched) = next(iter(self._sessions.items()))
+            if now - touched < self.ttl:
+                break
+            self._drop(key)
+
+    def _get(self, key):
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._sweep(now)
+        session = self._sessions.get(key)
+        if session is None:
+            return None
+        if now - session[2] >= self.ttl:
+            self._drop(key)
+            return None
+        session[2] = now
+        self._sessions.move_to_end(key)
+        return session
+
+    def _put(self, key, state, data: bytes):
+        old = self._sessions.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old[1])
+        if state is None and not data:
+            return
+        self._sessions[key] = [state, data, time.monotonic()]
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            self._drop(next(iter(self._sessions)))
+
+    async def set_state(self, key, state=None):
+        session = self._get(key)
+        state = state.state if isinstance(state, State) else state
+        self._put(key, state, session[1] if session else b"")
+
+    async def get_state(self, key):
+        session = self._get(key)
+        return session[0] if session else None
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        session = self._get(key)
+        self._put(key, session[0] if session else None, pickle.dumps(data) if data else b"")
+
+    async def get_data(self, key):
+        session = self._get(key)
+        return pickle.loads(session[1]) if session and session[1] else {}
+
+    async def close(self):
+        self._sessions.clear()
+        self._bytes = 0
+
+
+# Пул соединений с SQLite: у каждого потока пула своё соединение (WAL — читатели не ждут писателя)
+class SQLitePool:
+    def __init__(self, path: str, size: int = 4):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sqlite")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    # func(connection) в потоке пула
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(self._connection(), *args))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+_KEEP = object()  # поле сессии не менялось — в базе оставить как есть
+
+
+# Хранилище FSM в локальном SQLite: переживает перезапуск бота и общее для нескольких процессов.
+# Запись пакетная: set_state/set_data попадают в буфер (повторные изменения одной сессии
+# схлопываются), который раз в flush_interval или при batch_size сессиях пишется одной транзакцией.
+# Чтение сначала смотрит в буфер, потом в пакет, который пишется прямо сейчас, потом в базу.
+# Сессии без изменений дольше ttl удаляются.
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str = "fsm.sqlite3", pool_size: int = 4, ttl: float = 3600,
+                 flush_interval: float = 0.05, batch_size: int = 500, cleanup_interval: float = 60):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cleanup_interval = cleanup_interval
+        self._keys = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._pool = SQLitePool(path, pool_size)
+        self._pending = {}  # ключ -> [состояние, данные (json)] или _KEEP
+        self._inflight = {}  # пакет, который сейчас пишется (до коммита его нет ни в буфере, ни в базе)
+        self._wake = None
+        self._flusher = None
+        self._closing = False
+        self._last_cleanup = 0.0
+
+        with sqlite3.connect(path) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT, updated REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS fsm_updated ON fsm (updated)")
+        connection.close()
+
+    # Настройки из .env: FSM_SQLITE_PATH, FSM_SQLITE_POOL, SESSION_TTL
+    @classmethod
+    def from_env(cls):
+        return cls(
+            path=os.getenv("FSM_SQLITE_PATH", "fsm.sqlite3"),
+            pool_size=int(os.getenv("FSM_SQLITE_POOL", "4")),
+            ttl=float(os.getenv("SESSION_TTL", "3600")),
+        )
+
+    def _write(self, key, state=_KEEP, data=_KEEP):
+        entry = self._pending.setdefault(self._keys.build(key), [_KEEP, _KEEP])
+        if state is not _KEEP:
+            entry[0] = state
+        if data is not _KEEP:
+            entry[1] = data
+        if self._flusher is None:
+            self._wake = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Не удалось записать сессии в SQLite: {e}")
+
+    @staticmethod
+    def _flush_batch(connection, batch: dict, expired_before):
+        now = time.time()
+        both, states, datas = [], [], []
+        for key, (state, data) in batch.items():
+            if state is not _KEEP and data is not _KEEP:
+                both.append((key, state, data, now))
+            elif state is not _KEEP:
+                states.append((key, state, now))
+            else:
+                datas.append((key, data, now))
+        with connection:
+            connection.executemany(
+                "INSERT INTO fsm (key, state, data, updated) VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE "
+                "SET state = excluded.state, data = excluded.data, updated = excluded.updated", both)
+            connection.executemany(
+                "INSERT INTO fsm (key, state, updated) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE "
+                "SET state = excluded.state, updated = excluded.updated", states)
+            connection.executemany(
+                "INSERT INTO fsm (key, data, updated) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE "
+                "SET data = excluded.data, updated = excluded.updated", datas)
+            if expired_before is not None:
+                connection.execute("DELETE FROM fsm WHERE updated < ?", (expired_before,))
+
+    # Записать буфер (и раз в cleanup_interval удалить просроченные сессии)
+    async def flush(self):
+        expired_before = None
+        if time.monotonic() - self._last_cleanup >= self.cleanup_interval:
+            self._last_cleanup = time.monotonic()
+            expired_before = time.time() - self.ttl
+        if not self._pending and expired_before is None:
+            return
+        batch, self._pending = self._pending, {}
+        self._inflight = batch
+        try:
+            await self._pool.run(self._flush_batch, batch, expired_before)
+        except Exception:
+            # не потерять изменения: вернуть их в буфер, если новых по этим ключам ещё нет
+            for key, entry in batch.items():
+                pending = self._pending.setdefault(key, [_KEEP, _KEEP])
+                for i in range(2):
+                    if pending[i] is _KEEP:
+                        pending[i] = entry[i]
+            raise
+        finally:
+            self._inflight = {}
+
+    def _read(self, connection, key: str):
+        return connection.execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND updated >= ?", (key, time.time() - self.ttl)
+        ).fetchone()
+
+    # Ещё не записанные поля сессии: буфер поверх пакета, который пишется сейчас
+    def _buffered(self, key: str) -> list:
+        entry = list(self._pending.get(key, [_KEEP, _KEEP]))
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            entry = [inflight[i] if entry[i] is _KEEP else entry[i] for i in range(2)]
+        return entry
+
+    async def _get(self, key):
+        key = self._keys.build(key)
+        entry = self._buffered(key)
+        if entry[0] is _KEEP or entry[1] is _KEEP:
+            row = await self._pool.run(self._read, key) or (None, None)
+            # пока шло чтение, буфер мог измениться, а пакет — записаться в базу уже после нашего SELECT
+            before, entry = entry, self._buffered(key)
+            return [entry[i] if entry[i] is not _KEEP else before[i] if before[i] is not _KEEP else row[i]
+                    for i in range(2)]
+        return entry
+
+    async def set_state(self, key, state=None):
+        self._write(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key):
+        state, _ = await self._get(key)
+        return state
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        self._write(key, data=json.dumps(data, ensure_ascii=False) if data else None)
+
+    async def get_data(self, key):
+        _, data = await self._get(key)
+        return json.loads(data) if data else {}
+
+    async def close(self):
+        # не отменять запись посреди пакета: иначе финальный flush пойдёт другим соединением
+        # параллельно, и старый пакет может закоммититься последним
+        if self._flusher is not None:
+            self._closing = True
+            self._wake.set()
+            await self._flusher
+            self._flusher = None
+        await self.flush()
+        self._pool.close()
+
+
+# Хранилище сессий по FSM_STORAGE в .env: memory (по умолчанию) или sqlite
+def storage_from_env() -> BaseStorage:
+    if os.getenv("FSM_STORAGE", "memory").lower() == "sqlite":
+        return SQLiteStorage.from_env()
+    return BoundedMemoryStorage.from_env()
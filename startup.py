@@ -0,0 +1,48 @@
+import importlib
+import os
+import sys
+import time
+
+
+# Модуль, который импортируется только при первом обращении к его атрибуту:
+# pd = LazyModule("pandas") стоит ничего, пока не вызван pd.DataFrame(...)
+class LazyModule:
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+
+# Сколько секунд назад запущен процесс (Linux, по /proc), иначе None
+def process_uptime():
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+# --profile-startup: перед первым вопросом пользователю печатает, сколько прошло с запуска,
+# какие тяжёлые модули уже загружены, и завершает программу
+class StartupProfiler:
+    def __init__(self, started: float):
+        self.started = started
+        self.enabled = False
+
+    def first_prompt(self):
+        if not self.enabled:
+            return
+        elapsed = (time.perf_counter() - self.started) * 1000
+        uptime = process_uptime()
+        print(f"До первого вопроса: {elapsed:.0f} мс от начала загрузки программы", end="")
+        print(f", {uptime * 1000:.0f} мс от запуска процесса" if uptime is not None else "")
+        heavy = [name for name in ("pandas", "numpy") if name in sys.modules]
+        print(f"Уже загружены: {', '.join(heavy) if heavy else 'ни pandas, ни numpy'}")
+        sys.exit(0)
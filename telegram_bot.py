@@ -1,42 +1,76 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultArticle, InputTextMessageContent
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 import os
-import pandas as pd
+import hashlib
+import json
+import shutil
+import threading
+import numpy as np
+from catalog_cache import file_info, file_matches
+from compact_catalog import load_arrays, load_compact, open_store, replace_dir, save_arrays
+from catalog_executor import CatalogExecutor, ExecutorBusy
+from partners import PartnerRecommender
+from compat_matrix import TopPartnersTable, catalog_fingerprint
+from preset_registry import PresetRegistry
+from fuzzy_index import WORD_RE, FuzzyIndex
+from autocomplete import Autocomplete
+from rules_engine import RulesFile
+from layering_analysis import layering_result, layering_text
+from metrics import Metrics
+from query_cache import normalize_query, search_cache
+from session_storage import storage_from_env
+from catalog_reload import CatalogHolder, file_stamp
+from request_limits import RateLimiter, RateLimitMiddleware, SingleFlight
+from webhook import WebhookServer
 
 load_dotenv()  # загружает .env
 TOKEN = os.getenv("BOT_TOKEN")
+# Кто может перезагружать базу командой /reload (id пользователей через запятую)
+ADMIN_IDS = {int(i) for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()}
 
 if not TOKEN:
     raise ValueError("Токен бота не найден! Добавь BOT_TOKEN в .env файл")
 
-# Загрузка базы
-def load_base():
-    df = pd.DataFrame()  # дефолт на пустой
+# Метрики задержек (загрузка базы, поиск, анализ, FSM, запросы к Telegram) — выключены, если не заданы
+# METRICS_PORT / METRICS_LOG_INTERVAL в .env
+metrics = Metrics.from_env()
+metrics.collect("search_cache", search_cache.stats)
+
+# Загрузка базы в компактном виде (сохранённая compact_catalog.py открывается через mmap).
+# Возвращает (база, индекс, (путь к файлу базы, его размер и mtime до загрузки)).
+# source_path — при перезагрузке: только этот файл, без запасной маленькой базы (если большая
+# пропала или подменяется, перезагрузка не удаётся и остаётся старая версия)
+@metrics.timed("catalog_load")
+def load_base(source_path=None):
+    if source_path is not None:
+        source = (source_path, file_stamp(source_path))
+        store, index = load_compact(source_path)
+        print(f"Загружена база {source_path}: {len(store)} ароматов")
+        return store, index, source
     try:
-        df = pd.read_csv("fra_perfumes.csv", encoding='utf-8')
-        print(f"Загружена большая база: {len(df)} ароматов")
-        print("Колонки в базе:", df.columns.tolist())  # отладка здесь безопасна
-        return df
+        source = ("fra_perfumes.csv", file_stamp("fra_perfumes.csv"))
+        store, index = load_compact("fra_perfumes.csv")
+        print(f"Загружена большая база: {len(store)} ароматов")
+        print("Колонки в базе:", store.columns)  # отладка здесь безопасна
+        return store, index, source
     except FileNotFoundError:
         try:
-            df = pd.read_csv("perfume_base(2).csv", encoding='utf-8')
-            print(f"Загружена маленькая база: {len(df)} ароматов")
-            print("Колонки в базе:", df.columns.tolist())
-            return df
+            source = ("perfume_base(2).csv", file_stamp("perfume_base(2).csv"))
+            store, index = load_compact("perfume_base(2).csv")
+            print(f"Загружена маленькая база: {len(store)} ароматов")
+            print("Колонки в базе:", store.columns)
+            return store, index, source
         except:
             print("База не найдена!")
-            return pd.DataFrame()
-
-df = load_base()
-if df.empty:
-    raise Exception("Не удалось загрузить базу")
+            return None, None, None
 
 def get_perfume_id(row):
     brand = get_brand(row)
@@ -45,8 +79,13 @@ def get_perfume_id(row):
 
 # Универсальные функции
 def get_brand(row):
+    brand = row.get("Brand")  # отдельная колонка есть в базе из catalog_ingest.py
+    if isinstance(brand, str):
+        return brand
+    return brand_from_name(row.get("Name", ""))
+
+def brand_from_name(name):
     # Ищем колонку с брендом (часто в Name до "-")
-    name = row.get("Name", "")
     if '-' in name:
         return name.split('-')[0].strip()
     words = name.split()
@@ -55,34 +94,54 @@ def get_brand(row):
 def get_name(row):
     return row.get("Name", "Без названия")
 
-# Поиск (универсальный для большой базы)
-def search_perfumes(query: str):
-    if df.empty or not query.strip():
-        return pd.DataFrame()
-
-    query = query.lower().strip()
-
-    mask = pd.Series([False] * len(df))
-
-    # Точная колонка "Name" — начало или любое место
-    if "Name" in df.columns:
-        mask = mask | df["Name"].astype(str).str.lower().str.contains(query, na=False)
-
-    # Main Accords — аккорды
-    if "Main Accords" in df.columns:
-        mask = mask | df["Main Accords"].astype(str).str.lower().str.contains(query, na=False)
-
-    # Perfumers — парфюмеры (часто бренды)
-    if "Perfumers" in df.columns:
-        mask = mask | df["Perfumers"].astype(str).str.lower().str.contains(query, na=False)
-
-    # Description — дополнительно
-    if "Description" in df.columns:
-        mask = mask | df["Description"].astype(str).str.lower().str.contains(query, na=False)
+# get_perfume_id строки по колонкам (None — у строки нет названия)
+def perfume_key(name, brand):
+    if not isinstance(name, str):
+        return None
+    brand = brand if isinstance(brand, str) else brand_from_name(name)
+    return f"{brand} - {name}".lower().strip()
 
-    results = df[mask].head(10).reset_index(drop=True)
-    print(f"Запрос '{query}': найдено {len(results)} ароматов")  # отладка
-    return results
+def _id_hash(perfume_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(perfume_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+# Индекс get_perfume_id -> позиция строки в базе, строится один раз при загрузке.
+# Вместо dict — отсортированные 64-битные хеши id и позиции: массивы можно сохранить и открыть
+# через mmap во всех воркерах bot_workers.py. Совпадение хеша проверяется по самой строке
+class PerfumeIndex:
+    def __init__(self, store, arrays: dict = None):
+        self.store = store
+        if arrays is None:
+            arrays = self._build(store)
+        self._hashes = arrays["hashes"]
+        self._positions = arrays["positions"]
+
+    @staticmethod
+    def _build(store) -> dict:
+        hashes, positions = [], []
+        if "Name" in store.columns:
+            brands = store["Brand"].tolist() if "Brand" in store.columns else [None] * len(store)
+            for pos, (name, brand) in enumerate(zip(store["Name"].tolist(), brands)):
+                key = perfume_key(name, brand)
+                if key is not None:
+                    hashes.append(_id_hash(key))
+                    positions.append(pos)
+        hashes = np.array(hashes, dtype=np.uint64)
+        order = np.argsort(hashes, kind="stable")  # среди одинаковых id первой идёт первая строка
+        return {"hashes": hashes[order], "positions": np.array(positions, dtype=np.int64)[order]}
+
+    def to_arrays(self) -> dict:
+        return {"hashes": self._hashes, "positions": self._positions}
+
+    def get(self, perfume_id, default=None):
+        h = np.uint64(_id_hash(perfume_id))
+        i = int(np.searchsorted(self._hashes, h))
+        while i < len(self._hashes) and self._hashes[i] == h:
+            pos = int(self._positions[i])
+            brand = self.store["Brand"][pos] if "Brand" in self.store.columns else None
+            if perfume_key(self.store["Name"][pos], brand) == perfume_id:
+                return pos
+            i += 1
+        return default
 
 # Пресеты (твой полный словарь — вставь все 5 миксов)
 PRESETS = {
@@ -155,21 +214,164 @@ PRESETS = {
     }
 }
 
+# Подбор лучших пар по правилам layering_rules.json (как в консольной версии)
+rules_file = RulesFile("layering_rules.json")
+
+# Одна версия базы со всеми индексами по ней. После создания не меняется (ленивые индексы
+# строятся один раз): при перезагрузке собирается новый Catalog, а запросы, начатые на старом,
+# дорабатывают на нём. Обработчики берут catalogs.current один раз в начале.
+class Catalog:
+    def __init__(self, store, search_index, source, fingerprint=None, perfume_index=None):
+        self.store = store  # CompactCatalog: строки через store.row(pos) / store.rows(positions)
+        self.search_index = search_index
+        self.version = search_index.version  # номер версии в процессе (для кэша поиска)
+        self.source = source
+        self.fingerprint = fingerprint or catalog_fingerprint(store)
+        # короткий отпечаток содержимого — сохраняется в сессиях и кнопках, чтобы узнать устаревшие позиции
+        self.catalog_id = self.fingerprint[:8]
+        self.perfume_index = perfume_index if perfume_index is not None else PerfumeIndex(store)
+        # Пресеты сопоставляются со строками базы один раз
+        self.preset_registry = PresetRegistry.from_frame(PRESETS, store, search_index)
+        # Готовая таблица топ-N из compat_matrix.py, если она посчитана для этой базы (открывается через mmap)
+        self.top_partners_table = TopPartnersTable.open(store, fingerprint=self.fingerprint)
+        self.autocomplete = None
+        self._fuzzy_index = None
+        self._fuzzy_lock = threading.Lock()
+        self._recommender = None
+        self._recommender_lock = threading.Lock()
+
+    # Сохранить версию целиком (база, поисковый индекс и все индексы бота) в папку path —
+    # атомарно, как compact_catalog. Её открывают через mmap воркеры bot_workers.py (Catalog.attach)
+    def publish(self, path: str):
+        rules = file_info(rules_file.path) if os.path.exists(rules_file.path) else None  # до сборки битсетов
+        self.warm_up()
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        self.store.save(tmp_path, self.search_index)
+        save_arrays(tmp_path, "perfume_index", self.perfume_index.to_arrays())
+        save_arrays(tmp_path, "fuzzy", self.fuzzy_index().to_arrays())
+        save_arrays(tmp_path, "autocomplete", self.autocomplete.to_arrays(), raw=("key_data",))
+        recommender = self.recommender()
+        if recommender is not None and rules is not None:
+            save_arrays(tmp_path, "partners", recommender.to_arrays())
+        shared = {"source": self.source, "fingerprint": self.fingerprint, "rules": rules}
+        with open(os.path.join(tmp_path, "shared.json"), "w", encoding="utf-8") as f:
+            json.dump(shared, f, ensure_ascii=False)
+        replace_dir(tmp_path, path)
+        logging.info(f"База опубликована в {path}: {len(self.store)} ароматов")
+        return path
+
+    # Версия, сохранённая publish: все массивы открываются через mmap (общие страницы для всех
+    # процессов), в памяти процесса — только мелкие объекты. Битсеты берутся, если правила не менялись
+    @classmethod
+    def attach(cls, path: str):
+        with open(os.path.join(path, "shared.json"), "r", encoding="utf-8") as f:
+            shared = json.load(f)
+        store, search_index = open_store(path)
+        source_path, stamp = shared["source"]
+        catalog = cls(store, search_index, (source_path, tuple(stamp)), shared["fingerprint"],
+                      PerfumeIndex(store, load_arrays(path, "perfume_index")))
+        catalog._fuzzy_index = FuzzyIndex.from_frame(store, arrays=load_arrays(path, "fuzzy"))
+        catalog.autocomplete = Autocomplete.from_frame(store, arrays=load_arrays(path, "autocomplete"))
+        rules = rules_file.get()
+        if rules is not None and shared["rules"] is not None and file_matches(rules_file.path, shared["rules"]):
+            bits = load_arrays(path, "partners").get("bits")
+            if bits is not None:
+                catalog._recommender = PartnerRecommender.from_frame(store, search_index, rules, bits=bits)
+        return catalog
+
+    # Строка базы по get_perfume_id, None — если такого аромата нет
+    def find_perfume(self, perfume_id):
+        pos = self.perfume_index.get(perfume_id)
+        return None if pos is None else self.store.row(pos)
+
+    # Нечёткий поиск с опечатками — запасной вариант, если точный ничего не нашёл.
+    # Индекс строится один раз (лениво или заранее в пуле потоков)
+    def fuzzy_index(self):
+        with self._fuzzy_lock:
+            if self._fuzzy_index is None:
+                self._fuzzy_index = FuzzyIndex.from_frame(self.store)
+            return self._fuzzy_index
+
+    # Автодополнение для inline-режима (@бот запрос) — строится заранее в пуле потоков
+    def build_autocomplete(self):
+        if self.autocomplete is None:
+            self.autocomplete = Autocomplete.from_frame(self.store)
+        return self.autocomplete
+
+    # Битсеты для подбора пар; пересобираются, если файл правил изменился
+    def recommender(self):
+        with self._recommender_lock:
+            rules = rules_file.get()
+            if rules is None:
+                return None
+            if self._recommender is None or self._recommender.rules is not rules:
+                self._recommender = PartnerRecommender.from_frame(self.store, self.search_index, rules)
+            return self._recommender
+
+    # Индексы, которые иначе строились бы на первом запросе и могли упереться в таймаут
+    def warm_up(self):
+        self.recommender()
+        self.fuzzy_index()
+        self.build_autocomplete()
+
+def build_catalog(source_path=None):
+    store, search_index, source = load_base(source_path)
+    if store is None or store.empty:
+        raise Exception("Не удалось загрузить базу")
+    return Catalog(store, search_index, source)
+
+# Новая версия при перезагрузке собирается целиком (вместе с индексами) до подмены
+def build_warm_catalog(source_path=None):
+    catalog = build_catalog(source_path)
+    catalog.warm_up()
+    return catalog
+
+# База загружается (или читается из снапшота) при старте; перезагрузка — /reload, SIGHUP или
+# изменение файла базы (CATALOG_WATCH_INTERVAL в .env)
+catalogs = CatalogHolder(build_warm_catalog, build_catalog())
+
+# Поиск (универсальный для большой базы)
+@metrics.timed("search")
+def search_perfumes(catalog, query: str):
+    if catalog.store.empty or not query.strip():
+        return catalog.store.rows([])
+
+    query = normalize_query(query)
+    # популярные запросы берутся из кэша; он сбрасывается при загрузке новой версии базы.
+    # В кэше — позиции строк, сами строки берутся из базы
+    positions = search_cache.get_or_compute(catalog.version, ("exact", query, 10),
+                                            lambda: catalog.search_index.search(query, limit=10))
+    results = catalog.store.rows(positions)
+    logging.debug(f"Запрос '{query}': найдено {len(results)} ароматов")
+    return results
+
+# Точный поиск, а если он пуст — нечёткий. Возвращает (результаты, нечёткий ли поиск)
+def find_perfumes(catalog, query: str):
+    results = search_perfumes(catalog, query)
+    if results.empty and query.strip():
+        key = ("fuzzy", " ".join(WORD_RE.findall(query.lower())), 10)
+        with metrics.timer("search_fuzzy"):
+            positions = search_cache.get_or_compute(catalog.version, key,
+                                                    lambda: catalog.fuzzy_index().search(query, limit=10))
+        return catalog.store.rows(positions), True
+    return results, False
+
 # Анализ лееринга
-def analyze_layering(perfumes):
-    selected_words = set()
-    for p in perfumes:
-        selected_words.update(get_name(p).lower().split())
-        selected_words.update(get_brand(p).lower().split())
-        if "Main Accords" in p.index:
-            selected_words.update(str(p["Main Accords"]).lower().split(", "))
-    
-    for key, data in PRESETS.items():
-        preset_words = set(word for name in key for word in name.lower().split())
-        if preset_words.issubset(selected_words):
-            return data
-
-    # Общий анализ
+@metrics.timed("analysis")
+def analyze_layering(catalog, perfumes):
+    # p.name — позиция строки в базе (строки берутся через store.row)
+    data = catalog.preset_registry.match(p.name for p in perfumes)
+    if data is not None:
+        return data
+
+    # По правилам layering_rules.json — как в консольной версии и в подборе пар/дополнений,
+    # чтобы проценты в анализе совпадали с предложенными ботом
+    rules = rules_file.get()
+    if rules is not None:
+        return layering_result(rules.match(layering_text(perfumes)), len(perfumes))
+
+    # Общий анализ (файла правил нет)
     return {
         "compatibility": 75,
         "vibe": "Уникальный экспериментальный микс 🧪",
@@ -177,16 +379,39 @@ def analyze_layering(perfumes):
         "tips": ["2–3 пшика", "Сначала лёгкий, потом тяжёлый"]
     }
 
+# Топ-k пар для аромата на позиции pos: [(строка, совместимость)]
+@metrics.timed("partners")
+def find_partners(catalog, pos, k=5):
+    table = catalog.top_partners_table
+    if table is not None and k <= table.top and table.rules_fresh():
+        top = table.top_partners(pos, k)
+    else:
+        recommender = catalog.recommender()
+        if recommender is None:
+            return []
+        top = recommender.top_partners(pos, k)
+    return [(catalog.store.row(p), compatibility) for p, compatibility in top]
+
+# Лучшие дополнения микса (позиции 1–2 ароматов) до тройки: [(добавленные строки, совместимость)]
+@metrics.timed("complete")
+def find_completions(catalog, positions, k=5):
+    recommender = catalog.recommender()
+    if recommender is None:
+        return []
+    return [(list(catalog.store.rows(added)), compatibility) for added, compatibility in recommender.complete(positions, k)]
+
 # Состояния (определены правильно — вне декораторов)
 class LayeringStates(StatesGroup):
     waiting_for_perfumes = State()
+    waiting_for_partner = State()
 
 # Клавиатуры
 def main_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔥 Готовые миксы", callback_data="presets")],
         [InlineKeyboardButton(text="🔍 Поиск аромата", callback_data="search")],
-        [InlineKeyboardButton(text="🎭 Создать лееринг", callback_data="layer")]
+        [InlineKeyboardButton(text="🎭 Создать лееринг", callback_data="layer")],
+        [InlineKeyboardButton(text="🤝 Лучшая пара к аромату", callback_data="partners")]
     ])
 
 def presets_keyboard():
@@ -197,9 +422,37 @@ def presets_keyboard():
     kb.inline_keyboard.append([InlineKeyboardButton(text="← Назад", callback_data="back_main")])
     return kb
 
-# Бот
-bot = Bot(token=TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# Бот. TELEGRAM_API_URL в .env — свой сервер Bot API (локальный telegram-bot-api или фейковый из bot_loadtest.py)
+api_url = os.getenv("TELEGRAM_API_URL")
+bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None)
+metrics.instrument_bot(bot)
+dp = Dispatcher(storage=metrics.wrap_storage(storage_from_env()))
+catalog_executor = CatalogExecutor.from_env()
+# Сколько секунд при старте ждать заранее собираемые индексы (потом они соберутся по первому запросу)
+PREBUILD_TIMEOUT = 600
+# Одинаковые поиски и анализы, пришедшие одновременно (пост со ссылкой на бота), считаются один раз
+single_flight = SingleFlight()
+metrics.collect("single_flight", single_flight.stats)
+# Лимит запросов на пользователя (RATE_LIMIT_PER_SEC / RATE_LIMIT_BURST в .env)
+rate_limiter = RateLimiter.from_env()
+metrics.collect("rate_limit", rate_limiter.stats)
+dp.message.outer_middleware(RateLimitMiddleware(rate_limiter))
+dp.callback_query.outer_middleware(RateLimitMiddleware(rate_limiter))
+
+# Поиск и анализ — в пуле потоков с таймаутом, чтобы один тяжёлый запрос не блокировал остальных.
+# Одновременные запросы с одинаковым key (по умолчанию — функция и аргументы) ждут одно вычисление.
+# None — запрос не выполнен (бот перегружен или таймаут), пользователю уже ответили через answer
+async def run_catalog_task(answer, func, *args, key=None):
+    try:
+        return await single_flight.run(key or (func,) + args, catalog_executor.run, func, *args)
+    except ExecutorBusy:
+        metrics.inc("executor_busy")
+        await answer("⏳ Бот сейчас перегружен, попробуй через пару секунд")
+    except asyncio.TimeoutError:
+        metrics.inc("executor_timeout")
+        logging.warning(f"Таймаут {func.__name__}{args}")
+        await answer("⏳ Запрос выполнялся слишком долго, попробуй уточнить его")
+    return None
 
 @dp.message(Command("start"))
 async def start(message: Message):
@@ -216,19 +469,17 @@ async def show_presets(callback: types.CallbackQuery):
 
 @dp.callback_query(F.data.regexp(r"preset_\d+"))
 async def send_preset(callback: types.CallbackQuery):
+    catalog = catalogs.current
     idx = int(callback.data.split("_")[1]) - 1
-    key = list(PRESETS.keys())[idx]
+    key = catalog.preset_registry.keys[idx]
     data = PRESETS[key]
 
     perfumes = []
-    name_col = "Name"
-    for preset_name in key:
-        search_term = "|".join(preset_name.lower().split())
-        match = df[df[name_col].str.lower().str.contains(search_term, na=False, regex=True)]
-        if not match.empty:
-            perfumes.append(match.iloc[0])
+    for preset_name, pos in zip(key, catalog.preset_registry.rows[idx]):
+        if pos is not None:
+            perfumes.append(catalog.store.row(pos))
         else:
-            perfumes.append(pd.Series({name_col: preset_name}))
+            perfumes.append({"Name": preset_name})
 
     text = f"🎭 **Готовый микс #{idx+1}**\n\n"
     text += "\n".join(f"• {get_brand(p)} - {get_name(p)}" for p in perfumes)
@@ -246,102 +497,152 @@ async def back_to_main(callback: types.CallbackQuery):
 # Ручной лееринг и поиск (исправленные версии)
 @dp.callback_query(F.data == "search")
 async def cmd_search(callback: types.CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("🔍 Введи запрос для поиска (название, бренд, нота):")
+    # состояние — до ответа: запрос, отправленный сразу после него, уже должен попасть в поиск
     await state.set_state(LayeringStates.waiting_for_perfumes)
     await state.update_data(selected_indices=[])
+    await callback.message.edit_text("🔍 Введи запрос для поиска (название, бренд, нота):")
+
+# Строки последних результатов поиска. В сессии хранятся только позиции строк, запрос и
+# отпечаток базы — сами строки берутся из общей базы, а не копируются в состояние каждого пользователя.
+# Если база с тех пор перезагрузилась, позиции устарели: запрос повторяется на новой версии.
+# Возвращает (результаты, повторён ли запрос) или None — пользователю уже ответили через answer
+async def load_results(catalog, state: FSMContext, data, answer):
+    if data.get("catalog_id") == catalog.catalog_id:
+        positions = [pos for pos in data.get("current_result_indices", []) if pos < len(catalog.store)]
+        return catalog.store.rows(positions), False
+    if not data.get("current_query"):
+        return catalog.store.rows([]), False
+    found = await run_catalog_task(answer, find_perfumes, catalog, data["current_query"],
+                                   key=(find_perfumes, catalog, normalize_query(data["current_query"])))
+    if found is None:
+        return None
+    results, _ = found
+    await state.update_data(catalog_id=catalog.catalog_id, current_result_indices=results.positions.tolist())
+    return results, True
+
+# Выбранные ароматы. В сессии — позиции строк в версии базы selected_catalog_id: у строк с одинаковыми
+# брендом и названием id совпадает, различает их только позиция. Если база с тех пор перезагрузилась,
+# позиции устарели — строки находятся по id (из одинаковых берётся первая)
+def selected_rows(catalog, data) -> list:
+    if data.get("selected_catalog_id") == catalog.catalog_id:
+        return [catalog.store.row(pos) for pos in data.get("selected_positions", []) if pos < len(catalog.store)]
+    rows = [catalog.find_perfume(pid) for pid in data.get("selected_perfume_ids", [])]
+    return [row for row in rows if row is not None]
+
+async def send_results(message: Message, results, selected, fuzzy=False):
+    kb = InlineKeyboardMarkup(inline_keyboard=[])
+    selected_positions = {row.name for row in selected}
+
+    for i, row in enumerate(results):
+        name = get_name(row)
+        brand = get_brand(row)
+        status = " ✅" if row.name in selected_positions else ""
+        text = f"{brand} - {name}{status}"
+        kb.inline_keyboard.append([InlineKeyboardButton(text=text, callback_data=f"select_{i}")])
+
+    kb.inline_keyboard.append([InlineKeyboardButton(text="✅ Готово — анализ", callback_data="analyze")])
+    if 1 <= len(selected) <= 2:
+        kb.inline_keyboard.append([InlineKeyboardButton(text="🧩 Дополнить до тройки", callback_data="complete")])
+    kb.inline_keyboard.append([InlineKeyboardButton(text="🔍 Новый поиск", callback_data="new_search")])
+    kb.inline_keyboard.append([InlineKeyboardButton(text="← Отмена", callback_data="back_main")])
+
+    text = f"Найдено {len(results)} ароматов. Выбрано: {len(selected)}/3\nВыбери ароматы:"
+    if fuzzy:
+        text = "Точных совпадений нет — возможно, ты имел в виду:\n" + text
+    await message.answer(text, reply_markup=kb)
 
 @dp.message(LayeringStates.waiting_for_perfumes)
 async def process_search(message: Message, state: FSMContext):
+    catalog = catalogs.current
     data = await state.get_data()
     query = message.text.strip() if message.text else None
 
-    selected_perfume_ids = data.get("selected_perfume_ids", [])
+    selected = selected_rows(catalog, data)
+    fuzzy = False
 
     if query:  # Новый поиск
-        results = search_perfumes(query)
+        found = await run_catalog_task(message.answer, find_perfumes, catalog, query,
+                                       key=(find_perfumes, catalog, normalize_query(query)))
+        if found is None:
+            return
+        results, fuzzy = found
         if results.empty:
             await message.answer("Ничего не найдено 😔\nПопробуй другой запрос:", reply_markup=main_keyboard())
             return
 
-        current_result_indices = results.index.tolist()
-        current_results = results.to_dict('records')
         await state.update_data(
-            current_result_indices=current_result_indices,
-            current_results=current_results,
-            selected_perfume_ids=selected_perfume_ids  # Сохраняем прошлые выборы
+            catalog_id=catalog.catalog_id,
+            current_query=query,
+            current_result_indices=results.positions.tolist(),
         )
     else:  # Обновление списка
-        current_results = data.get("current_results", [])
-        current_result_indices = data.get("current_result_indices", [])
-        if not current_results:
+        loaded = await load_results(catalog, state, data, message.answer)
+        if loaded is None:
+            return
+        results, _ = loaded
+        if results.empty:
             await message.answer("Сессия устарела — начни заново:", reply_markup=main_keyboard())
             await state.clear()
             return
 
-        results = pd.DataFrame(current_results)
-
-    kb = InlineKeyboardMarkup(inline_keyboard=[])
-
-    for i in range(len(results)):
-        row = results.iloc[i]
-        name = get_name(row)
-        brand = get_brand(row)
-        perfume_id = get_perfume_id(row)
-        status = " ✅" if perfume_id in selected_perfume_ids else ""
-        text = f"{brand} - {name}{status}"
-        kb.inline_keyboard.append([InlineKeyboardButton(text=text, callback_data=f"select_{i}")])
-
-    kb.inline_keyboard.append([InlineKeyboardButton(text="✅ Готово — анализ", callback_data="analyze")])
-    kb.inline_keyboard.append([InlineKeyboardButton(text="🔍 Новый поиск", callback_data="new_search")])
-    kb.inline_keyboard.append([InlineKeyboardButton(text="← Отмена", callback_data="back_main")])
-
-    text = f"Найдено {len(results)} ароматов. Выбрано: {len(selected_perfume_ids)}/3\nВыбери ароматы:"
-    await message.answer(text, reply_markup=kb)
+    await send_results(message, results, selected, fuzzy)
 
 @dp.callback_query(F.data.startswith("select_"))
 async def select_perfume(callback: types.CallbackQuery, state: FSMContext):
+    catalog = catalogs.current
     data = await state.get_data()
-    current_result_indices = data.get("current_result_indices", [])
-    selected_perfume_ids = data.get("selected_perfume_ids", [])
+    loaded = await load_results(catalog, state, data, callback.message.answer)
+    if loaded is None:
+        return
+    results, refreshed = loaded
+    selected = selected_rows(catalog, data)
+
+    if refreshed and not results.empty:  # номера кнопок относились к старой версии базы
+        await callback.answer("База обновилась — выбери аромат ещё раз", show_alert=True)
+        await send_results(callback.message, results, selected)
+        return
 
     local_idx = int(callback.data.split("_")[1])
-    row = df.loc[current_result_indices[local_idx]]
-    perfume_id = get_perfume_id(row)
+    if local_idx >= len(results):
+        await callback.answer("Сессия устарела — начни заново", show_alert=True)
+        return
+    row = results[local_idx]
 
-    if perfume_id in selected_perfume_ids:
+    if any(p.name == row.name for p in selected):
         await callback.answer("Уже выбран!", show_alert=True)
         return
 
-    if len(selected_perfume_ids) >= 3:
+    if len(selected) >= 3:
         await callback.answer("Максимум 3 аромата!", show_alert=True)
         return
 
-    selected_perfume_ids.append(perfume_id)
-    await state.update_data(selected_perfume_ids=selected_perfume_ids)
+    selected.append(row)
+    await state.update_data(
+        selected_catalog_id=catalog.catalog_id,
+        selected_positions=[p.name for p in selected],
+        selected_perfume_ids=[get_perfume_id(p) for p in selected],
+    )
 
     await callback.answer(f"Добавлено: {get_brand(row)} - {get_name(row)}")
 
-    # Обновляем список из сохранённых результатов
-    await process_search(callback.message, state)
+    # Обновляем список из сохранённых позиций
+    await send_results(callback.message, results, selected)
 
 @dp.callback_query(F.data == "analyze")
 async def do_analysis(callback: types.CallbackQuery, state: FSMContext):
+    catalog = catalogs.current
     data = await state.get_data()
-    selected_perfume_ids = data.get("selected_perfume_ids", [])
+    perfumes = selected_rows(catalog, data)
 
-    if len(selected_perfume_ids) < 2:
+    if len(perfumes) < 2:
         await callback.message.answer("Нужно минимум 2 аромата!", reply_markup=main_keyboard())
         await state.clear()
         return
 
-    # Находим строки по ID
-    perfumes = []
-    for pid in selected_perfume_ids:
-        mask = (df["brand"].str.lower() + " - " + df["name"].str.lower()).str.strip() == pid
-        if mask.any():
-            perfumes.append(df[mask].iloc[0])
-
-    analysis = analyze_layering(perfumes)
+    analysis = await run_catalog_task(callback.message.answer, analyze_layering, catalog, perfumes,
+                                      key=(analyze_layering, catalog, tuple(p.name for p in perfumes)))
+    if analysis is None:
+        return
 
     text = "🎭 **Твой лееринг готов!**\n\n"
     text += "\n".join(f"• {get_brand(p)} - {get_name(p)}" for p in perfumes)
@@ -353,20 +654,160 @@ async def do_analysis(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text(text, reply_markup=main_keyboard())
     await state.clear()
 
+# Подбор третьего аромата (или пары) к уже выбранным с наибольшей совместимостью по правилам
+@dp.callback_query(F.data == "complete")
+async def complete_layering(callback: types.CallbackQuery, state: FSMContext):
+    catalog = catalogs.current
+    data = await state.get_data()
+    chosen = selected_rows(catalog, data)
+    if not 1 <= len(chosen) <= 2:
+        await callback.answer("Выбери 1–2 аромата, чтобы дополнить микс", show_alert=True)
+        return
+
+    options = await run_catalog_task(callback.message.answer, find_completions, catalog, tuple(row.name for row in chosen))
+    if options is None:
+        return
+    if not options:
+        await callback.message.answer("Не удалось подобрать дополнение 😔", reply_markup=main_keyboard())
+        await state.clear()
+        return
+
+    text = "🧩 **Лучшие дополнения для " + " + ".join(f"{get_brand(p)} - {get_name(p)}" for p in chosen) + "**\n\n"
+    text += "\n".join(
+        f"{i}. + " + " + ".join(f"{get_brand(p)} - {get_name(p)}" for p in added) + f" — {compatibility}%"
+        for i, (added, compatibility) in enumerate(options, 1)
+    )
+    await callback.message.answer(text, reply_markup=main_keyboard())
+    await state.clear()
+
 @dp.callback_query(F.data == "layer")
 async def start_layer(callback: types.CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("🎭 Создай свой лееринг!\nВведи запрос для поиска первого аромата:")
     await state.set_state(LayeringStates.waiting_for_perfumes)
     await state.update_data(selected_indices=[])
+    await callback.message.edit_text("🎭 Создай свой лееринг!\nВведи запрос для поиска первого аромата:")
 
 @dp.callback_query(F.data == "new_search")
 async def new_search(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text("🔍 Введи новый запрос для поиска следующего аромата:")
     # Сохраняем текущий выбор, но не сбрасываем
 
+@dp.callback_query(F.data == "partners")
+async def start_partners(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(LayeringStates.waiting_for_partner)
+    await callback.message.edit_text("🤝 Подберу лучшие пары!\nВведи запрос для поиска аромата:")
+
+@dp.message(LayeringStates.waiting_for_partner)
+async def process_partner_search(message: Message, state: FSMContext):
+    catalog = catalogs.current
+    query = message.text.strip() if message.text else ""
+    found = await run_catalog_task(message.answer, find_perfumes, catalog, query,
+                                   key=(find_perfumes, catalog, normalize_query(query)))
+    if found is None:
+        return
+    results, fuzzy = found
+    if results.empty:
+        await message.answer("Ничего не найдено 😔\nПопробуй другой запрос:")
+        return
+
+    kb = InlineKeyboardMarkup(inline_keyboard=[])
+    for row in results:
+        kb.inline_keyboard.append([InlineKeyboardButton(text=f"{get_brand(row)} - {get_name(row)}", callback_data=f"partner_{row.name}_{catalog.catalog_id}")])
+    kb.inline_keyboard.append([InlineKeyboardButton(text="← Отмена", callback_data="back_main")])
+    text = "К какому аромату подобрать пару?"
+    if fuzzy:
+        text = "Точных совпадений нет — возможно, ты имел в виду:\n" + text
+    await message.answer(text, reply_markup=kb)
+
+@dp.callback_query(F.data.regexp(r"partner_\d+"))
+async def show_partners(callback: types.CallbackQuery, state: FSMContext):
+    catalog = catalogs.current
+    parts = callback.data.split("_")
+    pos = int(parts[1])
+    if pos >= len(catalog.store) or parts[2:] != [catalog.catalog_id]:
+        await callback.answer("Список устарел (база обновилась) — найди аромат заново", show_alert=True)
+        return
+    partners = await run_catalog_task(callback.message.answer, find_partners, catalog, pos)
+    if partners is None:
+        return
+    if not partners:
+        await callback.message.edit_text("Не удалось подобрать пары 😔", reply_markup=main_keyboard())
+        await state.clear()
+        return
+
+    chosen = catalog.store.row(pos)
+    text = f"🤝 **Лучшие пары для {get_brand(chosen)} - {get_name(chosen)}**\n\n"
+    text += "\n".join(f"{i}. {get_brand(p)} - {get_name(p)} — {compatibility}%" for i, (p, compatibility) in enumerate(partners, 1))
+    await callback.message.edit_text(text, reply_markup=main_keyboard())
+    await state.clear()
+
+# Inline-режим: подсказки названий по мере набора, сортировка по числу отзывов
+@dp.inline_query()
+async def inline_autocomplete(inline_query: types.InlineQuery):
+    catalog = catalogs.current
+    if catalog.autocomplete is None:  # индекс ещё строится
+        await inline_query.answer([], cache_time=0)
+        return
+    results = []
+    with metrics.timer("autocomplete"):
+        positions = catalog.autocomplete.complete(inline_query.query, limit=20).tolist()
+    for pos in positions:
+        row = catalog.store.row(pos)
+        name = f"{get_brand(row)} - {get_name(row)}"
+        accords = row.get("Main Accords", "")
+        results.append(InlineQueryResultArticle(
+            id=str(pos),
+            title=name,
+            description=accords[:100] if isinstance(accords, str) else None,
+            input_message_content=InputTextMessageContent(message_text=get_name(row)),
+        ))
+    await inline_query.answer(results, cache_time=60)
+
+# Перезагрузка базы без остановки бота (только для ADMIN_IDS)
+@dp.message(Command("reload"))
+async def reload_catalog(message: Message):
+    if message.from_user is None or message.from_user.id not in ADMIN_IDS:
+        return
+    await message.answer("⏳ Перезагружаю базу...")
+    if await catalogs.reload(f"/reload от {message.from_user.id}"):
+        await message.answer(f"✅ База обновлена: {len(catalogs.current.store)} ароматов")
+    else:
+        await message.answer("Не удалось перезагрузить базу (или перезагрузка уже идёт) — подробности в логе")
+
+# Битсеты для подбора пар, нечёткий индекс и автодополнение строятся заранее, чтобы первый запрос не упёрся
+# в таймаут. В том же пуле, что и запросы (его размер и очередь действуют и здесь); ошибка сборки
+# попадает в лог сразу, а не всплывает потом в первом запросе, которому индекс понадобился
+async def prebuild_indexes(catalog):
+    builds = (catalog.recommender, catalog.fuzzy_index, catalog.build_autocomplete)
+    results = await asyncio.gather(*(catalog_executor.run(build, timeout=PREBUILD_TIMEOUT) for build in builds),
+                                   return_exceptions=True)
+    for build, result in zip(builds, results):
+        if isinstance(result, asyncio.TimeoutError):
+            logging.warning(f"{build.__name__} не собран за {PREBUILD_TIMEOUT:.0f} с — соберётся на первом запросе")
+        elif isinstance(result, Exception):
+            logging.error(f"Не удалось заранее собрать {build.__name__}: {result}", exc_info=result)
+
 async def main():
     logging.basicConfig(level=logging.INFO)
-    await dp.start_polling(bot)
+    prebuild = asyncio.create_task(prebuild_indexes(catalogs.current))
+    catalogs.start(watch_interval=float(os.getenv("CATALOG_WATCH_INTERVAL", "0")))
+    # WEBHOOK_URL в .env — обновления через webhook (aiohttp-сервер), иначе long polling
+    webhook = WebhookServer.from_env(dp, bot, health=lambda: {
+        "catalog_size": len(catalogs.current.store),
+        "executor_pending": catalog_executor.pending,
+    })
+    if webhook is not None:
+        metrics.collect("webhook", webhook.stats)
+    await metrics.start()
+    try:
+        if webhook is not None:
+            await webhook.serve()
+        else:
+            await dp.start_polling(bot)
+    finally:
+        prebuild.cancel()
+        catalogs.stop()
+        await metrics.stop()
+        catalog_executor.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey
+
+from session_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=7, user_id=7)
+
+
+# Чтение во время записи пакета видит изменения из этого пакета, а не старую строку из базы
+def test_read_during_flush(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "fsm.sqlite3"), flush_interval=3600)
+        started, release = threading.Event(), threading.Event()
+        flush_batch = storage._flush_batch
+
+        def slow_flush_batch(connection, batch, expired_before):
+            started.set()
+            release.wait(5)
+            flush_batch(connection, batch, expired_before)
+
+        storage._flush_batch = slow_flush_batch
+        await storage.set_data(KEY, {"sel": [1]})
+        flush = asyncio.create_task(storage.flush())
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+
+        data = await storage.get_data(KEY)
+        await storage.update_data(KEY, {"x": 1})
+        release.set()
+        await flush
+        await storage.flush()
+        stored = await storage.get_data(KEY)
+        await storage.close()
+        return data, stored
+
+    data, stored = asyncio.run(scenario())
+    assert data == {"sel": [1]}
+    assert stored == {"sel": [1], "x": 1}
+
+
+# close во время записи пакета: старый пакет дописывается до финального flush, а не параллельно с ним
+def test_close_during_flush(tmp_path):
+    path = str(tmp_path / "fsm.sqlite3")
+
+    async def scenario():
+        storage = SQLiteStorage(path, flush_interval=0.01)
+        started, release = threading.Event(), threading.Event()
+        flush_batch = storage._flush_batch
+        calls = []
+
+        def slow_flush_batch(connection, batch, expired_before):
+            calls.append(batch)
+            if len(calls) == 1:
+                started.set()
+                release.wait(0.5)
+            flush_batch(connection, batch, expired_before)
+
+        storage._flush_batch = slow_flush_batch
+        await storage.set_data(KEY, {"v": "old"})
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        await storage.set_data(KEY, {"v": "new"})
+        await storage.close()
+
+    async def reopen():
+        storage = SQLiteStorage(path)
+        data = await storage.get_data(KEY)
+        await storage.close()
+        return data
+
+    asyncio.run(scenario())
+    assert asyncio.run(reopen()) == {"v": "new"}
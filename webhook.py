@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+from aiogram.types import Update
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# Приём обновлений от Telegram через webhook вместо long polling: aiohttp-сервер на host:port,
+# Telegram сам присылает обновления POST-запросами на url + path. Каждое обновление
+# обрабатывается отдельной задачей — ответ Telegram уходит сразу, а одновременно в работе не больше
+# max_concurrency обновлений (дальше ответ придерживается, и Telegram шлёт медленнее).
+# GET /healthz — проверка живости для балансировщика/оркестратора.
+# Остановка по SIGTERM/SIGINT: новые обновления получают 503 (Telegram повторит их позже),
+# начатые дорабатываются не дольше shutdown_timeout секунд.
+# feed — своя обработка обновления вместо dp.feed_update (bot_workers.py передаёт обновления воркерам)
+class WebhookServer:
+    def __init__(self, dp, bot, url: str, host: str = "0.0.0.0", port: int = 8080, path: str = "/webhook",
+                 secret: str = None, max_concurrency: int = 64, max_connections: int = 40,
+                 shutdown_timeout: float = 10.0, health=None, feed=None):
+        self.dp = dp
+        self.bot = bot
+        self.feed = feed  # async функция (update) -> None
+        self.url = url.rstrip("/") + path if url else None
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.max_connections = max_connections
+        self.shutdown_timeout = shutdown_timeout
+        self._health = health  # функция -> dict с подробностями для /healthz
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+        self._runner = None
+        self._closing = False
+        self._stop = asyncio.Event()
+        self.received = 0
+        self.handled = 0
+        self.failed = 0
+
+    # Настройки из .env: WEBHOOK_URL (внешний адрес; без него бот работает через polling),
+    # WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONCURRENCY,
+    # WEBHOOK_MAX_CONNECTIONS, WEBHOOK_SHUTDOWN_TIMEOUT. WEBHOOK_URL=local — сервер без set_webhook
+    # (Telegram настроен заранее или обновления шлёт фейковый API из bot_loadtest.py)
+    @classmethod
+    def from_env(cls, dp, bot, health=None, feed=None):
+        url = os.getenv("WEBHOOK_URL")
+        if not url:
+            return None
+        return cls(
+            dp, bot,
+            url=None if url == "local" else url,
+            host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", "8080")),
+            path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            secret=os.getenv("WEBHOOK_SECRET") or None,
+            max_concurrency=int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "64")),
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+            shutdown_timeout=float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "10")),
+            health=health,
+            feed=feed,
+        )
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def _handle_update(self, request: web.Request):
+        if self._closing:
+            return web.Response(status=503, text="shutting down")
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError as e:
+            logging.warning(f"Webhook: некорректное обновление: {e}")
+            return web.Response(status=400)
+
+        self.received += 1
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            if self.feed is not None:
+                await self.feed(update)
+            else:
+                await self.dp.feed_update(self.bot, update)
+            self.handled += 1
+        except Exception:
+            self.failed += 1
+            logging.exception(f"Webhook: ошибка обработки обновления {update.update_id}")
+        finally:
+            self._slots.release()
+
+    async def _handle_health(self, _request: web.Request):
+        body = {"status": "stopping" if self._closing else "ok", **self.stats()}
+        if self._health is not None:
+            body.update(self._health())
+        return web.Response(status=503 if self._closing else 200, text=json.dumps(body, ensure_ascii=False),
+                            content_type="application/json")
+
+    def stats(self) -> dict:
+        return {"received": self.received, "handled": self.handled, "failed": self.failed, "pending": self.pending}
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get("/healthz", self._handle_health)
+        self._runner = web.AppRunner(app, handle_signals=False)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Webhook: слушаю http://{self.host}:{self.port}{self.path}")
+
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp)
+        if self.url:
+            await self.bot.set_webhook(self.url, secret_token=self.secret, max_connections=self.max_connections,
+                                       allowed_updates=self.dp.resolve_used_update_types())
+            logging.info(f"Webhook: Telegram шлёт обновления на {self.url}")
+
+    def request_stop(self, reason: str = ""):
+        if not self._stop.is_set():
+            logging.info(f"Webhook: остановка {reason}".rstrip())
+            self._stop.set()
+
+    # Корректная остановка: сначала перестаём брать новые обновления, потом ждём начатые.
+    # Webhook в Telegram не удаляется — пока бот перезапускается, обновления копятся у Telegram
+    async def stop(self):
+        self._closing = True
+        if self._tasks:
+            logging.info(f"Webhook: дорабатываю {len(self._tasks)} обновлений")
+            started = time.monotonic()
+            _, unfinished = await asyncio.wait(set(self._tasks), timeout=self.shutdown_timeout)
+            if unfinished:
+                logging.warning(f"Webhook: за {time.monotonic() - started:.1f} с не завершились "
+                                f"{len(unfinished)} обновлений — отменяю")
+                for task in unfinished:
+                    task.cancel()
+                await asyncio.gather(*unfinished, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp)
+        await self.bot.session.close()
+        logging.info(f"Webhook: остановлен, обработано {self.handled}, ошибок {self.failed}")
+
+    # Работа до SIGTERM/SIGINT (или request_stop) с корректной остановкой
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        signals = [s for s in (getattr(signal, "SIGTERM", None), signal.SIGINT) if s is not None]
+        for sig in signals:
+            try:
+                loop.add_signal_handler(sig, self.request_stop, sig.name)
+            except NotImplementedError:  # Windows
+                pass
+        try:
+            await self.start()
+            await self._stop.wait()
+        finally:
+            for sig in signals:
+                try:
+                    loop.remove_signal_handler(sig)
+                except NotImplementedError:
+                    pass
+            await self.stop()